@@ -0,0 +1,68 @@
+"""Rendered-reply benchmark.
+
+Answers title searches against the local OMDb, shortener and Bot API stand-ins
+of loadtest.py, first cold (empty caches) and then warm, and reports reply
+latency and upstream calls per request for both.
+
+    python bench_replies.py --titles 50 --omdb-latency 0.15
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from loadtest import BOT_TOKEN, FakeUpstreams, build_catalog, percentile
+
+
+def measure(bot, upstreams, catalog):
+    latencies = []
+    calls_before = dict(upstreams.calls)
+    for n, item in enumerate(catalog):
+        message = SimpleNamespace(chat=SimpleNamespace(id=n + 1), message_id=1)
+        start = time.perf_counter()
+        bot.handle_search_title(message, item['Title'], item['Type'])
+        latencies.append(time.perf_counter() - start)
+    calls = {upstream: (count - calls_before.get(upstream, 0)) / len(catalog)
+             for upstream, count in sorted(upstreams.calls.items())}
+    return sorted(latencies), calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--titles', type=int, default=50, help='titles to search, each cold then warm (default: 50)')
+    parser.add_argument('--omdb-latency', type=float, default=0.15, help='mean OMDb latency in seconds (default: 0.15)')
+    parser.add_argument('--shortener-latency', type=float, default=0.1, help='mean shortener latency (default: 0.1)')
+    parser.add_argument('--telegram-latency', type=float, default=0.03, help='mean Bot API latency (default: 0.03)')
+    args = parser.parse_args()
+
+    catalog = build_catalog(args.titles)
+    upstreams = FakeUpstreams(catalog, latency={'omdb': args.omdb_latency, 'shortener': args.shortener_latency,
+                                                'telegram': args.telegram_latency}, error_rate={})
+    upstreams.start()
+    # Offline, like loadtest.py: only the stand-ins, in-memory state, no warm-up
+    os.environ.update({
+        'BOT_TOKEN': BOT_TOKEN, 'OMDB_API_KEY': 'bench', 'MDISK_API_KEY': 'bench',
+        'OMDB_API_URL': upstreams.url + '/omdb/', 'SHORTENER_API_URL': upstreams.url + '/shortener/api',
+        'TELEGRAM_API_URL': upstreams.url + '/bot{0}/{1}', 'STATE_BACKEND': 'memory', 'CACHE_BACKEND': 'memory',
+        'REDIS_URL': '', 'RENDER_API_KEY': '', 'RENDER_SERVICE_ID': '', 'WARMUP_ON_START': '0',
+        'UPDATE_WORKERS': '0', 'MAX_DAILY_REQUESTS': '10000000', 'OMDB_RATE_PER_SECOND': '100000',
+        'OMDB_BURST': '100000',
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(tempfile.mkdtemp(prefix='movizinfo-bench-'))
+    import movie_filter_bot
+    movie_filter_bot.ensure_initialized()
+
+    for label in ('Cold', 'Warm'):
+        latencies, calls = measure(movie_filter_bot, upstreams, catalog)
+        per_request = ', '.join(f"{upstream} {count:.2f}" for upstream, count in calls.items())
+        print(f"{label}: median {statistics.median(latencies) * 1000:.0f} ms, "
+              f"p95 {percentile(latencies, 0.95) * 1000:.0f} ms; upstream calls per request: {per_request}")
+    print(f"Rendered reply hits: {movie_filter_bot.bot_stats['rendered_reply_hits']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Startup benchmark.
+
+Imports the bot in fresh interpreters and reports the median time to import it,
+the part of that spent in the module itself, and the startup work
+(ensure_initialized) that LAZY_INIT defers to the first update.
+
+    python bench_startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+SNIPPET = """
+import json, time
+start = time.perf_counter()
+import movie_filter_bot
+imported = time.perf_counter() - start
+movie_filter_bot.ensure_initialized()
+print(json.dumps(dict(movie_filter_bot.startup_stats, total_import_seconds=imported)))
+"""
+
+
+def measure_startup(lazy=True, **env):
+    """Import the bot once in a fresh interpreter. Returns its startup_stats plus total_import_seconds."""
+    full_env = {key: value for key, value in os.environ.items() if key not in ('UPDATE_WORKERS', 'VERCEL')}
+    # Offline: no state files in the repo, no Redis, no warm-up calls to OMDb
+    full_env.update({'BOT_TOKEN': '123456:bench', 'LAZY_INIT': '1' if lazy else '0', 'STATE_BACKEND': 'memory',
+                     'CACHE_BACKEND': 'memory', 'WARMUP_ON_START': '0', 'UPDATE_WORKERS': '0', 'PYTHONPATH': REPO})
+    full_env.update(env)
+    with tempfile.TemporaryDirectory(prefix='movizinfo-startup-') as cwd:
+        result = subprocess.run([sys.executable, '-c', SNIPPET], cwd=cwd, env=full_env,
+                                capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters per mode (default: 10)')
+    args = parser.parse_args()
+
+    for lazy in (True, False):
+        runs = [measure_startup(lazy) for _ in range(args.runs)]
+        median = {key: statistics.median(run[key] for run in runs) * 1000 for key in runs[0]}
+        print(f"LAZY_INIT={int(lazy)}: import {median['total_import_seconds']:.0f} ms "
+              f"(module {median['import_seconds']:.1f} ms), startup work {median['init_seconds']:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
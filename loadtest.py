@@ -0,0 +1,341 @@
+"""Offline load test for movie_filter_bot.
+
+Starts local stand-ins for OMDb, the link shortener and the Telegram Bot API
+(with configurable latency and error rates), points the bot at them, then
+replays synthetic updates through the Flask webhook route and reports reply
+latency percentiles, upstream calls per update and throughput.
+
+    python loadtest.py --updates 1000 --concurrency 50 --omdb-latency 0.2
+
+Other bot settings can still be passed as environment variables, e.g.
+UPDATE_WORKERS=0 or ASYNC_UPDATES=1 python loadtest.py. Credentials, upstream
+URLs and the state and cache backends are always replaced with offline values,
+whatever the environment or .env says.
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_TOKEN = '123456:loadtest'
+ADJECTIVES = ['Silent', 'Broken', 'Golden', 'Dark', 'Lost', 'Final', 'Crimson', 'Hidden', 'Iron', 'Frozen',
+              'Wild', 'Last', 'Secret', 'Burning', 'Electric', 'Midnight', 'Distant', 'Savage', 'Quiet', 'Endless']
+NOUNS = ['River', 'Empire', 'Horizon', 'Witness', 'Garden', 'Signal', 'Kingdom', 'Stranger', 'Harbor', 'Machine',
+         'Frontier', 'Echo', 'Protocol', 'Shadow', 'Orchard', 'Verdict', 'Station', 'Tide', 'Legacy', 'Cipher']
+GENRES = ['Action', 'Comedy', 'Drama', 'Horror', 'Romance', 'Sci-Fi', 'Thriller']
+
+
+def build_catalog(size):
+    """Synthetic OMDb titles, every third one a series."""
+    catalog = []
+    for n in range(size):
+        media_type = 'series' if n % 3 == 0 else 'movie'
+        title = f"{ADJECTIVES[n % len(ADJECTIVES)]} {NOUNS[(n // len(ADJECTIVES)) % len(NOUNS)]}"
+        if n >= len(ADJECTIVES) * len(NOUNS):
+            title += f" {n // (len(ADJECTIVES) * len(NOUNS)) + 1}"
+        catalog.append({
+            'Title': title,
+            'Year': str(1980 + n % 45),
+            'Rated': 'PG-13',
+            'Released': '01 Jan 2001',
+            'Runtime': f"{90 + n % 60} min",
+            'Genre': ', '.join(GENRES[(n + k) % len(GENRES)] for k in range(2)),
+            'Director': f"Director {n % 50}",
+            'Writer': f"Writer {n % 70}",
+            'Actors': ', '.join(f"Actor {(n * 7 + k) % 300}" for k in range(3)),
+            'Plot': 'A synthetic title used for load testing.',
+            'Language': 'English',
+            'Country': 'USA',
+            'Awards': 'N/A',
+            'Poster': f"https://example.com/posters/{n}.jpg",
+            'imdbRating': f"{5 + (n % 50) / 10:.1f}",
+            'imdbID': f"tt{9000000 + n}",
+            'Type': media_type,
+            'totalSeasons': str(1 + n % 6) if media_type == 'series' else 'N/A',
+            'Response': 'True',
+        })
+    return catalog
+
+
+class FakeUpstreams:
+    """OMDb, shortener and Telegram stand-ins served from one local HTTP server."""
+
+    def __init__(self, catalog, latency, error_rate):
+        self.catalog = catalog
+        self.by_title = {item['Title'].lower(): item for item in catalog}
+        self.by_id = {item['imdbID']: item for item in catalog}
+        self.latency = latency  # upstream -> mean seconds
+        self.error_rate = error_rate  # upstream -> fraction of requests answered with a 500
+        self.calls = defaultdict(int)
+        self.lock = threading.Lock()
+        self.waiting = {}  # chat_id -> callback run on the next message sent to that chat
+        self.message_ids = iter(range(1, 1 << 62))
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handler_class(self):
+        upstreams = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.respond()
+
+            def do_POST(self):
+                self.respond()
+
+            def respond(self):
+                parsed = urllib.parse.urlsplit(self.path)
+                params = dict(urllib.parse.parse_qsl(parsed.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length).decode('utf-8', 'replace')
+                    if self.headers.get('Content-Type', '').startswith('application/json'):
+                        params.update(json.loads(body))
+                    else:
+                        params.update(urllib.parse.parse_qsl(body))
+                upstream = parsed.path.split('/')[1]
+                status, content_type, payload = upstreams.answer(upstream, parsed.path, params)
+                data = payload.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+    def answer(self, upstream, path, params):
+        if upstream.startswith('bot'):
+            upstream = 'telegram'
+        with self.lock:
+            self.calls[upstream] += 1
+        latency = self.latency.get(upstream, 0)
+        if latency:
+            time.sleep(random.uniform(0.5, 1.5) * latency)
+        if random.random() < self.error_rate.get(upstream, 0):
+            return 500, 'text/plain', 'stand-in error'
+        if upstream == 'omdb':
+            return 200, 'application/json', json.dumps(self.omdb(params))
+        if upstream == 'shortener':
+            return 200, 'text/plain', f"https://short.example/{abs(hash(params.get('url', ''))) % 10 ** 8}"
+        if upstream == 'telegram':
+            return 200, 'application/json', json.dumps(self.telegram(path.rsplit('/', 1)[-1], params))
+        return 404, 'text/plain', 'unknown upstream'
+
+    def omdb(self, params):
+        not_found = {'Response': 'False', 'Error': 'Movie not found!'}
+        if 'Season' in params:
+            item = self.by_id.get(params.get('i'))
+            season = int(params['Season'])
+            if item is None or item['Type'] != 'series' or season > int(item['totalSeasons']):
+                return not_found
+            episodes = [{'Title': f"Episode {e}", 'Released': '2001-01-01', 'Episode': str(e),
+                         'imdbRating': '7.5', 'imdbID': f"{item['imdbID']}{season:02d}{e:02d}"}
+                        for e in range(1, 9)]
+            return {'Title': item['Title'], 'Season': str(season), 'totalSeasons': item['totalSeasons'],
+                    'Episodes': episodes, 'Response': 'True'}
+        if 'i' in params:
+            return self.by_id.get(params['i'], not_found)
+        if 's' in params:
+            matches = [item for item in self.catalog
+                       if params['s'].lower() in item['Genre'].lower() and item['Type'] == params.get('type', item['Type'])]
+            if not matches:
+                return not_found
+            return {'Search': [{key: item[key] for key in ('Title', 'Year', 'imdbID', 'Type', 'Poster')}
+                               for item in matches[:10]],
+                    'totalResults': str(len(matches)), 'Response': 'True'}
+        item = self.by_title.get(params.get('t', '').lower())
+        if item is None or params.get('type', item['Type']) != item['Type']:
+            return not_found
+        return item
+
+    def telegram(self, method, params):
+        if method == 'getMe':
+            return {'ok': True, 'result': {'id': 123456, 'is_bot': True, 'first_name': 'Load', 'username': 'loadtest_bot'}}
+        if method in ('deleteMessage', 'deleteMessages', 'setWebhook', 'deleteWebhook'):
+            return {'ok': True, 'result': True}
+        chat_id = int(params.get('chat_id', 0))
+        if method.startswith('send'):
+            with self.lock:
+                callback = self.waiting.pop(chat_id, None)
+            if callback:
+                callback()
+        return {'ok': True, 'result': {'message_id': next(self.message_ids), 'date': int(time.time()),
+                                       'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', '')}}
+
+    def expect_reply(self, chat_id, callback):
+        with self.lock:
+            self.waiting[chat_id] = callback
+
+
+def make_query(catalog, rng, season_share, miss_share):
+    # Popularity roughly follows Zipf's law, as real search traffic does
+    item = catalog[min(int(rng.paretovariate(1.2)) - 1, len(catalog) - 1)]
+    roll = rng.random()
+    if roll < miss_share:
+        return f"Unknown Title {rng.randrange(10 ** 6)}"
+    if roll < miss_share + season_share and item['Type'] == 'series':
+        return f"{item['Title']} season {rng.randint(1, int(item['totalSeasons']))}"
+    return item['Title'].lower() if rng.random() < 0.3 else item['Title']
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def run(args):
+    random.seed(args.seed)
+    catalog = build_catalog(args.titles)
+    upstreams = FakeUpstreams(
+        catalog,
+        latency={'omdb': args.omdb_latency, 'shortener': args.shortener_latency, 'telegram': args.telegram_latency},
+        error_rate={'omdb': args.omdb_error_rate, 'shortener': args.shortener_error_rate,
+                    'telegram': args.telegram_error_rate},
+    )
+    upstreams.start()
+
+    # State files go to a scratch directory. The bot must only ever talk to the
+    # stand-ins, so credentials, upstream URLs and backends are forced; the
+    # bot's load_dotenv() never overrides a variable that is already set, so
+    # the real credentials are blanked rather than removed.
+    workdir = tempfile.mkdtemp(prefix='movizinfo-loadtest-')
+    os.environ.update({
+        'BOT_TOKEN': BOT_TOKEN,
+        'OMDB_API_KEY': 'loadtest',
+        'MDISK_API_KEY': 'loadtest',
+        'DEVELOPER_ID': '1',
+        'OMDB_API_URL': upstreams.url + '/omdb/',
+        'SHORTENER_API_URL': upstreams.url + '/shortener/api',
+        'TELEGRAM_API_URL': upstreams.url + '/bot{0}/{1}',
+        'STATE_BACKEND': 'memory',
+        'CACHE_BACKEND': 'memory',
+        'REDIS_URL': '',
+        'RENDER_API_KEY': '',
+        'RENDER_SERVICE_ID': '',
+    })
+    # Limits that would reject synthetic traffic are lifted unless set explicitly
+    for key, value in {
+        'MAX_DAILY_REQUESTS': '10000000',
+        'OMDB_RATE_PER_SECOND': '100000',
+        'OMDB_BURST': '100000',
+        'SEARCH_RATE_PER_MINUTE': '100000',
+        'SEARCH_CHAT_RATE_PER_MINUTE': '100000',
+        'SEARCH_DEBOUNCE_SECONDS': '0',
+        'WARMUP_ON_START': '0',
+    }.items():
+        os.environ.setdefault(key, value)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    import movie_filter_bot
+
+    latencies = []
+    timeouts = 0
+    rejected = 0
+    results_lock = threading.Lock()
+    update_ids = iter(range(1, 1 << 62))
+    counter_lock = threading.Lock()
+    remaining = [args.updates]
+
+    def virtual_user(index):
+        nonlocal timeouts, rejected
+        rng = random.Random(args.seed * 1000 + index)
+        client = movie_filter_bot.app.test_client()
+        chat_id = 10 ** 6 + index
+        while True:
+            with counter_lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+                update_id = next(update_ids)
+            text = '/help' if rng.random() < args.command_share else make_query(catalog, rng, args.season_share, args.miss_share)
+            update = {
+                'update_id': update_id,
+                'message': {
+                    'message_id': update_id,
+                    'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'from': {'id': chat_id, 'is_bot': False, 'first_name': f"User{index}"},
+                    'text': text,
+                },
+            }
+            replied = threading.Event()
+            upstreams.expect_reply(chat_id, replied.set)
+            start = time.perf_counter()
+            response = client.post('/' + BOT_TOKEN, data=json.dumps(update), content_type='application/json')
+            if response.status_code != 200:
+                with results_lock:
+                    rejected += 1
+                continue
+            if replied.wait(args.timeout):
+                with results_lock:
+                    latencies.append(time.perf_counter() - start)
+            else:
+                with results_lock:
+                    timeouts += 1
+
+    calls_before = dict(upstreams.calls)
+    # The bot logs every search; keep that out of the report unless asked for
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        started = time.perf_counter()
+        threads = [threading.Thread(target=virtual_user, args=(i,), daemon=True) for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    answered = len(latencies)
+    print(f"Updates: {args.updates} sent, {answered} answered, {timeouts} timed out, "
+          f"{rejected} rejected by the webhook in {elapsed:.2f}s ({answered / elapsed:.1f} replies/s)")
+    print(f"Reply latency: p50 {percentile(latencies, 0.50) * 1000:.0f} ms, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.0f} ms, p99 {percentile(latencies, 0.99) * 1000:.0f} ms, "
+          f"max {(latencies[-1] if latencies else 0) * 1000:.0f} ms")
+    calls = {upstream: count - calls_before.get(upstream, 0) for upstream, count in upstreams.calls.items()}
+    print("Upstream calls per update: " + ', '.join(
+        f"{upstream} {count / args.updates:.2f}" for upstream, count in sorted(calls.items())))
+    print(f"Threads: {threading.active_count()}, cache hit ratio: {movie_filter_bot.cache.hit_ratio():.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--updates', type=int, default=500, help='number of updates to send (default: 500)')
+    parser.add_argument('--concurrency', type=int, default=20, help='virtual users sending in parallel (default: 20)')
+    parser.add_argument('--titles', type=int, default=300, help='size of the synthetic catalog (default: 300)')
+    parser.add_argument('--season-share', type=float, default=0.2, help='share of season searches (default: 0.2)')
+    parser.add_argument('--miss-share', type=float, default=0.05, help='share of unknown titles (default: 0.05)')
+    parser.add_argument('--command-share', type=float, default=0.05, help='share of /help commands (default: 0.05)')
+    parser.add_argument('--omdb-latency', type=float, default=0.15, help='mean OMDb latency in seconds (default: 0.15)')
+    parser.add_argument('--shortener-latency', type=float, default=0.1, help='mean shortener latency (default: 0.1)')
+    parser.add_argument('--telegram-latency', type=float, default=0.03, help='mean Bot API latency (default: 0.03)')
+    parser.add_argument('--omdb-error-rate', type=float, default=0.0, help='share of OMDb requests failing with 500')
+    parser.add_argument('--shortener-error-rate', type=float, default=0.0, help='share of shortener requests failing')
+    parser.add_argument('--telegram-error-rate', type=float, default=0.0, help='share of Bot API requests failing')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for a reply (default: 30)')
+    parser.add_argument('--verbose', action='store_true', help="show the bot's own output")
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the update stream (default: 1)')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -3,73 +3,609 @@ from telebot import types
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 import time
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import os
+import hmac
+import uuid
+import atexit
 from datetime import datetime, timedelta
 import threading
+import heapq
+import asyncio
+import contextvars
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 import random
 import re
 import urllib.parse
-from collections import defaultdict
+import unicodedata
+import bisect
+import math
+import difflib
+from collections import defaultdict, OrderedDict
 import logging
+import sqlite3
 from dotenv import load_dotenv
 from flask import Flask, request
 
+try:
+    import redis
+except ImportError:
+    redis = None
+
+_module_started = time.perf_counter()
+
 # Load environment variables from .env file
 load_dotenv()
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
-bot = telebot.TeleBot(BOT_TOKEN)
+# Handlers run on our own update workers (see enqueue_update), not telebot's pool
+bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
 OMDB_API_KEY = os.getenv('OMDB_API_KEY')
 MDISK_API_KEY = os.getenv('MDISK_API_KEY')
-# To store user interaction timestamps and additional user information
-user_last_interaction = {}
+# Additional user information
 user_bios = {}  # Store user bios if applicable
 DEVELOPER_ID = os.getenv('DEVELOPER_ID')  # Replace with your Telegram user ID
 # Dictionary to store bot statistics
 bot_stats = defaultdict(int)
-# Global cache
-cache = defaultdict(lambda: None)
 # Track broadcast status
 broadcast_status = {}
-# Add this with your other global variables
-filtered_words = set()
-# Add this at the beginning of your script, with your other global variables
-recommendation_cache = {}
+# Message filter rules: chat id (as a string, '*' for every chat) -> {word: whole_word}
+filter_rules = {'*': {}}
 # Add these new variables
 API_REQUEST_COUNT = 0
 LAST_RESET_DATE = datetime.now().date()
-MAX_DAILY_REQUESTS = 1000
+MAX_DAILY_REQUESTS = int(os.getenv('MAX_DAILY_REQUESTS', '1000'))
+# Redis connection shared by every feature that can use it
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_KEY_PREFIX = os.getenv('REDIS_KEY_PREFIX', 'movizinfo:')
+# 'redis' shares quota, filters, conversations, users, chats and broadcasts
+# between every worker process and instance; 'memory' keeps them in process
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory').lower()
+_redis_client = None
+_redis_client_lock = threading.Lock()
 # Create Flask app
 app = Flask(__name__)
 
+# Startup work (loading saved state, opening stores, starting background
+# threads) is registered with on_startup and run once by ensure_initialized:
+# at the end of the import, or on the first update when LAZY_INIT=1 so a
+# serverless cold start doesn't pay for it before it can answer.
+LAZY_INIT = os.getenv('LAZY_INIT', '1' if os.getenv('VERCEL') else '0') == '1'
+startup_tasks = []  # (func, args) in registration order
+startup_stats = {}
+_initialized = False
+_startup_done = 0  # how many of startup_tasks have completed
+_init_lock = threading.Lock()
+
+def on_startup(func, *args):
+    startup_tasks.append((func, args))
+
+def start_daemon(target, *args):
+    threading.Thread(target=target, args=args, daemon=True).start()
+
+def ensure_initialized():
+    global _initialized, _startup_done
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        start = time.perf_counter()
+        # If a task raises, the next call retries it without re-running (and
+        # re-starting the threads of) the tasks that already completed
+        while _startup_done < len(startup_tasks):
+            func, args = startup_tasks[_startup_done]
+            func(*args)
+            _startup_done += 1
+        startup_stats['init_seconds'] = time.perf_counter() - start
+        _initialized = True
+
+_bot_user = None
+
+def get_bot_user():
+    """bot.get_me(), fetched once since the bot's own account doesn't change while it runs."""
+    global _bot_user
+    if _bot_user is None:
+        _bot_user = bot.get_me()
+    return _bot_user
+
 # Initialize group_ids and channel_ids from environment variables
 group_ids = json.loads(os.getenv('GROUP_IDS', '[]'))
 channel_ids = json.loads(os.getenv('CHANNEL_IDS', '[]'))
 
-def reset_api_counter():
+# Shared HTTP client. Every outbound call goes through http_request so
+# connections to each upstream are kept alive and reused.
+# (connect, read) timeouts and retry counts per upstream
+HTTP_TIMEOUTS = {
+    'omdb': (3, 10),
+    'shortener': (2, 3),
+    'render': (3, 10),
+}
+HTTP_RETRIES = {
+    'omdb': 2,
+    'shortener': 1,
+    'render': 2,
+}
+HTTP_BACKOFF_BASE = 0.3
+# Upstream endpoints, overridable so loadtest.py can point the bot at local stand-ins
+OMDB_API_URL = os.getenv('OMDB_API_URL', 'http://www.omdbapi.com/')
+SHORTENER_API_URL = os.getenv('SHORTENER_API_URL', 'https://mdiskshortner.link/api')
+if os.getenv('TELEGRAM_API_URL'):
+    telebot.apihelper.API_URL = os.getenv('TELEGRAM_API_URL')
+HTTP_BACKOFF_MAX = 3
+http_session = requests.Session()
+_http_adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+http_session.mount('http://', _http_adapter)
+http_session.mount('https://', _http_adapter)
+# upstream -> calls, errors, retries, total_seconds, max_seconds
+upstream_stats = defaultdict(lambda: defaultdict(float))
+upstream_stats_lock = threading.Lock()
+
+def record_upstream_call(upstream, elapsed, failed=False):
+    with upstream_stats_lock:
+        stats = upstream_stats[upstream]
+        stats['calls'] += 1
+        stats['total_seconds'] += elapsed
+        stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+        if failed:
+            stats['errors'] += 1
+    observe_latency('upstream_request_seconds', elapsed, upstream=upstream)
+
+# Latency histograms exported on /metrics and summarised in /stats.
+# Bucket bounds are in seconds, as Prometheus expects.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_PREFIX = 'movizinfo_'
+# /metrics needs METRICS_TOKEN as a bearer token; without one it is disabled
+# unless METRICS_PUBLIC=1 (e.g. when only a private network can reach the app)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_PUBLIC = os.getenv('METRICS_PUBLIC', '0') == '1'
+latency_histograms = {}  # (name, ((label, value), ...)) -> Histogram
+latency_histograms_lock = threading.Lock()
+
+class Histogram:
+    """Latency histogram with fixed bucket bounds, like a Prometheus histogram."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate the q-th quantile by interpolating inside its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, n in zip(self.buckets, self.counts):
+            if n and seen + n >= rank:
+                return lower + (bound - lower) * (rank - seen) / n
+            seen += n
+            lower = bound
+        return self.buckets[-1]
+
+def observe_latency(name, seconds, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with latency_histograms_lock:
+        histogram = latency_histograms.get(key)
+        if histogram is None:
+            histogram = latency_histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+def send_telegram_request(method, url, **kwargs):
+    """Request sender for telebot so Bot API calls reuse the shared session and are timed."""
+    start = time.monotonic()
+    try:
+        response = http_session.request(method, url, **kwargs)
+    except (requests.ConnectionError, requests.Timeout):
+        record_upstream_call('telegram', time.monotonic() - start, failed=True)
+        raise
+    # getUpdates long-polls for up to 30s, which would drown out every other call
+    if not url.endswith('/getUpdates'):
+        record_upstream_call('telegram', time.monotonic() - start, failed=response.status_code >= 500)
+    return response
+
+telebot.apihelper.CUSTOM_REQUEST_SENDER = send_telegram_request
+
+def http_request(upstream, method, url, timeout=None, retries=None, priority='lookup', **kwargs):
+    """Send a request on the shared session, retrying timeouts, connection errors and 5xx
+    responses with exponential backoff and full jitter. The last error is re-raised.
+
+    Every OMDb attempt, retries included, is charged to the daily quota first and
+    QuotaExceeded is raised once the quota for the given priority is used up."""
+    timeout = timeout or HTTP_TIMEOUTS[upstream]
+    retries = HTTP_RETRIES[upstream] if retries is None else retries
+    for attempt in range(retries + 1):
+        if attempt:
+            with upstream_stats_lock:
+                upstream_stats[upstream]['retries'] += 1
+            time.sleep(random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt)))
+        if upstream == 'omdb':
+            acquire_api_call(priority)
+        start = time.monotonic()
+        try:
+            response = http_session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            record_upstream_call(upstream, time.monotonic() - start, failed=True)
+            if attempt == retries:
+                raise
+            continue
+        record_upstream_call(upstream, time.monotonic() - start, failed=response.status_code >= 500)
+        if response.status_code < 500 or attempt == retries:
+            return response
+
+def http_get(upstream, url, **kwargs):
+    return http_request(upstream, 'GET', url, **kwargs)
+
+class TokenBucket:
+    """Thread-safe token bucket: refills at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def pause(self, seconds):
+        """Hand out no tokens for the next `seconds`, then start refilling from empty."""
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self.paused_until:
+                self.paused_until = until
+                self.tokens = 0
+                self.updated = until
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available. Returns 0 on success, otherwise the seconds until they will be."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now + tokens / self.rate
+            self._refill(now)
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, timeout=None, tokens=1):
+        """Block until tokens are available. Returns False if that would take longer than timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_time = self.try_acquire(tokens)
+            if not wait_time:
+                return True
+            if deadline is not None and time.monotonic() + wait_time > deadline:
+                return False
+            time.sleep(wait_time)
+
+    def release(self, tokens=1):
+        """Give back tokens taken for work that didn't happen."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+    async def acquire_async(self, timeout=None, tokens=1):
+        """acquire() for coroutines: waits on the event loop instead of blocking it."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_time = self.try_acquire(tokens)
+            if not wait_time:
+                return True
+            if deadline is not None and time.monotonic() + wait_time > deadline:
+                return False
+            await asyncio.sleep(wait_time)
+
+class QuotaExceeded(requests.RequestException):
+    pass
+
+class MemoryState:
+    """Process-local key/value state with optional expiry. Values must be JSON-serialisable."""
+
+    name = 'memory'
+    shared = False
+
+    def __init__(self):
+        self._data = {}  # key -> (value, expires_at or None)
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.time():
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._live(key)
+            return default if item is None else item[0]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        """Set key only if it doesn't exist. Returns True if it was set."""
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._live(key)
+            self._data.pop(key, None)
+            return default if item is None else item[0]
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._lock:
+            item = self._live(key)
+            value = (item[0] if item else 0) + amount
+            self._data[key] = (value, item[1] if item else (time.time() + ttl if ttl else None))
+            return value
+
+    def refresh(self, key, value, ttl=None):
+        """Reset the expiry of key only while it still holds value. Returns True if it did."""
+        with self._lock:
+            item = self._live(key)
+            if item is None or item[0] != value:
+                return False
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            return True
+
+    def release(self, key, value):
+        """Delete key only while it still holds value."""
+        with self._lock:
+            item = self._live(key)
+            if item is not None and item[0] == value:
+                del self._data[key]
+
+class RedisState:
+    """The same interface as MemoryState, shared through Redis."""
+
+    name = 'redis'
+    shared = True
+
+    def __init__(self, client, prefix=REDIS_KEY_PREFIX):
+        self.client = client
+        self.prefix = prefix + 'state:'
+
+    def get(self, key, default=None):
+        value = self.client.get(self.prefix + key)
+        return default if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(self.prefix + key, json.dumps(value), ex=ttl, nx=True))
+
+    def pop(self, key, default=None):
+        pipe = self.client.pipeline()
+        pipe.get(self.prefix + key)
+        pipe.delete(self.prefix + key)
+        value = pipe.execute()[0]
+        return default if value is None else json.loads(value)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key, amount=1, ttl=None):
+        pipe = self.client.pipeline()
+        pipe.incrby(self.prefix + key, amount)
+        if ttl:
+            pipe.expire(self.prefix + key, ttl)
+        return pipe.execute()[0]
+
+    def _if_value(self, key, value, update):
+        # WATCH makes the check and the update one step; a concurrent write aborts it
+        name = self.prefix + key
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(name)
+                current = pipe.get(name)
+                if current is None or json.loads(current) != value:
+                    return False
+                pipe.multi()
+                update(pipe, name)
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def refresh(self, key, value, ttl=None):
+        return self._if_value(key, value, lambda pipe, name: pipe.set(name, json.dumps(value), ex=ttl))
+
+    def release(self, key, value):
+        self._if_value(key, value, lambda pipe, name: pipe.delete(name))
+
+shared_state = MemoryState()
+
+def init_shared_state():
+    global shared_state
+    if STATE_BACKEND != 'redis':
+        return
+    try:
+        shared_state = RedisState(get_redis_client())
+    except Exception as e:
+        print(f"Could not use Redis for shared state: {e}. Keeping state in process.")
+
+on_startup(init_shared_state)
+
+# OMDb quota. Every request to OMDb is counted here, the count is persisted so
+# restarts don't reset it, and the last OMDB_RESERVED_FOR_LOOKUPS requests of
+# the day are kept for title lookups rather than recommendations. The count is
+# written behind every few seconds and at exit; with a shared STATE_BACKEND
+# the shared counter is authoritative and the file isn't used.
+API_USAGE_FILE = os.getenv('API_USAGE_FILE', 'api_usage.json')
+API_USAGE_SAVE_INTERVAL = 5
+OMDB_RESERVED_FOR_LOOKUPS = int(os.getenv('OMDB_RESERVED_FOR_LOOKUPS', '200'))
+OMDB_RATE_PER_SECOND = float(os.getenv('OMDB_RATE_PER_SECOND', '5'))
+OMDB_BURST = int(os.getenv('OMDB_BURST', '10'))
+# How long a request may wait for a rate limiter token, by priority
+OMDB_RATE_WAIT = {'lookup': 5, 'recommendation': 1, 'warmup': 1}
+api_counter_lock = threading.Lock()
+api_counter_dirty = False
+warmup_calls_today = 0  # OMDb calls made by warm-ups today, without shared state
+omdb_bucket = TokenBucket(OMDB_RATE_PER_SECOND, OMDB_BURST)
+
+def load_api_counter():
     global API_REQUEST_COUNT, LAST_RESET_DATE
-    current_date = datetime.now().date()
-    if current_date > LAST_RESET_DATE:
-        API_REQUEST_COUNT = 0
-        LAST_RESET_DATE = current_date
+    if shared_state.shared:
+        return
+    try:
+        with open(API_USAGE_FILE, 'r') as f:
+            usage = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+    global warmup_calls_today
+    if usage.get('date') == LAST_RESET_DATE.isoformat():
+        API_REQUEST_COUNT = usage.get('count', 0)
+        warmup_calls_today = usage.get('warmup', 0)
+
+def write_json_atomic(path, data):
+    # Write to a temp file first so a crash never leaves a truncated file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+def save_api_counter():
+    global api_counter_dirty
+    with api_counter_lock:
+        if not api_counter_dirty or shared_state.shared:
+            return
+        usage = {'date': LAST_RESET_DATE.isoformat(), 'count': API_REQUEST_COUNT, 'warmup': warmup_calls_today}
+        api_counter_dirty = False
+    try:
+        write_json_atomic(API_USAGE_FILE, usage)
+    except OSError as e:
+        print(f"Error saving API usage: {e}")
+
+def api_counter_saver():
+    while True:
+        time.sleep(API_USAGE_SAVE_INTERVAL)
+        save_api_counter()
 
-def increment_api_counter():
-    global API_REQUEST_COUNT
-    API_REQUEST_COUNT += 1
+def api_counter_key():
+    return f"omdb_calls:{LAST_RESET_DATE.isoformat()}"
 
-def check_api_limit():
+def warmup_counter_key():
+    return f"omdb_warmup_calls:{LAST_RESET_DATE.isoformat()}"
+
+def reset_api_counter():
+    global API_REQUEST_COUNT, LAST_RESET_DATE, warmup_calls_today
+    with api_counter_lock:
+        current_date = datetime.now().date()
+        if current_date > LAST_RESET_DATE:
+            API_REQUEST_COUNT = 0
+            warmup_calls_today = 0
+            LAST_RESET_DATE = current_date
+        if shared_state.shared:
+            API_REQUEST_COUNT = shared_state.get(api_counter_key(), 0)
+
+def daily_limit_for(priority):
+    if priority == 'lookup':
+        return MAX_DAILY_REQUESTS
+    return MAX_DAILY_REQUESTS - OMDB_RESERVED_FOR_LOOKUPS
+
+def warmup_calls_used():
+    if shared_state.shared:
+        return shared_state.get(warmup_counter_key(), 0)
+    return warmup_calls_today
+
+def warmup_call_cap():
+    # Warm-ups share WARMUP_QUOTA_BUDGET per day across restarts and workers,
+    # and a run may only count up to the limit it set when it started
+    return min(WARMUP_QUOTA_BUDGET, warmup_call_limit)
+
+def increment_api_counter(priority='lookup'):
+    """Atomically count one OMDb request. Returns False if the quota for this priority is used up."""
+    global API_REQUEST_COUNT, api_counter_dirty, warmup_calls_today
+    reset_api_counter()
+    if shared_state.shared:
+        # Count first and give the call back if that went over the limit, so
+        # concurrent workers can never spend more than the quota between them
+        key = api_counter_key()
+        count = shared_state.incr(key, ttl=2 * 86400)
+        if count > daily_limit_for(priority):
+            API_REQUEST_COUNT = shared_state.incr(key, -1)
+            return False
+        if priority == 'warmup' and shared_state.incr(warmup_counter_key(), ttl=2 * 86400) > warmup_call_cap():
+            shared_state.incr(warmup_counter_key(), -1)
+            API_REQUEST_COUNT = shared_state.incr(key, -1)
+            return False
+        API_REQUEST_COUNT = count
+        return True
+    with api_counter_lock:
+        if API_REQUEST_COUNT >= daily_limit_for(priority):
+            return False
+        if priority == 'warmup':
+            if warmup_calls_today >= warmup_call_cap():
+                return False
+            warmup_calls_today += 1
+        API_REQUEST_COUNT += 1
+        api_counter_dirty = True
+        return True
+
+def acquire_api_call(priority='lookup'):
+    if not omdb_bucket.acquire(timeout=OMDB_RATE_WAIT.get(priority, 1)):
+        rate_limited_api_call()
+    count_api_call(priority)
+
+async def acquire_api_call_async(priority='lookup'):
+    if not await omdb_bucket.acquire_async(timeout=OMDB_RATE_WAIT.get(priority, 1)):
+        rate_limited_api_call()
+    count_api_call(priority)
+
+def rate_limited_api_call():
+    bot_stats['rate_limited_api_calls'] += 1
+    raise QuotaExceeded('OMDb rate limit reached. Please try again in a moment.')
+
+def count_api_call(priority):
+    if not increment_api_counter(priority):
+        bot_stats['quota_rejected_api_calls'] += 1
+        raise QuotaExceeded('Daily API limit reached. Please try again tomorrow.')
+
+def check_api_limit(priority='lookup'):
     reset_api_counter()  # Ensure the counter is reset if it's a new day
-    return API_REQUEST_COUNT < MAX_DAILY_REQUESTS
+    if priority == 'warmup' and warmup_calls_used() >= warmup_call_cap():
+        return False
+    return API_REQUEST_COUNT < daily_limit_for(priority)
 
-# Modify your API request functions to use these new functions
-def invoke_rest_method(url, params=None):
-    if not check_api_limit():
+def remaining_api_calls():
+    reset_api_counter()
+    return max(0, MAX_DAILY_REQUESTS - API_REQUEST_COUNT)
+
+on_startup(load_api_counter)
+on_startup(start_daemon, api_counter_saver)
+on_startup(atexit.register, save_api_counter)
+
+def invoke_rest_method(url, params=None, priority='lookup'):
+    if not check_api_limit(priority):
         return {'Response': 'False', 'Error': 'Daily API limit reached. Please try again tomorrow.'}
     
     try:
-        response = requests.get(url, params=params, timeout=60)
-        increment_api_counter()
+        response = http_get('omdb', url, params=params, priority=priority)
 
         if response.status_code == 200:
             data = response.json()
@@ -87,6 +623,18 @@ RENDER_API_KEY = os.getenv('RENDER_API_KEY')
 RENDER_SERVICE_ID = os.getenv('RENDER_SERVICE_ID')
 RENDER_API_URL = f"https://api.render.com/v1/services/{RENDER_SERVICE_ID}/env-vars"
 
+def get_redis_client():
+    """Return the shared Redis client, connecting on first use. Raises if Redis is unavailable."""
+    global _redis_client
+    if redis is None:
+        raise RuntimeError("the redis package is not installed")
+    with _redis_client_lock:
+        if _redis_client is None:
+            client = redis.Redis.from_url(REDIS_URL, socket_timeout=2, socket_connect_timeout=2)
+            client.ping()
+            _redis_client = client
+        return _redis_client
+
 def save_ids():
     global group_ids, channel_ids
     
@@ -101,7 +649,11 @@ def save_ids():
     ]
     
     for var in env_vars:
-        response = requests.post(RENDER_API_URL, headers=headers, json=var)
+        try:
+            response = http_request('render', 'POST', RENDER_API_URL, headers=headers, json=var)
+        except requests.RequestException as e:
+            print(f"Failed to update {var['key']}: {e}")
+            continue
         if response.status_code != 200:
             print(f"Failed to update {var['key']}: {response.text}")
         else:
@@ -111,91 +663,1020 @@ def save_ids():
     os.environ['GROUP_IDS'] = json.dumps(group_ids)
     os.environ['CHANNEL_IDS'] = json.dumps(channel_ids)
 
+# Chat registry. Membership is checked against an in-memory set so registering
+# a chat never blocks message handling; new or removed ids are written behind
+# in batches to CHAT_IDS_FILE (and Redis or the Render env vars if configured).
+# Redis gets each change as SADD/SREM rather than this worker's whole list, so
+# workers never overwrite chats the others have registered.
+CHAT_IDS_FILE = os.getenv('CHAT_IDS_FILE', 'ids.json')
+CHAT_REGISTRY_BACKEND = os.getenv('CHAT_REGISTRY_BACKEND', 'redis' if STATE_BACKEND == 'redis' else 'file').lower()
+CHAT_IDS_FLUSH_INTERVAL = 5
+known_chat_ids = set()
+chat_ids_lock = threading.Lock()
+chat_ids_dirty = threading.Event()
+pending_chat_changes = []  # (SADD or SREM, set name, chat id) not yet written to Redis
+
 def load_ids():
     global group_ids, channel_ids
-    group_ids = json.loads(os.getenv('GROUP_IDS', '[]'))
-    channel_ids = json.loads(os.getenv('CHANNEL_IDS', '[]'))
+    groups = json.loads(os.getenv('GROUP_IDS', '[]'))
+    channels = json.loads(os.getenv('CHANNEL_IDS', '[]'))
+    try:
+        with open(CHAT_IDS_FILE, 'r') as f:
+            saved = json.load(f)
+        groups += saved.get('group_ids', [])
+        channels += saved.get('channel_ids', [])
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    if CHAT_REGISTRY_BACKEND == 'redis':
+        try:
+            client = get_redis_client()
+            # Chats from the env vars or file may predate the shared sets
+            pipe = client.pipeline()
+            for key, ids in (('group_ids', groups), ('channel_ids', channels)):
+                if ids:
+                    pipe.sadd(REDIS_KEY_PREFIX + key, *ids)
+            pipe.execute()
+            groups += [int(i) for i in client.smembers(REDIS_KEY_PREFIX + 'group_ids')]
+            channels += [int(i) for i in client.smembers(REDIS_KEY_PREFIX + 'channel_ids')]
+        except Exception as e:
+            print(f"Could not load chat ids from Redis: {e}")
+    with chat_ids_lock:
+        group_ids = list(dict.fromkeys(groups))
+        channel_ids = list(dict.fromkeys(channels))
+        known_chat_ids.clear()
+        known_chat_ids.update(group_ids, channel_ids)
+
+def register_chat(chat_id, chat_type):
+    """Start tracking a group or channel. Returns True if it wasn't tracked yet."""
+    if chat_id in known_chat_ids or chat_type not in ('channel', 'group', 'supergroup'):
+        return False
+    with chat_ids_lock:
+        if chat_id in known_chat_ids:
+            return False
+        known_chat_ids.add(chat_id)
+        (channel_ids if chat_type == 'channel' else group_ids).append(chat_id)
+        pending_chat_changes.append(('sadd', 'channel_ids' if chat_type == 'channel' else 'group_ids', chat_id))
+    chat_ids_dirty.set()
+    return True
+
+def unregister_chat(chat_id):
+    with chat_ids_lock:
+        if chat_id not in known_chat_ids:
+            return
+        known_chat_ids.discard(chat_id)
+        if chat_id in channel_ids:
+            channel_ids.remove(chat_id)
+        if chat_id in group_ids:
+            group_ids.remove(chat_id)
+        # Another worker may have it in the other set
+        pending_chat_changes.extend([('srem', 'channel_ids', chat_id), ('srem', 'group_ids', chat_id)])
+    chat_ids_dirty.set()
+
+def write_chat_changes():
+    """Apply the pending registrations and removals to the shared Redis sets."""
+    with chat_ids_lock:
+        changes = pending_chat_changes[:]
+        pending_chat_changes.clear()
+    if CHAT_REGISTRY_BACKEND != 'redis' or not changes:
+        return
+    try:
+        pipe = get_redis_client().pipeline()
+        for command, key, chat_id in changes:
+            getattr(pipe, command)(REDIS_KEY_PREFIX + key, chat_id)
+        pipe.execute()
+    except Exception as e:
+        print(f"Error saving chat ids to Redis: {e}")
+        # Keep them, in order, for the next flush
+        with chat_ids_lock:
+            pending_chat_changes[:0] = changes
+        chat_ids_dirty.set()
+
+def tracked_chats():
+    """Return (channel ids, group ids). With the Redis registry this reads the
+    shared sets, so it includes chats registered by other workers."""
+    if CHAT_REGISTRY_BACKEND == 'redis':
+        write_chat_changes()
+        try:
+            client = get_redis_client()
+            return (sorted(int(i) for i in client.smembers(REDIS_KEY_PREFIX + 'channel_ids')),
+                    sorted(int(i) for i in client.smembers(REDIS_KEY_PREFIX + 'group_ids')))
+        except Exception as e:
+            print(f"Could not load chat ids from Redis: {e}")
+    with chat_ids_lock:
+        return list(channel_ids), list(group_ids)
+
+def flush_chat_ids():
+    chat_ids_dirty.clear()
+    with chat_ids_lock:
+        groups, channels = list(group_ids), list(channel_ids)
+    try:
+        write_json_atomic(CHAT_IDS_FILE, {'group_ids': groups, 'channel_ids': channels})
+    except OSError as e:
+        print(f"Error saving chat ids: {e}")
+    write_chat_changes()
+    if RENDER_API_KEY and RENDER_SERVICE_ID:
+        save_ids()
 
-load_ids()
+def chat_ids_writer():
+    while True:
+        chat_ids_dirty.wait()
+        # Collect whatever else arrives in the next few seconds into one write
+        time.sleep(CHAT_IDS_FLUSH_INTERVAL)
+        flush_chat_ids()
 
-# Update these functions to use the new save_ids() function
+on_startup(load_ids)
+on_startup(start_daemon, chat_ids_writer)
+
+@bot.my_chat_member_handler()
 def handle_my_chat_member(message):
     if message.new_chat_member.status in ['member', 'administrator']:
-        chat_id = message.chat.id
-        chat_type = message.chat.type
-        
-        if chat_type == 'channel' and chat_id not in channel_ids:
-            channel_ids.append(chat_id)
-            save_ids()
-            print(f"Bot added to channel. Channel ID {chat_id} saved.")
-        elif chat_type in ['group','supergroup'] and chat_id not in group_ids:
-            group_ids.append(chat_id)
-            save_ids()
-            print(f"Bot added to group. Group ID {chat_id} saved.")
+        if register_chat(message.chat.id, message.chat.type):
+            print(f"Bot added to {message.chat.type}. Chat ID {message.chat.id} saved.")
+    elif message.new_chat_member.status in ['left', 'kicked']:
+        unregister_chat(message.chat.id)
 
 def handle_new_message(message):
-    chat_id = message.chat.id
-    chat_type = message.chat.type
-    
-    if chat_type == 'channel' and chat_id not in channel_ids:
-        channel_ids.append(chat_id)
-        save_ids()
-        print(f"New message from untracked channel. Channel ID {chat_id} saved.")
-    elif chat_type in ['group','supergroup'] and chat_id not in group_ids:
-        group_ids.append(chat_id)
-        save_ids()
-        print(f"New message from untracked group. Group ID {chat_id} saved.")
-        
-def invoke_rest_method(url, params=None):
+    if register_chat(message.chat.id, message.chat.type):
+        print(f"New message from untracked {message.chat.type}. Chat ID {message.chat.id} saved.")
+
+# Cache limits and per-namespace TTLs (in seconds). The namespace is the part of
+# the key before the first ':' e.g. "movie:Inception" -> "movie".
+CACHE_MAX_ITEMS = int(os.getenv('CACHE_MAX_ITEMS', '5000'))
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(20 * 1024 * 1024)))
+CACHE_SWEEP_INTERVAL = int(os.getenv('CACHE_SWEEP_INTERVAL', '300'))
+# Cache backend: 'memory' (per process), 'sqlite' (survives restarts) or
+# 'redis' (shared by every worker and instance)
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory').lower()
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', 'cache.db')
+CACHE_DEFAULT_TTL = 3600
+CACHE_TTLS = {
+    'movie': 3600,
+    'series': 3600,
+    'season': 6 * 3600,
+    'recommendations': 24 * 3600,
+    'genre': 24 * 3600,
+    'reply': 3600,
+}
+# How long "not found" answers from OMDb are remembered
+NEGATIVE_CACHE_TTL = int(os.getenv('NEGATIVE_CACHE_TTL', '600'))
+
+class CacheBackend:
+    """Common TTL and hit/miss bookkeeping shared by every cache backend.
+
+    Backends implement get(key, max_age), set(key, value, ttl), delete(key),
+    clear(), sweep(), __len__ and describe(). Values must be JSON-serialisable.
+    """
+
+    name = 'base'
+
+    def __init__(self, ttls=None, default_ttl=CACHE_DEFAULT_TTL):
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.stats = defaultdict(int)
+
+    def ttl_for(self, key):
+        return self.ttls.get(key.split(':', 1)[0], self.default_ttl)
+
+    def hit_ratio(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def sweep(self):
+        return 0
+
+    def describe(self):
+        return f"{self.name}, {len(self)} items"
+
+class LRUCache(CacheBackend):
+    """Thread-safe in-process LRU cache bounded by item count and approximate byte size."""
+
+    name = 'memory'
+
+    def __init__(self, max_items, max_bytes, ttls=None, default_ttl=CACHE_DEFAULT_TTL):
+        super().__init__(ttls, default_ttl)
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._data = OrderedDict()  # key -> (value, stored_at, expires_at, size)
+        self._lock = threading.RLock()
+
+    def _estimate_size(self, key, value):
+        try:
+            return len(key) + len(json.dumps(value, default=str))
+        except (TypeError, ValueError):
+            return len(key) + len(repr(value))
+
+    def _remove(self, key):
+        size = self._data.pop(key)[3]
+        self.size_bytes -= size
+
+    def get(self, key, max_age=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            value, stored_at, expires_at, _ = entry
+            now = time.time()
+            # max_age lets callers ask for fresher data than the namespace TTL
+            if now >= expires_at or (max_age is not None and now - stored_at >= max_age):
+                self._remove(key)
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._data.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        size = self._estimate_size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            now = time.time()
+            self._data[key] = (value, now, now + (ttl if ttl is not None else self.ttl_for(key)), size)
+            self.size_bytes += size
+            self.stats['sets'] += 1
+            while self._data and (len(self._data) > self.max_items or self.size_bytes > self.max_bytes):
+                self._remove(next(iter(self._data)))
+                self.stats['evictions'] += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            count = len(self._data)
+            self._data.clear()
+            self.size_bytes = 0
+            return count
+
+    def sweep(self):
+        """Drop every expired entry and return how many were removed."""
+        now = time.time()
+        with self._lock:
+            expired = [k for k, entry in self._data.items() if now >= entry[2]]
+            for key in expired:
+                self._remove(key)
+            self.stats['expired'] += len(expired)
+            return len(expired)
+
+    def describe(self):
+        return (f"{self.name}, {len(self)}/{self.max_items} items, "
+                f"{self.size_bytes // 1024}/{self.max_bytes // 1024} KB")
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+class SQLiteCache(CacheBackend):
+    """On-disk cache that keeps warm data across restarts, evicting least recently used rows."""
+
+    name = 'sqlite'
+
+    def __init__(self, path, max_items, ttls=None, default_ttl=CACHE_DEFAULT_TTL):
+        super().__init__(ttls, default_ttl)
+        self.path = path
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+            'stored_at REAL NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)')
+        self._conn.commit()
+
+    def get(self, key, max_age=None):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, stored_at, expires_at FROM cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            value, stored_at, expires_at = row
+            if now >= expires_at or (max_age is not None and now - stored_at >= max_age):
+                self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+                self._conn.commit()
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._conn.execute('UPDATE cache SET accessed_at = ? WHERE key = ?', (now, key))
+            self._conn.commit()
+            self.stats['hits'] += 1
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.ttl_for(key))
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, stored_at, expires_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, json.dumps(value), now, expires_at, now)
+            )
+            self.stats['sets'] += 1
+            overflow = self._conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.max_items
+            if overflow > 0:
+                self._conn.execute(
+                    'DELETE FROM cache WHERE key IN '
+                    '(SELECT key FROM cache ORDER BY accessed_at LIMIT ?)', (overflow,)
+                )
+                self.stats['evictions'] += overflow
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            count = self._conn.execute('DELETE FROM cache').rowcount
+            self._conn.commit()
+            return count
+
+    def sweep(self):
+        with self._lock:
+            removed = self._conn.execute('DELETE FROM cache WHERE expires_at <= ?', (time.time(),)).rowcount
+            self._conn.commit()
+        self.stats['expired'] += removed
+        return removed
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+class RedisCache(CacheBackend):
+    """Cache shared by every worker and instance. Redis handles expiry itself and
+    should be configured with an LRU maxmemory-policy to bound its size."""
+
+    name = 'redis'
+
+    def __init__(self, client, prefix=REDIS_KEY_PREFIX, ttls=None, default_ttl=CACHE_DEFAULT_TTL):
+        super().__init__(ttls, default_ttl)
+        self.client = client
+        # Its own namespace, so clear() and len() never touch the shared state
+        self.prefix = prefix + 'cache:'
+
+    def get(self, key, max_age=None):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.stats['misses'] += 1
+            return None
+        entry = json.loads(raw)
+        if max_age is not None and time.time() - entry['t'] >= max_age:
+            self.stats['expired'] += 1
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return entry['v']
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl_for(key)
+        self.client.set(self.prefix + key, json.dumps({'v': value, 't': time.time()}), ex=max(1, int(ttl)))
+        self.stats['sets'] += 1
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def _keys(self):
+        return self.client.scan_iter(match=self.prefix + '*', count=500)
+
+    def clear(self):
+        count = 0
+        for key in self._keys():
+            count += self.client.delete(key)
+        return count
+
+    def __len__(self):
+        return sum(1 for _ in self._keys())
+
+def create_cache(backend=CACHE_BACKEND):
+    if backend == 'redis':
+        if redis is None:
+            print("CACHE_BACKEND is 'redis' but the redis package is not installed. Using memory cache.")
+        else:
+            try:
+                return RedisCache(get_redis_client(), ttls=CACHE_TTLS)
+            except Exception as e:
+                print(f"Could not connect to Redis at {REDIS_URL}: {e}. Using memory cache.")
+    elif backend == 'sqlite':
+        try:
+            return SQLiteCache(CACHE_DB_PATH, CACHE_MAX_ITEMS, ttls=CACHE_TTLS)
+        except sqlite3.Error as e:
+            print(f"Could not open cache database {CACHE_DB_PATH}: {e}. Using memory cache.")
+    return LRUCache(CACHE_MAX_ITEMS, CACHE_MAX_BYTES, CACHE_TTLS)
+
+# Global cache, created on startup
+cache = None
+
+def init_cache():
+    global cache
+    cache = create_cache()
+
+on_startup(init_cache)
+
+def get_cached_data(key, expiry=None):
     try:
-        response = requests.get(url, params=params, timeout=60)
+        return cache.get(key, max_age=expiry)
+    except Exception as e:
+        # A flaky shared backend should cost an upstream call, not the reply
+        cache.stats['errors'] += 1
+        print(f"Error reading cache key {key}: {e}")
+        return None
 
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('Response') == 'True':
-                return data
-            else:
-                return data
-        else:
-            return {'Response': 'False', 'Error': f"HTTP Error: {response.status_code}"}
+def set_cached_data(key, data, ttl=None):
+    try:
+        cache.set(key, data, ttl=ttl)
     except Exception as e:
-        return {'Response': 'False', 'Error': str(e)}
+        cache.stats['errors'] += 1
+        print(f"Error writing cache key {key}: {e}")
 
-cache = {}
+def delete_cached_data(key):
+    try:
+        cache.delete(key)
+    except Exception as e:
+        cache.stats['errors'] += 1
+        print(f"Error deleting cache key {key}: {e}")
 
-def get_cached_data(key, expiry=3600):
-    if key in cache:
-        data, timestamp = cache[key]
-        if time.time() - timestamp < expiry:
-            return data
+def cache_sweeper():
+    while True:
+        time.sleep(CACHE_SWEEP_INTERVAL)
+        try:
+            removed = cache.sweep()
+            if removed:
+                print(f"Cache sweep removed {removed} expired entries")
+        except Exception as e:
+            print(f"Error in cache_sweeper: {e}")
+
+on_startup(start_daemon, cache_sweeper)
+
+# User activity is kept as (user_id, last_seen epoch seconds) rows in SQLite.
+# Messages only update an in-memory buffer which is flushed in one transaction
+# every USER_ACTIVITY_FLUSH_INTERVAL seconds; the last_seen index answers
+# windowed active-user counts without scanning every row.
+USER_ACTIVITY_DB = os.getenv('USER_ACTIVITY_DB', 'users.db')
+USER_ACTIVITY_FLUSH_INTERVAL = int(os.getenv('USER_ACTIVITY_FLUSH_INTERVAL', '30'))
+ACTIVITY_WINDOWS = (('1h', 3600), ('24h', 86400), ('7d', 7 * 86400))
+
+class UserActivityStore:
+    """Last-seen timestamps of every user, with write-behind batching."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()  # held while writing to the database
+        self._pending_lock = threading.Lock()
+        self._pending = {}  # user_id -> last_seen, not flushed yet
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, last_seen INTEGER NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS users_last_seen ON users (last_seen)')
+        self._conn.commit()
+
+    def touch(self, user_id, when=None):
+        with self._pending_lock:
+            self._pending[user_id] = int(when if when is not None else time.time())
+
+    def _take_pending(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def flush(self):
+        with self._lock:
+            pending = self._take_pending()
+            if not pending:
+                return 0
+            self._conn.executemany(
+                'INSERT INTO users (user_id, last_seen) VALUES (?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)',
+                pending.items()
+            )
+            self._conn.commit()
+        return len(pending)
+
+    def remove(self, user_id):
+        with self._lock:
+            with self._pending_lock:
+                self._pending.pop(user_id, None)
+            self._conn.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+            self._conn.commit()
+
+    def total(self):
+        self.flush()
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def active_counts(self, now=None):
+        """Number of users seen within each of ACTIVITY_WINDOWS, e.g. {'1h': 3, '24h': 10, '7d': 42}."""
+        self.flush()
+        now = int(now if now is not None else time.time())
+        with self._lock:
+            return {
+                label: self._conn.execute(
+                    'SELECT COUNT(*) FROM users WHERE last_seen >= ?', (now - seconds,)
+                ).fetchone()[0]
+                for label, seconds in ACTIVITY_WINDOWS
+            }
+
+    def user_ids_after(self, user_id, limit):
+        """The next `limit` user ids greater than `user_id`, in ascending order."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?', (user_id, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def iter_user_ids(self, batch_size=1000):
+        """Yield every user id without loading the whole table into memory."""
+        self.flush()
+        last = float('-inf')
+        while True:
+            batch = self.user_ids_after(last, batch_size)
+            if not batch:
+                return
+            yield from batch
+            last = batch[-1]
+
+class RedisUserActivityStore(UserActivityStore):
+    """UserActivityStore kept in two Redis sorted sets shared by every worker: one
+    scored by last_seen for the windowed counts, one scored by user_id for paging."""
+
+    def __init__(self, client, prefix=REDIS_KEY_PREFIX):
+        self._lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending = {}
+        self.client = client
+        self.seen_key = prefix + 'users:last_seen'
+        self.ids_key = prefix + 'users:ids'
+
+    def flush(self):
+        with self._lock:
+            pending = self._take_pending()
+            if not pending:
+                return 0
+            pipe = self.client.pipeline(transaction=False)
+            pipe.zadd(self.seen_key, pending)
+            pipe.zadd(self.ids_key, {user_id: user_id for user_id in pending})
+            pipe.execute()
+        return len(pending)
+
+    def remove(self, user_id):
+        with self._lock:
+            with self._pending_lock:
+                self._pending.pop(user_id, None)
+            pipe = self.client.pipeline(transaction=False)
+            pipe.zrem(self.seen_key, user_id)
+            pipe.zrem(self.ids_key, user_id)
+            pipe.execute()
+
+    def total(self):
+        self.flush()
+        return self.client.zcard(self.ids_key)
+
+    def active_counts(self, now=None):
+        self.flush()
+        now = int(now if now is not None else time.time())
+        pipe = self.client.pipeline(transaction=False)
+        for _, seconds in ACTIVITY_WINDOWS:
+            pipe.zcount(self.seen_key, now - seconds, '+inf')
+        return {label: count for (label, _), count in zip(ACTIVITY_WINDOWS, pipe.execute())}
+
+    def user_ids_after(self, user_id, limit):
+        low = '-inf' if user_id == float('-inf') else f'({user_id}'
+        return [int(member) for member in self.client.zrangebyscore(self.ids_key, low, '+inf', start=0, num=limit)]
+
+user_activity = None
+
+def init_user_activity():
+    global user_activity
+    if STATE_BACKEND == 'redis':
+        try:
+            user_activity = RedisUserActivityStore(get_redis_client())
+            return
+        except Exception as e:
+            print(f"Could not keep user activity in Redis: {e}. Using {USER_ACTIVITY_DB}.")
+    try:
+        user_activity = UserActivityStore(USER_ACTIVITY_DB)
+    except sqlite3.Error as e:
+        # e.g. a read-only filesystem; activity is then only kept until restart
+        print(f"Could not open user activity database {USER_ACTIVITY_DB}: {e}. Keeping it in memory.")
+        user_activity = UserActivityStore(':memory:')
+
+on_startup(init_user_activity)
+
+def user_activity_flusher():
+    while True:
+        time.sleep(USER_ACTIVITY_FLUSH_INTERVAL)
+        try:
+            user_activity.flush()
+        except Exception as e:
+            print(f"Error flushing user activity: {e}")
+
+on_startup(start_daemon, user_activity_flusher)
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_title(title):
+    """Fold a user supplied title into a cache key so 'Amélie ', 'amelie' and 'AMÉLIE!' match."""
+    title = unicodedata.normalize('NFKD', title)
+    title = ''.join(ch for ch in title if not unicodedata.combining(ch))
+    title = _PUNCTUATION_RE.sub(' ', title.casefold())
+    return _WHITESPACE_RE.sub(' ', title).strip()
+
+def is_not_found(data):
+    return bool(data) and data.get('Response') == 'False' and 'not found' in data.get('Error', '').lower()
+
+def get_cached_omdb_data(cache_key):
+    data = get_cached_data(cache_key)
+    if data is not None:
+        # Every cache hit here is an OMDb request we didn't have to make
+        bot_stats['upstream_calls_saved'] += 1
+        if is_not_found(data):
+            bot_stats['negative_cache_hits'] += 1
+    return data
+
+def cache_omdb_data(cache_key, data):
+    if not data:
+        return
+    if data.get('Response') == 'True':
+        set_cached_data(cache_key, data)
+    elif is_not_found(data):
+        # Remember misses briefly so typos don't hit OMDb on every retry
+        set_cached_data(cache_key, data, ttl=NEGATIVE_CACHE_TTL)
+    index_title(data)
+
+# Local index of every title OMDb has returned to us, used to resolve
+# misspelled or partial queries without a round-trip and to suggest titles.
+# Stored as imdbID -> [Title, Year, Type, Genre, Director, Actors, imdbRating];
+# the lookup structures below are built from it in the background at startup
+# (or on first use) and kept up to date as titles are added.
+TITLE_INDEX_FILE = os.getenv('TITLE_INDEX_FILE', 'title_index.json')
+TITLE_INDEX_MAX = int(os.getenv('TITLE_INDEX_MAX', '100000'))
+# difflib ratio a fuzzy match needs to be used instead of asking OMDb
+TITLE_MATCH_THRESHOLD = float(os.getenv('TITLE_MATCH_THRESHOLD', '0.9'))
+TITLE_SUGGEST_THRESHOLD = 0.6
+TITLE_INDEX_SAVE_INTERVAL = 60
+title_index = {}
+title_index_lock = threading.RLock()
+title_index_dirty = False
+title_norms = None     # normalized title -> set of imdbIDs
+title_trigrams = None  # trigram -> set of normalized titles
+sorted_title_norms = None  # for prefix lookups
+genre_index = None     # (type, genre) -> set of imdbIDs
+person_index = None    # director or actor -> set of imdbIDs
+TITLE_ENTRY_FIELDS = ['Title', 'Year', 'Type', 'Genre', 'Director', 'Actors', 'imdbRating']
+
+def title_trigrams_of(norm):
+    padded = f"  {norm} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def split_names(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip() and name.strip() != 'N/A']
+
+def _add_to_title_lookups(imdb_id, entry):
+    norm = normalize_title(entry[0])
+    if norm not in title_norms:
+        title_norms[norm] = set()
+        bisect.insort(sorted_title_norms, norm)
+        for trigram in title_trigrams_of(norm):
+            title_trigrams.setdefault(trigram, set()).add(norm)
+    title_norms[norm].add(imdb_id)
+    for genre in split_names(entry[3]):
+        genre_index.setdefault((entry[2], genre.lower()), set()).add(imdb_id)
+    for person in split_names(entry[4]) + split_names(entry[5]):
+        person_index.setdefault(person.lower(), set()).add(imdb_id)
+
+def build_title_lookups():
+    global title_norms, title_trigrams, sorted_title_norms, genre_index, person_index
+    with title_index_lock:
+        if title_norms is not None:
+            return
+        title_norms, title_trigrams, sorted_title_norms = {}, {}, []
+        genre_index, person_index = {}, {}
+        for imdb_id, entry in title_index.items():
+            _add_to_title_lookups(imdb_id, entry)
+
+def index_title(data):
+    global title_index_dirty
+    if not data or data.get('Response', 'True') != 'True':
+        return
+    imdb_id, title, media_type = data.get('imdbID'), data.get('Title'), data.get('Type')
+    if not imdb_id or not title or media_type not in ('movie', 'series'):
+        return
+    with title_index_lock:
+        known = title_index.get(imdb_id)
+        # Search results only carry Title/Year/Type, so keep details we already have
+        entry = [data.get(field) or (known[i] if known else '') for i, field in enumerate(TITLE_ENTRY_FIELDS)]
+        if known == entry:
+            return
+        if known is None and len(title_index) >= TITLE_INDEX_MAX:
+            return
+        title_index[imdb_id] = entry
+        title_index_dirty = True
+        if title_norms is not None:
+            _add_to_title_lookups(imdb_id, entry)
+
+def title_rating(entry):
+    try:
+        return float(entry[6])
+    except (TypeError, ValueError):
+        return 0.0
+
+def recommend_from_index(media_type, genres=(), directors=(), actors=(), exclude=(), limit=5):
+    """Rank indexed titles of media_type by shared genres, director and actors, then rating."""
+    build_title_lookups()
+    scores = defaultdict(float)
+    with title_index_lock:
+        for genre in genres:
+            for imdb_id in genre_index.get((media_type, genre.lower()), ()):
+                scores[imdb_id] += 2
+        for weight, people in ((3, directors), (1, actors)):
+            for person in people:
+                for imdb_id in person_index.get(person.lower(), ()):
+                    if title_index[imdb_id][2] == media_type:
+                        scores[imdb_id] += weight
+        for imdb_id in exclude:
+            scores.pop(imdb_id, None)
+        ranked = heapq.nlargest(limit, scores, key=lambda imdb_id: (scores[imdb_id], title_rating(title_index[imdb_id])))
+        return [title_index[imdb_id][0] for imdb_id in ranked]
+
+def find_titles(query, media_type=None, limit=5):
+    """Rank indexed titles against query. Returns [(score, entry)], best first."""
+    norm = normalize_title(query)
+    if not norm:
+        return []
+    build_title_lookups()
+    with title_index_lock:
+        # Candidates share at least one trigram with the query; keep those sharing the most
+        shared = defaultdict(int)
+        for trigram in title_trigrams_of(norm):
+            for candidate in title_trigrams.get(trigram, ()):
+                shared[candidate] += 1
+        candidates = heapq.nlargest(limit * 10, shared, key=shared.get)
+        # Titles that start with the query count as partial-name matches
+        start = bisect.bisect_left(sorted_title_norms, norm)
+        prefixed = []
+        for candidate in sorted_title_norms[start:start + limit * 10]:
+            if not candidate.startswith(norm):
+                break
+            prefixed.append(candidate)
+        results = []
+        for candidate in set(candidates) | set(prefixed):
+            if candidate == norm:
+                score = 1.0
+            else:
+                score = difflib.SequenceMatcher(None, norm, candidate).ratio()
+            # A unique prefix that covers most of the title is as good as a close match
+            if len(prefixed) == 1 and candidate == prefixed[0] and len(norm) >= 0.6 * len(candidate):
+                score = max(score, TITLE_MATCH_THRESHOLD)
+            for imdb_id in title_norms[candidate]:
+                entry = title_index[imdb_id]
+                if media_type is None or entry[2] == media_type:
+                    results.append((score, [imdb_id] + entry))
+    results.sort(key=lambda result: result[0], reverse=True)
+    return results[:limit]
+
+def resolve_title(query, media_type=None, exact=False):
+    """Return the indexed [imdbID, Title, Year, Type, Genre] query confidently refers to, or None.
+
+    With exact=True only a title that normalizes to the query itself counts.
+    """
+    matches = find_titles(query, media_type, limit=2)
+    if not matches:
+        return None
+    score, entry = matches[0]
+    if score == 1.0:
+        return entry
+    if exact:
+        return None
+    # Short queries are too easy to confuse with a different title ('Alien' vs 'Aliens')
+    if score >= TITLE_MATCH_THRESHOLD and len(normalize_title(query)) >= 6:
+        if len(matches) == 1 or matches[1][0] < score:
+            bot_stats['title_index_resolved'] += 1
+            return entry
     return None
 
-def set_cached_data(key, data):
-    cache[key] = (data, time.time())
+def suggest_titles(query, media_type=None, limit=3):
+    return [entry for score, entry in find_titles(query, media_type, limit) if score >= TITLE_SUGGEST_THRESHOLD]
+
+def load_title_index():
+    global title_index
+    try:
+        with open(TITLE_INDEX_FILE, 'r') as f:
+            title_index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        title_index = {}
+    # Pad entries saved before newer fields were added
+    for entry in title_index.values():
+        entry.extend([''] * (len(TITLE_ENTRY_FIELDS) - len(entry)))
+
+def save_title_index():
+    global title_index_dirty
+    with title_index_lock:
+        if not title_index_dirty:
+            return
+        snapshot = dict(title_index)
+        title_index_dirty = False
+    try:
+        write_json_atomic(TITLE_INDEX_FILE, snapshot)
+    except OSError as e:
+        print(f"Error saving title index: {e}")
+
+def title_index_saver():
+    while True:
+        time.sleep(TITLE_INDEX_SAVE_INTERVAL)
+        save_title_index()
+
+on_startup(load_title_index)
+on_startup(start_daemon, title_index_saver)
+on_startup(start_daemon, build_title_lookups)
+
+# With a shared state backend the rules are also kept there, and every worker
+# reloads them within FILTER_SYNC_INTERVAL seconds of a /filter anywhere
+FILTER_SYNC_INTERVAL = 5
+filters_version = None
+filters_checked_at = 0
 
 def save_filtered_words():
-    with open('filtered_words.json', 'w') as f:
-        json.dump(list(filtered_words), f)
+    global filters_version
+    with filter_lock:
+        snapshot = {chat_key: dict(rules) for chat_key, rules in filter_rules.items()}
+    try:
+        write_json_atomic('filtered_words.json', snapshot)
+    except OSError as e:
+        print(f"Error saving filtered words: {e}")
+    if shared_state.shared:
+        shared_state.set('filters', snapshot)
+        filters_version = shared_state.incr('filters_version')
 
 def load_filtered_words():
-    global filtered_words
+    global filter_rules, filters_version
+    saved = None
+    if shared_state.shared:
+        filters_version = shared_state.get('filters_version')
+        saved = shared_state.get('filters')
+    if saved is None:
+        try:
+            with open('filtered_words.json', 'r') as f:
+                saved = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            saved = []
+    # Older files are a plain list of words matched anywhere in every chat
+    if isinstance(saved, list):
+        saved = {'*': {word: False for word in saved}}
+    filter_rules = {chat_key: {word.lower(): bool(whole) for word, whole in rules.items()}
+                    for chat_key, rules in saved.items()}
+    filter_rules.setdefault('*', {})
+    with filter_lock:
+        filter_patterns.clear()
+
+# Compiled matcher per rule set, rebuilt only for the rule set that changed
+filter_patterns = {}
+filter_lock = threading.Lock()
+
+def _trie_pattern(words):
+    """Build one regex alternation from a character trie of words, so matching
+    cost grows with the text length rather than with the number of words."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def build(node):
+        is_end = '' in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        if len(branches) == 1 and not is_end:
+            return branches[0]
+        return '(?:' + '|'.join(branches) + ')' + ('?' if is_end else '')
+
+    return build(trie)
+
+def compile_filter_rules(rules):
+    substrings = [word for word, whole in rules.items() if not whole]
+    whole_words = [word for word, whole in rules.items() if whole]
+    parts = []
+    if whole_words:
+        parts.append(r'(?<!\w)' + _trie_pattern(whole_words) + r'(?!\w)')
+    if substrings:
+        parts.append(_trie_pattern(substrings))
+    if not parts:
+        return None
+    return re.compile('|'.join(parts), re.IGNORECASE)
+
+def get_filter_pattern(chat_key):
+    with filter_lock:
+        if chat_key not in filter_patterns:
+            filter_patterns[chat_key] = compile_filter_rules(filter_rules.get(chat_key, {}))
+        return filter_patterns[chat_key]
+
+def add_filter_rule(word, chat_key='*', whole_word=False):
+    with filter_lock:
+        filter_rules.setdefault(chat_key, {})[word.lower()] = whole_word
+        filter_patterns.pop(chat_key, None)
+    save_filtered_words()
+
+def sync_filter_rules():
+    global filters_checked_at
+    if not shared_state.shared or time.time() - filters_checked_at < FILTER_SYNC_INTERVAL:
+        return
+    filters_checked_at = time.time()
+    if shared_state.get('filters_version') != filters_version:
+        load_filtered_words()
+
+def find_filtered_word(text, chat_id):
+    """Return the first filtered word found in text for this chat, or None."""
+    sync_filter_rules()
+    for chat_key in ('*', str(chat_id)):
+        pattern = get_filter_pattern(chat_key)
+        if pattern is not None:
+            match = pattern.search(text)
+            if match:
+                return match.group(0)
+    return None
+
+on_startup(load_filtered_words)
+
+# Short links are deterministic per long URL, so they are remembered in
+# short_urls.json and reused across restarts
+SHORT_URLS_FILE = os.getenv('SHORT_URLS_FILE', 'short_urls.json')
+SHORT_URLS_MAX = int(os.getenv('SHORT_URLS_MAX', '20000'))
+SHORTEN_TIMEOUT = float(os.getenv('SHORTEN_TIMEOUT', '3'))
+SHORT_URLS_SAVE_INTERVAL = 30
+short_urls = {}
+short_urls_lock = threading.Lock()
+short_urls_dirty = False
+shortener_executor = ThreadPoolExecutor(max_workers=int(os.getenv('SHORTENER_WORKERS', '6')), thread_name_prefix='shorten')
+
+def load_short_urls():
+    global short_urls
     try:
-        with open('filtered_words.json', 'r') as f:
-            filtered_words = set(json.load(f))
-    except FileNotFoundError:
-        filtered_words = set()
+        with open(SHORT_URLS_FILE, 'r') as f:
+            short_urls = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        short_urls = {}
+
+def save_short_urls():
+    global short_urls_dirty
+    with short_urls_lock:
+        if not short_urls_dirty:
+            return
+        snapshot = dict(short_urls)
+        short_urls_dirty = False
+    write_json_atomic(SHORT_URLS_FILE, snapshot)
 
-load_filtered_words()
+def short_urls_saver():
+    while True:
+        time.sleep(SHORT_URLS_SAVE_INTERVAL)
+        try:
+            save_short_urls()
+        except OSError as e:
+            print(f"Error saving short URLs: {e}")
+
+def remember_short_url(long_url, short_url):
+    global short_urls_dirty
+    with short_urls_lock:
+        short_urls[long_url] = short_url
+        # Dicts keep insertion order, so the oldest links are dropped first
+        while len(short_urls) > SHORT_URLS_MAX:
+            del short_urls[next(iter(short_urls))]
+        short_urls_dirty = True
+
+on_startup(load_short_urls)
+on_startup(start_daemon, short_urls_saver)
+
+def shorten_url(long_url, timeout=SHORTEN_TIMEOUT):
+    short_url = short_urls.get(long_url)
+    if short_url:
+        bot_stats['short_url_hits'] += 1
+        return short_url
 
-def shorten_url(long_url):
     encoded_url = requests.utils.quote(long_url)
-    api_url = f"https://mdiskshortner.link/api?api={MDISK_API_KEY}&url={encoded_url}&format=text"
+    api_url = f"{SHORTENER_API_URL}?api={MDISK_API_KEY}&url={encoded_url}&format=text"
     
     try:
-        response = requests.get(api_url)
+        response = http_get('shortener', api_url, timeout=(HTTP_TIMEOUTS['shortener'][0], timeout))
         if response.status_code == 200:
             short_url = response.text.strip()
             if short_url:
+                remember_short_url(long_url, short_url)
                 return short_url
             else:
                 print("Received an empty response from API.")
@@ -207,6 +1688,47 @@ def shorten_url(long_url):
         print(f"An error occurred: {e}")
         return long_url
 
+def shorten_urls(long_urls, timeout=SHORTEN_TIMEOUT):
+    """Shorten several URLs in parallel. Anything not shortened within the timeout keeps its long URL."""
+    results = [short_urls.get(url) for url in long_urls]
+    pending = {i: shortener_executor.submit(shorten_url, url, timeout)
+               for i, url in enumerate(long_urls) if not results[i]}
+    if pending:
+        done, _ = wait(pending.values(), timeout=timeout)
+        for i, future in pending.items():
+            if future in done and future.exception() is None:
+                results[i] = future.result()
+            else:
+                # Late results still land in short_urls for the next request
+                bot_stats['short_url_timeouts'] += 1
+                results[i] = long_urls[i]
+    return results
+
+def build_reply_links(data, media_type):
+    """Return the trailer, watch and information URLs shown under a movie or series reply."""
+    query = data['Title'].replace(' ', '+')
+    if media_type == 'movie':
+        return [
+            f"https://www.youtube.com/results?search_query={query}+trailer",
+            f"https://www.youtube.com/results?search_query={query}+full movie",
+            f"http://www.movieclue.rf.gd/movie_detail.html?imdbID={data['imdbID']}",
+        ]
+    return [
+        f"https://www.youtube.com/results?search_query={query}+trailer",
+        f"https://www.youtube.com/results?search_query={query}+full series",
+        f"https://www.imdb.com/title/{data['imdbID']}/",
+    ]
+
+def preshorten_titles(titles, media_type='movie'):
+    """Shorten the reply links of popular titles ahead of time. Returns how many titles were found."""
+    found = 0
+    for data in get_titles_data(titles, media_type).values():
+        if data and data.get('Response') == 'True':
+            shorten_urls(build_reply_links(data, media_type))
+            found += 1
+    save_short_urls()
+    return found
+
 def send_message_with_keyboard_removal(chat_id, text, reply_markup=None):
     bot.send_message(chat_id, text, reply_markup=reply_markup)
     if reply_markup is not None:
@@ -214,14 +1736,14 @@ def send_message_with_keyboard_removal(chat_id, text, reply_markup=None):
         bot.send_message(chat_id, " ", reply_markup=types.ReplyKeyboardRemove())
 
 def handle_recommend_command(message):
-    if not check_api_limit():
+    if not check_api_limit('recommendation'):
         return bot.reply_to(message, 'My Daily limit reached. Please try again tomorrow.')
     markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
     markup.add(KeyboardButton('Movie'), KeyboardButton('Series'))
     markup.add(KeyboardButton('Cancel'))
     response = bot.send_message(message.chat.id, "Please select whether you want a recommendation for a Movie or a Series:", reply_markup=markup)
     schedule_deletion(message.chat.id, message.message_id, response.message_id)
-    bot.register_next_step_handler(message, process_media_type)
+    start_conversation(message, 'recommend_media_type')
 
 def process_genre_selection(message, media_type):
     if message.text.lower() == 'cancel':
@@ -243,9 +1765,6 @@ def process_genre_selection(message, media_type):
     
     schedule_deletion(message.chat.id, message.message_id, response.message_id)
 
-def schedule_deletion(chat_id, *message_ids, delay=20):
-    threading.Timer(delay, delete_messages, args=[chat_id, *message_ids]).start()
-
 def process_media_type(message):
     if message.text.lower() == 'cancel':
         cancel_recommendation(message)
@@ -263,96 +1782,266 @@ def process_media_type(message):
     markup.add(KeyboardButton('Cancel'))
     response = bot.send_message(message.chat.id, f"Great! Now please select a genre for your {media_type} recommendation:", reply_markup=markup)
     schedule_deletion(message.chat.id, message.message_id, response.message_id)
-    bot.register_next_step_handler(message, lambda msg: process_genre_selection(msg, media_type))
+    start_conversation(message, 'recommend_genre', media_type=media_type)
+
+# Multi-step flows (/recommend, /broadcast) keep the step a user is on in
+# shared_state rather than in telebot's next-step handlers, so the next message
+# can be answered by any worker and survives a restart.
+CONVERSATION_TTL = 600
+
+def conversation_key(message):
+    return f"conversation:{message.chat.id}:{message.from_user.id}"
+
+def start_conversation(message, step, **data):
+    shared_state.set(conversation_key(message), {'step': step, 'data': data}, ttl=CONVERSATION_TTL)
+
+def continue_conversation(message):
+    """Hand the message to the step the user is on. Returns False if there is none."""
+    conversation = shared_state.pop(conversation_key(message))
+    if conversation is None:
+        return False
+    step = CONVERSATION_STEPS.get(conversation['step'])
+    if step is None:
+        return False
+    step(message, **conversation['data'])
+    return True
 
 def cancel_recommendation(message):
     response = bot.send_message(message.chat.id, "Recommendation process cancelled.", reply_markup=ReplyKeyboardRemove())
     schedule_deletion(message.chat.id, message.message_id, response.message_id)
 
+# Genre searches for recommendations run on a shared pool so a title's genres
+# are fetched concurrently instead of one after another
+RECOMMENDATION_WORKERS = int(os.getenv('RECOMMENDATION_WORKERS', '8'))
+RECOMMENDATION_DEADLINE = float(os.getenv('RECOMMENDATION_DEADLINE', '4'))
+recommendation_executor = ThreadPoolExecutor(max_workers=RECOMMENDATION_WORKERS, thread_name_prefix='recommend')
+# key -> Future for calls that are currently running
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+def submit_deduplicated(key, func, *args, executor=recommendation_executor):
+    """Run func(*args) on the executor, sharing one Future between concurrent callers with the same key."""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            bot_stats['deduplicated_requests'] += 1
+            return future
+        future = executor.submit(func, *args)
+        _inflight[key] = future
+
+    def forget(_):
+        with _inflight_lock:
+            if _inflight.get(key) is future:
+                del _inflight[key]
+
+    future.add_done_callback(forget)
+    return future
+
+def search_genre(genre, media_type, priority='recommendation'):
+    cache_key = f"genre:{media_type}:{genre.lower()}"
+    cached_data = get_cached_data(cache_key)
+    if cached_data is not None:
+        return cached_data
+
+    params = {
+        'apikey': OMDB_API_KEY,
+        's': genre,
+        'type': media_type
+    }
+    try:
+        response = http_get('omdb', OMDB_API_URL, params=params,
+                            timeout=(HTTP_TIMEOUTS['omdb'][0], RECOMMENDATION_DEADLINE),
+                            priority=priority)
+    except requests.RequestException as e:
+        # Raised, not returned as [], so the caller knows the results are incomplete
+        print(f"Error searching genre {genre}: {e}")
+        raise
+    if response.status_code != 200:
+        raise requests.HTTPError(f"OMDb returned HTTP {response.status_code} for genre {genre}")
+    return store_genre_results(cache_key, response.json())
+
+def store_genre_results(cache_key, data):
+    for item in data.get('Search', []):
+        index_title(item)
+    titles = [item['Title'] for item in data.get('Search', [])]
+    set_cached_data(cache_key, titles)
+    return titles
+
+def search_genres(genres, media_type, deadline=RECOMMENDATION_DEADLINE, priority='recommendation'):
+    """Search several genres concurrently and return whatever finished before the deadline.
+
+    The second value is False if any search failed or was still running when the
+    deadline passed.
+    """
+    futures = [submit_deduplicated(f"genre:{media_type}:{genre.lower()}", search_genre, genre, media_type, priority)
+               for genre in genres]
+    done, not_done = wait(futures, timeout=deadline)
+    titles = []
+    failed = 0
+    for future in futures:
+        if future in done and future.exception() is None:
+            titles.extend(future.result())
+        elif future in done:
+            failed += 1
+    if not_done:
+        print(f"Genre search deadline exceeded for {len(not_done)} of {len(futures)} genres")
+    return titles, not not_done and not failed
+
 def get_recommendations_by_genre(genre, media_type):
-    search_url = f"http://www.omdbapi.com/?apikey={OMDB_API_KEY}&s={genre}&type={media_type}"
-    response = requests.get(search_url)
-    if response.status_code == 200:
-        data = response.json()
-        if 'Search' in data:
-            titles = [item['Title'] for item in data['Search']]
-            random.shuffle(titles)
-            return titles[:5]
-    return []
-    
-def get_recommendations(title, media_type):
-    cache_key = f"{media_type}:{title}"
-    current_time = datetime.now()
-    
+    # Served from the local genre index when it knows enough titles
+    recommendations = recommend_from_index(media_type, genres=[genre])
+    if len(recommendations) >= 5:
+        bot_stats['recommendations_from_index'] += 1
+        return recommendations
+
+    titles, _ = search_genres([genre], media_type)
+    titles = [t for t in dict.fromkeys(titles) if t not in recommendations]
+    random.shuffle(titles)
+    return (recommendations + titles)[:5]
+
+def get_recommendations(title, media_type, priority='lookup'):
+    return find_recommendations(title, media_type, priority)[0]
+
+def cached_recommendations(cache_key):
+    """Return (recommendations, complete) from the cache, or None on a miss."""
+    cached_data = get_cached_data(cache_key)
+    if isinstance(cached_data, dict):
+        return cached_data['partial'], False
+    return None if cached_data is None else (cached_data, True)
+
+def find_recommendations(title, media_type, priority='lookup'):
+    """Return (recommendations, complete). Incomplete ones are missing the
+    genre searches that failed or ran past the deadline."""
+    cache_key = f"recommendations:{media_type}:{normalize_title(title)}"
+
     # Check if recommendations are in cache and not expired (24 hours)
-    if cache_key in recommendation_cache:
-        cached_data, timestamp = recommendation_cache[cache_key]
-        if current_time - timestamp < timedelta(hours=24):
-            return cached_data
+    cached = cached_recommendations(cache_key)
+    if cached is not None:
+        return cached
 
     # If not in cache or expired, fetch new recommendations
     if media_type == 'movie':
-        data = get_movie_data(title)
+        data = get_movie_data(title, priority)
     else:
-        data = get_series_data(title)
+        data = get_series_data(title, priority)
     
     if not data or 'Genre' not in data:
-        return []
+        return [], False
 
     genres = data['Genre'].split(', ')
-    
-    recommendations = set()
-    for genre in genres:
-        search_url = f'http://www.omdbapi.com/?apikey={OMDB_API_KEY}&s={genre}&type={media_type}'
-        response = requests.get(search_url)
-        
-        if response.status_code == 200:
-            search_data = response.json()
-            if 'Search' in search_data:
-                recommendations.update(item['Title'] for item in search_data['Search'] if item['Title'] != title)
-    
-    recommendations = list(recommendations)
-    random.shuffle(recommendations)
-    recommendations = recommendations[:5]
 
-    # Cache the recommendations
-    recommendation_cache[cache_key] = (recommendations, current_time)
+    # Rank similar titles from the local index; only search OMDb while the
+    # index is still too small to fill the list
+    recommendations = recommend_similar(data, media_type)
+    if len(recommendations) >= 5:
+        bot_stats['recommendations_from_index'] += 1
+        set_cached_data(cache_key, recommendations)
+        return recommendations, True
+
+    # Genre searches never use the lookup reserve, even for a user's own request
+    titles, complete = search_genres(genres, media_type, priority='recommendation' if priority == 'lookup' else priority)
+    return add_genre_results(cache_key, recommendations, titles, complete, (title, data.get('Title')))
+
+def recommend_similar(data, media_type):
+    return recommend_from_index(
+        media_type, data['Genre'].split(', '), split_names(data.get('Director')), split_names(data.get('Actors')),
+        exclude=[data.get('imdbID')]
+    )
 
-    return recommendations
+def add_genre_results(cache_key, recommendations, titles, complete, exclude):
+    """Fill recommendations up with genre search results and cache them."""
+    extra = list({t for t in titles if t not in exclude and t not in recommendations})
+    random.shuffle(extra)
+    recommendations = (recommendations + extra)[:5]
 
-def get_movie_data(movie_name):
-    cache_key = f"movie:{movie_name}"
-    cached_data = get_cached_data(cache_key)
-    if cached_data:
-        return cached_data
-    
-    response = requests.get(f'http://www.omdbapi.com/?apikey={OMDB_API_KEY}&t={movie_name}', timeout=60)
-    if response.status_code == 200:
-        data = response.json()
-        set_cached_data(cache_key, data)
-        return data
+    # Cache the recommendations. Partial results are marked as such and only
+    # kept until the slow genre searches finish and land in the genre cache.
+    if complete:
+        set_cached_data(cache_key, recommendations)
     else:
-        return None
+        set_cached_data(cache_key, {'partial': recommendations}, ttl=NEGATIVE_CACHE_TTL)
+
+    return recommendations, complete
+
+# Concurrent lookups of the same OMDb key share one request: the first caller
+# fetches, everyone else waits for its result
+LOOKUP_WORKERS = int(os.getenv('LOOKUP_WORKERS', '8'))
+# Look the series variant up while the movie lookup runs, trading a possibly
+# unused OMDb request for one less round-trip when the title is a series. Off
+# by default; the speculative request is made at 'recommendation' priority so
+# it never spends the lookup reserve.
+PARALLEL_TITLE_LOOKUP = os.getenv('PARALLEL_TITLE_LOOKUP', '0') == '1'
+lookup_executor = ThreadPoolExecutor(max_workers=LOOKUP_WORKERS, thread_name_prefix='lookup')
+_lookup_calls = {}  # cache key -> Future of the request in flight
+_lookup_calls_lock = threading.Lock()
+
+def singleflight(key, func, *args):
+    with _lookup_calls_lock:
+        future = _lookup_calls.get(key)
+        owner = future is None
+        if owner:
+            future = _lookup_calls[key] = Future()
+    if not owner:
+        bot_stats['coalesced_lookups'] += 1
+        return future.result()
 
-def get_series_data(series_name):
-    cache_key = f"series:{series_name}"
-    cached_data = get_cached_data(cache_key)
-    if cached_data:
+    try:
+        result = func(*args)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _lookup_calls_lock:
+            del _lookup_calls[key]
+
+# Per-thread count of lookups that had to go to OMDb, used to tell whether a
+# search was answered entirely from warm data
+lookup_trace = threading.local()
+
+def fetch_omdb_data(cache_key, params, priority='lookup'):
+    def fetch():
+        lookup_trace.misses = getattr(lookup_trace, 'misses', 0) + 1
+        data = invoke_rest_method(OMDB_API_URL, params, priority=priority)
+        cache_omdb_data(cache_key, data)
+        return data
+
+    cached_data = get_cached_omdb_data(cache_key)
+    if cached_data is not None:
         return cached_data
-    
+    return singleflight(cache_key, fetch)
+
+def get_titles_data(titles, media_type='movie'):
+    """Resolve many titles at once, concurrently. Returns {title: data}, with data None on errors."""
+    lookup = get_movie_data if media_type == 'movie' else get_series_data
+    futures = {}
+    for title in titles:
+        if title not in futures:
+            futures[title] = lookup_executor.submit(lookup, title)
+    results = {}
+    for title, future in futures.items():
+        try:
+            results[title] = future.result()
+        except Exception as e:
+            print(f"Error looking up {title}: {e}")
+            results[title] = None
+    return results
+
+def get_movie_data(movie_name, priority='lookup'):
+    params = {
+        'apikey': OMDB_API_KEY,
+        't': movie_name
+    }
+    return fetch_omdb_data(f"movie:{normalize_title(movie_name)}", params, priority)
+
+def get_series_data(series_name, priority='lookup'):
     params = {
         'apikey': OMDB_API_KEY,
         't': series_name,
         'type': 'series'
     }
-    url = 'http://www.omdbapi.com/'
-    
-    data = invoke_rest_method(url, params)
-    
-    if data.get('Response') == 'True':
-        set_cached_data(cache_key, data)
-    
-    return data
+    return fetch_omdb_data(f"series:{normalize_title(series_name)}", params, priority)
 
 def delete_data(chat_id, message_id):
     bot.delete_message(chat_id=chat_id, message_id=message_id)
@@ -382,7 +2071,7 @@ def handle_start(message):
         welcome_message = f"Hi {mention}! 🎬🍿 Welcome to MOVIZINFO Bot.\n\nYou can search for any movie by typing movie name.\nor for a series, type series name.\nor for a specific season type series name season seasonnumber \nI'll provide you with detailed information about the movie or series, including a link to its IMDb page. Let's start exploring the world of cinema together! 🌍🎥"
 
         markup = InlineKeyboardMarkup()
-        invite_button = InlineKeyboardButton(text="Add me to your group", url=f"https://t.me/{bot.get_me().username}?startgroup=true")
+        invite_button = InlineKeyboardButton(text="Add me to your group", url=f"https://t.me/{get_bot_user().username}?startgroup=true")
         
         markup.add(invite_button)
     
@@ -419,29 +2108,58 @@ def handle_search_season_command(message):
     else:
         bot.reply_to(message, 'Please use the format: /searchseason <series name> <season number>')
 
+def total_seasons(season_data):
+    # OMDb sends 'N/A' for some series
+    value = str(season_data.get('totalSeasons') or '')
+    return int(value) if value.isdigit() else 0
+
 def handle_search_season(message, series_name, season_number):
     if not check_api_limit():
         return bot.reply_to(message, 'My Daily limit reached. Please try again tomorrow.')
+    lookup_trace.misses = 0
     series_data = get_series_data(series_name)
     if series_data and series_data.get('Response') == 'True':
+        source_key = f"season:{series_data['imdbID']}:{season_number}"
+        rendered = get_rendered_reply(f"reply:{source_key}")
+        if rendered:
+            record_search(True)
+            record_title_request(series_data['Title'], 'series')
+            return send_rendered_reply(message.chat.id, rendered)
+
         season_data = get_season_data(series_data['imdbID'], season_number)
         if season_data and season_data.get('Response') == 'True':
-            formatted_data = format_season_data(series_data, season_data, season_number)
+            record_search(lookup_trace.misses == 0)
+            record_title_request(series_data['Title'], 'series')
+            # Users usually move on to the next season, so fetch it now
+            next_season = int(season_number) + 1
+            if next_season <= total_seasons(season_data):
+                prefetch_season(series_data, next_season)
+            long_link = season_link(series_data, season_number)
+            short_link = shorten_url(long_link)
+            formatted_data = format_season_data(series_data, season_data, season_number, short_link)
+            # Don't keep a long fallback link around for as long as the data is cached
+            if short_link != long_link:
+                set_rendered_reply(f"reply:{source_key}", source_key, series_data['Title'], formatted_data)
             return bot.send_message(message.chat.id, formatted_data, parse_mode='HTML')
     return None
 
-def format_season_data(series_data, season_data, season_number):
-    formatted_data = f"<b>{series_data['Title']} - Season {season_number}</b>\n\n"
-    formatted_data += f"Total Episodes: {len(season_data['Episodes'])}\n\n"
+def record_search(warm):
+    bot_stats['searches'] += 1
+    if warm:
+        bot_stats['warm_searches'] += 1
 
-    for episode in season_data['Episodes']:
-        formatted_data += f"Episode {episode['Episode']}: {episode['Title']} - Rating: {episode['imdbRating']}\n"
+def format_season_data(series_data, season_data, season_number, short_link):
+    parts = [
+        f"<b>{series_data['Title']} - Season {season_number}</b>\n\n",
+        f"Total Episodes: {len(season_data['Episodes'])}\n\n",
+    ]
+    parts.extend(f"Episode {episode['Episode']}: {episode['Title']} - Rating: {episode['imdbRating']}\n"
+                 for episode in season_data['Episodes'])
 
     # Add a link to watch the season if available
-    season_link = shorten_url(f"https://www.youtube.com/results?search_query={series_data['Title'].replace(' ', '+')}+season+{season_number}")
-    formatted_data += f"\n<b>Watch Season:</b> <a href='{season_link}'>Search for Season {season_number}</a>"
+    parts.append(f"\n<b>Watch Season:</b> <a href='{short_link}'>Search for Season {season_number}</a>")
 
-    return formatted_data
+    return ''.join(parts)
 
 def process_season_data(message, series_data, season_data, season_number):
     # Format and send the season information
@@ -453,57 +2171,225 @@ def process_season_data(message, series_data, season_data, season_number):
 
     return formatted_data
 
-def get_season_data(imdb_id, season_number):
-    cache_key = f"season:{imdb_id}:{season_number}"
-    cached_data = get_cached_data(cache_key)
-    if cached_data:
-        return cached_data
-    
+def get_season_data(imdb_id, season_number, priority='lookup'):
     params = {
         'apikey': OMDB_API_KEY,
         'i': imdb_id,
         'Season': season_number
     }
-    url = 'http://www.omdbapi.com/'
+    return fetch_omdb_data(f"season:{imdb_id}:{season_number}", params, priority)
+
+def season_link(series_data, season_number):
+    return f"https://www.youtube.com/results?search_query={series_data['Title'].replace(' ', '+')}+season+{season_number}"
+
+def prefetch_season(series_data, season_number, priority='recommendation'):
+    """Fetch a season and shorten its link in the background so the next request is warm."""
+    def prefetch():
+        season_data = get_season_data(series_data['imdbID'], season_number, priority)
+        if season_data and season_data.get('Response') == 'True':
+            shorten_url(season_link(series_data, season_number))
+            bot_stats['seasons_prefetched'] += 1
+
+    if check_api_limit(priority):
+        lookup_executor.submit(prefetch)
+
+# Cache warm-up. Popular titles (WARMUP_TITLES plus the most requested ones)
+# are pushed through the same lookups a user request would make, so the first
+# users after a deploy are served from warm caches. OMDb calls made by all
+# warm-ups of a day, on every worker and across restarts, are capped by
+# WARMUP_QUOTA_BUDGET and never touch the lookup reserve. Warming on start is
+# off by default where processes start often: lazy (serverless) and webhook mode.
+WARMUP_TITLES = [t.strip() for t in os.getenv('WARMUP_TITLES', '').split(',') if t.strip()]
+WARMUP_TOP_REQUESTED = int(os.getenv('WARMUP_TOP_REQUESTED', '50'))
+WARMUP_QUOTA_BUDGET = int(os.getenv('WARMUP_QUOTA_BUDGET', '100'))
+WARMUP_ON_START = os.getenv(
+    'WARMUP_ON_START', '0' if LAZY_INIT or os.getenv('ENVIRONMENT') == 'production' else '1') == '1'
+WARMUP_INTERVAL = int(os.getenv('WARMUP_INTERVAL', '0'))  # seconds, 0 disables scheduled runs
+POPULAR_TITLES_FILE = os.getenv('POPULAR_TITLES_FILE', 'popular_titles.json')
+POPULAR_TITLES_MAX = 1000
+popular_titles = defaultdict(int)  # "type:Title" -> request count
+popular_titles_lock = threading.Lock()
+warmup_status = {}
+warmup_lock = threading.Lock()
+warmup_call_limit = 0  # warmup_calls_used() a running warm-up may not go past
+
+def record_title_request(title, media_type):
+    with popular_titles_lock:
+        popular_titles[f"{media_type}:{title}"] += 1
+
+def load_popular_titles():
+    try:
+        with open(POPULAR_TITLES_FILE, 'r') as f:
+            popular_titles.update(json.load(f))
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+def save_popular_titles():
+    with popular_titles_lock:
+        top = sorted(popular_titles.items(), key=lambda item: item[1], reverse=True)[:POPULAR_TITLES_MAX]
+        popular_titles.clear()
+        popular_titles.update(top)
+    try:
+        write_json_atomic(POPULAR_TITLES_FILE, dict(top))
+    except OSError as e:
+        print(f"Error saving popular titles: {e}")
+
+def warmup_candidates():
+    with popular_titles_lock:
+        top = sorted(popular_titles, key=popular_titles.get, reverse=True)[:WARMUP_TOP_REQUESTED]
+    candidates = [('movie', title) for title in WARMUP_TITLES]
+    candidates += [tuple(key.split(':', 1)) for key in top]
+    return list(dict.fromkeys(candidates))
+
+def warm_title(title, media_type):
+    # Every OMDb call below is made at 'warmup' priority, so it is checked
+    # against the run's budget on its own and never touches the lookup reserve
+    data = get_movie_data(title, 'warmup') if media_type == 'movie' else get_series_data(title, 'warmup')
+    if not data or data.get('Response') != 'True':
+        return False
+    get_recommendations(title, media_type, 'warmup')
+    shorten_urls(build_reply_links(data, media_type))
+    if media_type == 'series':
+        prefetch_season(data, 1, 'warmup')
+    return True
+
+def run_warmup(budget=WARMUP_QUOTA_BUDGET):
+    global warmup_call_limit
+    if not warmup_lock.acquire(blocking=False):
+        return warmup_status
+    try:
+        reset_api_counter()
+        start_count = warmup_calls_used()
+        warmup_call_limit = start_count + budget
+        start = time.time()
+        warmed = skipped = 0
+        for media_type, title in warmup_candidates():
+            if not check_api_limit('warmup'):
+                skipped += 1
+                continue
+            try:
+                if warm_title(title, media_type):
+                    warmed += 1
+            except Exception as e:
+                print(f"Error warming {title}: {e}")
+        save_short_urls()
+        warmup_status.update({
+            'finished_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'warmed': warmed,
+            'skipped': skipped,
+            'api_calls': warmup_calls_used() - start_count,
+            'seconds': round(time.time() - start, 1),
+        })
+        print(f"Warm-up finished: {warmup_status}")
+        return warmup_status
+    finally:
+        warmup_lock.release()
+
+def warmup_scheduler():
+    if WARMUP_ON_START:
+        run_warmup()
+    while True:
+        time.sleep(max(WARMUP_INTERVAL, 60))
+        save_popular_titles()
+        if WARMUP_INTERVAL:
+            run_warmup()
+
+on_startup(load_popular_titles)
+on_startup(start_daemon, warmup_scheduler)
+
+# Finished replies are cached next to the data they were rendered from. A
+# rendered reply is only used while that data is still cached, so expiring,
+# evicting or clearing the data invalidates the reply as well.
+REPLY_DETAIL_KEYS = ['Title', 'Year', 'Rated', 'Released', 'Runtime', 'Genre', 'Director', 'Writer', 'Actors',
+                     'Language', 'Country', 'Awards', 'imdbRating']
+
+def get_rendered_reply(reply_key):
+    entry = get_cached_data(reply_key)
+    if entry is None:
+        return None
+    source = get_cached_data(entry['source'])
+    if not source or source.get('Response') != 'True':
+        delete_cached_data(reply_key)
+        return None
+    bot_stats['rendered_reply_hits'] += 1
+    return entry
+
+def set_rendered_reply(reply_key, source_key, title, text, reply_markup=None):
+    set_cached_data(reply_key, {
+        'source': source_key,
+        'title': title,
+        'text': text,
+        'markup': reply_markup.to_json() if reply_markup else None,
+    })
+
+def send_rendered_reply(chat_id, entry):
+    markup = types.InlineKeyboardMarkup.de_json(entry['markup']) if entry.get('markup') else None
+    return bot.send_message(chat_id=chat_id, text=entry['text'], parse_mode='HTML', reply_markup=markup)
+
+def render_title_reply(data, media_type, name):
+    long_links = build_reply_links(data, media_type)
+    links = shorten_urls(long_links)
+    recommendations, complete = find_recommendations(name, media_type)
+    # The second value is False if the reply shouldn't be cached: a link kept
+    # its long URL or the recommendations are partial
+    text = compose_title_reply(data, media_type, links, recommendations)
+    return text, complete and links_shortened(links, long_links)
+
+def links_shortened(links, long_links):
+    return all(link != long_link for link, long_link in zip(links, long_links))
+
+def compose_title_reply(data, media_type, links, recommendations):
+    # Start with the poster URL
+    parts = []
+    if data.get("Poster") and data["Poster"] != "N/A":
+        parts.append(f'<a href="{data["Poster"]}">&#8205;</a>')
     
-    data = invoke_rest_method(url, params)
+    # Add the movie or series information
+    parts.append('\n\n' + '\n'.join(f'<b>{k}</b>: {data.get(k, "N/A")}' for k in REPLY_DETAIL_KEYS))
     
-    if data.get('Response') == 'True':
-        set_cached_data(cache_key, data)
+    trailer_link, watch_link, imdb_link = links
+    parts.append(f'\n\n<b>Trailer:</b> <a href="{trailer_link}">Watch Trailer</a>')
+    if media_type == 'movie':
+        parts.append(f'\n\n<b>Movie:</b> <a href="{watch_link}">Watch Movie (if available)</a>')
+    else:
+        parts.append(f'\n\n<b>Series:</b> <a href="{watch_link}">Watch Series (if available)</a>')
+    parts.append(f'\n\n<a href="{imdb_link}">More Information</a>')
     
-    return data
+    # Add recommendations
+    if recommendations:
+        parts.append("\n\n<b>Recommendations:</b>\n" + "\n".join(recommendations))
+    return ''.join(parts)
+
+def handle_search_title(message, name, media_type):
+    """Send the reply for a movie or series, or return None if OMDb doesn't know it."""
+    source_key = f"{media_type}:{normalize_title(name)}"
+    reply_key = f"reply:{source_key}"
+    rendered = get_rendered_reply(reply_key)
+    if rendered:
+        record_title_request(rendered['title'], media_type)
+        return send_rendered_reply(message.chat.id, rendered)
+
+    data = get_movie_data(name) if media_type == 'movie' else get_series_data(name)
+    if not data or 'Error' in data:
+        return None
+    record_title_request(data['Title'], media_type)
+    text, cacheable = render_title_reply(data, media_type, name)
+    # Don't keep long fallback links or partial recommendations around for as
+    # long as the data is cached
+    if cacheable:
+        set_rendered_reply(reply_key, source_key, data['Title'], text)
+    
+    # Send the message
+    return bot.send_message(chat_id=message.chat.id, text=text, parse_mode='HTML')
 
 def handle_search_movie(message, movie_name=None):
     if not check_api_limit():
         return bot.reply_to(message, 'My Daily limit reached. Please try again tomorrow.')
     if not movie_name:
         movie_name = message.text
-    movie_data = get_movie_data(movie_name)
-    if movie_data and 'Error' not in movie_data:
-        # Start with the poster URL
-        formatted_movie_data = ''
-        if movie_data.get("Poster") and movie_data["Poster"] != "N/A":
-            formatted_movie_data = f'<a href="{movie_data["Poster"]}">&#8205;</a>'
-        
-        # Add the movie information
-        keys = ['Title', 'Year', 'Rated', 'Released', 'Runtime', 'Genre', 'Director', 'Writer', 'Actors', 'Language',
-                'Country', 'Awards', 'imdbRating']
-        formatted_movie_data += '\n\n' + '\n'.join(f'<b>{k}</b>: {movie_data.get(k, "N/A")}' for k in keys)
-        
-        trailer_link = shorten_url(f"https://www.youtube.com/results?search_query={movie_name.replace(' ', '+')}+trailer")
-        formatted_movie_data += f'\n\n<b>Trailer:</b> <a href="{trailer_link}">Watch Trailer</a>'
-        movie_link = shorten_url(f"https://www.youtube.com/results?search_query={movie_name.replace(' ', '+')}+full movie")
-        formatted_movie_data += f'\n\n<b>Movie:</b> <a href="{movie_link}">Watch Movie (if available)</a>'
-        imdb_link = shorten_url(f"http://www.movieclue.rf.gd/movie_detail.html?imdbID={movie_data['imdbID']}")
-        formatted_movie_data += f'\n\n<a href="{imdb_link}">More Information</a>'
-        
-        # Add recommendations
-        recommendations = get_recommendations(movie_name, 'movie')
-        if recommendations:
-            formatted_movie_data += "\n\n<b>Recommendations:</b>\n" + "\n".join(recommendations)
-        
-        # Send the message
-        return bot.send_message(chat_id=message.chat.id, text=formatted_movie_data, parse_mode='HTML')
+    response = handle_search_title(message, movie_name, 'movie')
+    if response:
+        return response
     else:
         response = bot.reply_to(message, 'Please provide a movie name after the /searchmovie command.\nFor example: /searchmovie Inception')
         schedule_deletion(message.chat.id, message.message_id, response.message_id)
@@ -513,146 +2399,225 @@ def handle_search_series(message, series_name=None):
         return bot.reply_to(message, 'My Daily limit reached. Please try again tomorrow.')
     if not series_name:
         series_name = message.text
-    series_data = get_series_data(series_name)
-    if series_data and 'Error' not in series_data:
-        # Start with the poster URL
-        formatted_series_data = ''
-        if series_data.get("Poster") and series_data["Poster"] != "N/A":
-            formatted_series_data = f'<a href="{series_data["Poster"]}">&#8205;</a>'
-        
-        # Add the series information
-        keys = ['Title', 'Year', 'Rated', 'Released', 'Runtime', 'Genre', 'Director', 'Writer', 'Actors', 'Language',
-                'Country', 'Awards', 'imdbRating']
-        formatted_series_data += '\n\n' + '\n'.join(f'<b>{k}</b>: {series_data.get(k, "N/A")}' for k in keys)
-        
-        trailer_link = shorten_url(f"https://www.youtube.com/results?search_query={series_name.replace(' ', '+')}+trailer")
-        formatted_series_data += f'\n\n<b>Trailer:</b> <a href="{trailer_link}">Watch Trailer</a>'
-        series_link = shorten_url(f"https://www.youtube.com/results?search_query={series_name.replace(' ', '+')}+full series")
-        formatted_series_data += f'\n\n<b>Series:</b> <a href="{series_link}">Watch Series (if available)</a>'
-        imdb_link = shorten_url(f'https://www.imdb.com/title/{series_data["imdbID"]}/')
-        formatted_series_data += f'\n\n<a href="{imdb_link}">More Information</a>'
-        
-        # Add recommendations
-        recommendations = get_recommendations(series_name, 'series')
-        if recommendations:
-            formatted_series_data += "\n\n<b>Recommendations:</b>\n" + "\n".join(recommendations)
-        
-        # Send the message
-        return bot.send_message(chat_id=message.chat.id, text=formatted_series_data, parse_mode='HTML')
-    return None
+    return handle_search_title(message, series_name, 'series')
     
         
-def handle_search_movie_or_series(message):
-    search_query = message.text.strip()
+def handle_search_movie_or_series(message, search_query=None):
+    if not search_query:
+        search_query = message.text.strip()
     print(f"Searching for: {search_query}")
     
     try:
-        if not handle_search_movie(message, search_query):
-            if not handle_search_series(message, search_query):
-                bot.reply_to(message, f"Sorry, I couldn't find any information about '{search_query}'.")
+        lookup_trace.misses = 0
+        # An exact match in the local index tells us whether it's a movie or
+        # a series, so only one OMDb lookup is needed
+        match = resolve_title(search_query, exact=True)
+        if match:
+            search_query = match[1]
+            if match[3] == 'series':
+                response = handle_search_series(message, search_query) or handle_search_movie(message, search_query)
+            else:
+                response = handle_search_movie(message, search_query) or handle_search_series(message, search_query)
+        else:
+            if PARALLEL_TITLE_LOOKUP and check_api_limit('recommendation'):
+                # The series lookup lands in the cache (or is joined in flight) by
+                # the time handle_search_series asks for it
+                lookup_executor.submit(get_series_data, search_query, 'recommendation')
+            response = handle_search_movie(message, search_query)
+            if not response:
+                response = handle_search_series(message, search_query)
+        if not response:
+            # Only once OMDb doesn't know the title as typed, try the closest
+            # indexed one, so 'the dark knight' never turns into '... Rises'
+            match = resolve_title(search_query)
+            if match and normalize_title(match[1]) != normalize_title(search_query) and check_api_limit():
+                response = handle_search_title(message, match[1], 'series' if match[3] == 'series' else 'movie')
+        if response:
+            record_search(lookup_trace.misses == 0)
+        if not response:
+            reply = f"Sorry, I couldn't find any information about '{search_query}'."
+            suggestions = suggest_titles(search_query)
+            if suggestions:
+                reply += "\nDid you mean: " + ", ".join(f"{entry[1]} ({entry[2]})" for entry in suggestions) + "?"
+            response = bot.reply_to(message, reply)
+        return response
     except Exception as e:
         print(f"Error in handle_search_movie_or_series: {e}")
-        bot.reply_to(message, "An error occurred while processing your request. Please try again later.")
+        return bot.reply_to(message, "An error occurred while processing your request. Please try again later.")
 
 def handle_filter_command(message):
-    # Split the message text to get the filter criteria
-    command_parts = message.text.split(maxsplit=1)
-    if len(command_parts) < 2:
+    # Usage: /filter [--chat] [--whole] <word>
+    #   --chat   only filter in the current chat
+    #   --whole  only match the word on its own, not inside other words
+    command_parts = message.text.split()[1:]
+    chat_only = '--chat' in command_parts
+    whole_word = '--whole' in command_parts
+    criteria = " ".join(part for part in command_parts if part not in ('--chat', '--whole')).strip()
+    if not criteria:
         bot.reply_to(message, "Please provide filter criteria after the command.")
         return
 
-    criteria = command_parts[1].strip()
-    
     # Store the filter criteria
-    filtered_words.add(criteria)
-    save_filtered_words()
+    add_filter_rule(criteria, str(message.chat.id) if chat_only else '*', whole_word)
     
-    bot.reply_to(message, f"Filter criteria '{criteria}' has been added.")
+    scope = "this chat" if chat_only else "all chats"
+    bot.reply_to(message, f"Filter criteria '{criteria}' has been added for {scope}.")
 
-  # This handler will process all incoming messages
+# Runs on every non-command message; returns True if the message was removed
 def filter_messages(message):
-    if not filtered_words:
-        return
+    if not message.text:
+        return False
 
     # Check if the message text contains any of the filtered words
-    message_text = message.text.lower()
-    for word in filtered_words:
-        if word.lower() in message_text:
-            # Send notification message
-            sent_message = bot.send_message(message.chat.id, f"Your message containing '{word}' has been deleted.")
-            
-            # Delete the original message
-            bot.delete_message(chat_id=message.chat.id, message_id=message.message_id)
-            
-            # Wait for a specific period (e.g., 10 seconds) before deleting the notification message
-            time.sleep(5)
-            bot.delete_message(chat_id=message.chat.id, message_id=sent_message.message_id)
-            return
+    word = find_filtered_word(message.text, message.chat.id)
+    if not word:
+        return False
+    bot_stats['filtered_messages'] += 1
+    # Send notification message
+    sent_message = bot.send_message(message.chat.id, f"Your message containing '{word}' has been deleted.")
+    
+    # Delete the original message
+    try:
+        bot.delete_message(chat_id=message.chat.id, message_id=message.message_id)
+    except Exception as e:
+        print(f"Error deleting filtered message {message.message_id}: {e}")
+    
+    # Delete the notification after a few seconds without blocking this handler
+    schedule_deletion(message.chat.id, sent_message.message_id, delay=5)
+    return True
 
 
 
+def handle_preshorten_command(message):
+    command_parts = message.text.split(maxsplit=1)
+    if len(command_parts) < 2:
+        return bot.reply_to(message, "Please use the format: /preshorten <title>, <title>, ...")
+
+    titles = [t.strip() for t in command_parts[1].split(',') if t.strip()]
+    found = preshorten_titles(titles)
+    response = bot.reply_to(message, f"Pre-shortened links for {found} of {len(titles)} titles.")
+    delete_message_after_delay(message.chat.id, response.message_id)
+    return response
+
+def handle_warmup_command(message):
+    if warmup_lock.locked():
+        return bot.reply_to(message, "A warm-up is already running.")
+    response = bot.reply_to(message, "Warming up caches...")
+
+    # A run can take minutes, so don't hold up an update worker with it
+    def warmup_and_report():
+        status = run_warmup()
+        bot.reply_to(
+            message,
+            f"Warm-up finished: {status.get('warmed', 0)} titles warmed, {status.get('skipped', 0)} skipped, "
+            f"{status.get('api_calls', 0)} OMDb calls in {status.get('seconds', 0)}s."
+        )
+
+    start_daemon(warmup_and_report)
+    return response
+
 def handle_devinfo_command(message):
-    user_id = message.from_user.id
-    if user_id != int(DEVELOPER_ID):
-        bot.reply_to(message, "Access denied. This command is for developers only.")
-        return
     try:
         dev_info = (
             "🔧 *Developer Information* 🔧\n\n"
             f"**Developer ID:** `{DEVELOPER_ID}`\n"
             f"**Current Time:** `{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}`\n"
             f"**Bot Status:** `Operational`\n"
-            f"**Total Users:** `{len(user_last_interaction)}`\n"
-            f"**Cached Items:** `{len(cache)}`\n"
+            f"**Startup:** import `{startup_stats.get('import_seconds', 0) * 1000:.0f} ms`, "
+            f"init `{startup_stats.get('init_seconds', 0) * 1000:.0f} ms`{' (lazy)' if LAZY_INIT else ''}\n"
+            f"**Total Users:** `{user_activity.total()}`\n"
+            f"**Cache:** `{cache.describe()}`\n"
+            f"**Cache Hits/Misses:** `{cache.stats['hits']}` / `{cache.stats['misses']}` (`{cache.hit_ratio():.0%}`)\n"
+            f"**Cache Evictions/Expired:** `{cache.stats['evictions']}` / `{cache.stats['expired']}`\n"
         )
+        for upstream, stats in sorted(upstream_stats.items()):
+            calls = int(stats['calls'])
+            avg_ms = stats['total_seconds'] / calls * 1000 if calls else 0
+            dev_info += (
+                f"**{upstream}:** `{calls}` calls, `{int(stats['errors'])}` errors, "
+                f"`{int(stats['retries'])}` retries, avg `{avg_ms:.0f} ms`, max `{stats['max_seconds'] * 1000:.0f} ms`\n"
+            )
         response = bot.send_message(message.chat.id, dev_info, parse_mode='Markdown')
         delete_message_after_delay(message.chat.id, response.message_id)
     except Exception as e:
         bot.send_message(message.chat.id, "An error occurred while processing the command.")
 
 def handle_clear_cache_command(message):
-    user_id= message.from_user.id
-    if user_id != int(DEVELOPER_ID):
-        bot.reply_to(message, "Access denied. This command is for developers only.")
-        return
-    
-    global cache
-    cache.clear()
-    response = bot.send_message(message.chat.id, "Cache cleared")
+    removed = cache.clear()
+    response = bot.send_message(
+        message.chat.id,
+        f"Cache cleared ({removed} items). "
+        f"Hits: {cache.stats['hits']}, Misses: {cache.stats['misses']}, Evictions: {cache.stats['evictions']}"
+    )
     delete_message_after_delay(message.chat.id, response.message_id)
     
 
 def handle_stats_command(message):
-    user_id= message.from_user.id
-    if user_id != int(DEVELOPER_ID):
-        bot.reply_to(message, "Access denied. This command is for developers only.")
-        return
-
+    reset_api_counter()
+    active_users = user_activity.active_counts()
     stats_message = (
         "📊 *Bot Statistics* 📊\n\n"
         f"**Messages Received:** `{bot_stats['messages_received']}`\n"
-        f"**Active Users:** `{len(user_last_interaction)}`\n"
+        f"**Active Users:** `{active_users['1h']}` last hour, `{active_users['24h']}` last day, "
+        f"`{active_users['7d']}` last week (`{user_activity.total()}` total)\n"
         f"**Errors Encountered:** `{bot_stats['errors']}`\n"
+        f"**Pending Deletions:** `{deletion_queue_depth()}`\n"
+        f"**Update Queue:** `{update_queue_depth()}` queued, `{int(update_stats['processed'])}` processed, "
+        f"`{int(update_stats['duplicates'])}` duplicates, `{int(update_stats['rejected'])}` rejected\n"
+        f"**Update Queue Wait:** avg `{update_stats['total_wait_seconds'] / max(1, update_stats['enqueued']) * 1000:.0f} ms`, "
+        f"max `{update_stats['max_wait_seconds'] * 1000:.0f} ms`\n"
+        f"**OMDb Requests Today:** `{API_REQUEST_COUNT}` / `{MAX_DAILY_REQUESTS}` "
+        f"(`{remaining_api_calls()}` remaining, `{OMDB_RESERVED_FOR_LOOKUPS}` reserved for lookups)\n"
+        f"**OMDb Calls Rejected:** `{bot_stats['quota_rejected_api_calls']}` by quota, "
+        f"`{bot_stats['rate_limited_api_calls']}` by rate limit\n"
+        f"**OMDb Calls Saved by Cache:** `{bot_stats['upstream_calls_saved']}` "
+        f"(`{bot_stats['negative_cache_hits']}` from cached not-found results)\n"
+        f"**Title Index:** `{len(title_index)}` titles, `{bot_stats['title_index_resolved']}` queries resolved locally, "
+        f"`{bot_stats['recommendations_from_index']}` recommendations served locally\n"
+        f"**Rendered Replies Reused:** `{bot_stats['rendered_reply_hits']}`\n"
+        f"**Searches Rejected:** `{bot_stats['searches_user_limited']}` user limit, "
+        f"`{bot_stats['searches_chat_limited']}` chat limit, `{bot_stats['searches_debounced']}` repeated\n"
+        f"**Warm Searches:** `{bot_stats['warm_searches']}` / `{bot_stats['searches']}` "
+        f"(`{bot_stats['warm_searches'] / max(1, bot_stats['searches']):.0%}` with no OMDb call), "
+        f"`{bot_stats['seasons_prefetched']}` seasons prefetched\n"
+        f"**Last Warm-up:** `{warmup_status.get('finished_at', 'never')}`, "
+        f"`{warmup_status.get('warmed', 0)}` titles, `{warmup_status.get('api_calls', 0)}` OMDb calls\n"
     )
+    busiest = sorted(command_stats.items(), key=lambda item: item[1]['count'], reverse=True)[:5]
+    if busiest:
+        stats_message += "\n*Commands:*\n"
+        for command, stats in busiest:
+            avg_ms = stats['total_seconds'] / stats['count'] * 1000 if stats['count'] else 0
+            stats_message += (
+                f"`/{command}`: `{int(stats['count'])}` runs, avg `{avg_ms:.0f} ms`, "
+                f"`{int(stats['rejected'])}` rejected, `{int(stats['errors'])}` errors\n"
+            )
+
+    with latency_histograms_lock:
+        latencies = sorted(
+            ((name, labels, histogram.count, histogram.quantile(0.5), histogram.quantile(0.95))
+             for (name, labels), histogram in latency_histograms.items()
+             if name in ('handler_seconds', 'upstream_request_seconds')),
+            key=lambda item: item[2], reverse=True
+        )[:8]
+    if latencies:
+        stats_message += "\n*Latency (p50 / p95):*\n"
+        for name, labels, count, p50, p95 in latencies:
+            stats_message += (
+                f"`{labels[0][1]}`: `{p50 * 1000:.0f} ms` / `{p95 * 1000:.0f} ms` over `{count}` calls\n"
+            )
+    stats_message += f"\n**Threads:** `{threading.active_count()}`\n"
 
     response = bot.send_message(message.chat.id, stats_message, parse_mode='Markdown')
     delete_message_after_delay(message.chat.id, response.message_id)
 
 def handle_reload_command(message):
-    user_id= message.from_user.id
-    if user_id == int(DEVELOPER_ID):
-        bot.reply_to(message, "Bot is reloading...")
-        # Add your reload logic here
-    else:
-        bot.reply_to(message, "Access denied. You are not authorized to use this command.")
+    bot.reply_to(message, "Bot is reloading...")
+    # Add your reload logic here
 
 def handle_broadcast(message):
-    user_id= message.from_user.id
-    if user_id == int(DEVELOPER_ID):
-        bot.send_message(message.chat.id, "Please send the message you want to broadcast.")
-        bot.register_next_step_handler(message, handle_broadcast_message)
-    else:
-        bot.reply_to(message, "You are not authorized to use this command.")
+    bot.send_message(message.chat.id, "Please send the message you want to broadcast.")
+    start_conversation(message, 'broadcast_message')
 
 def process_broadcast_message(message):
     broadcast_message = message.text
@@ -662,49 +2627,273 @@ def process_broadcast_message(message):
     except Exception as e:
         print(f"An error occurred: {e}")
 
+# Broadcasts are sent in the background by a small worker pool under a global
+# and a per-chat rate limit, honouring Telegram's retry_after. Progress is
+# checkpointed to BROADCAST_FILE so an interrupted broadcast resumes after a
+# restart, and chats that blocked or removed the bot are dropped. Users are
+# read from the activity store in batches, so memory doesn't grow with them.
+BROADCAST_FILE = os.getenv('BROADCAST_FILE', 'broadcast_state.json')
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '4'))
+# Telegram allows about 30 messages per second overall and 20 per minute per group
+BROADCAST_RATE_PER_SECOND = float(os.getenv('BROADCAST_RATE_PER_SECOND', '25'))
+BROADCAST_MAX_RETRIES = 3
+BROADCAST_CHECKPOINT_INTERVAL = 2
+# Only the holder of the 'broadcast_runner' lease sends. A heartbeat thread
+# renews it every BROADCAST_LEASE_RENEW_INTERVAL seconds, so if the sending
+# worker dies another one takes over once it expires. A runner that finds the
+# lease gone or held by someone else stops before its next send and leaves the
+# saved state to the new holder.
+BROADCAST_RUNNER_TTL = 30
+BROADCAST_LEASE_RENEW_INTERVAL = 5
+BROADCAST_BATCH_SIZE = 200
+CHAT_SEND_BUCKETS_MAX = 10000
+broadcast_bucket = TokenBucket(BROADCAST_RATE_PER_SECOND, BROADCAST_RATE_PER_SECOND)
+chat_send_buckets = OrderedDict()  # chat_id -> TokenBucket, least recently used first
+chat_send_buckets_lock = threading.Lock()
+broadcast_lock = threading.Lock()
+# Errors meaning the chat will never accept messages from us again
+UNREACHABLE_CHAT_ERRORS = ('bot was blocked', 'user is deactivated', 'chat not found',
+                           'bot was kicked', 'not a member', 'have no rights to send')
+
+def chat_send_bucket(chat_id):
+    with chat_send_buckets_lock:
+        bucket = chat_send_buckets.get(chat_id)
+        if bucket is None:
+            # Groups and channels have negative ids and a much lower limit
+            bucket = TokenBucket(20 / 60, 3) if chat_id < 0 else TokenBucket(1, 1)
+            chat_send_buckets[chat_id] = bucket
+            if len(chat_send_buckets) > CHAT_SEND_BUCKETS_MAX:
+                chat_send_buckets.popitem(last=False)
+        chat_send_buckets.move_to_end(chat_id)
+        return bucket
+
+def send_rate_limited(chat_id, text):
+    """Send one message under the broadcast rate limits. Returns 'sent', 'failed' or 'unreachable'."""
+    for attempt in range(BROADCAST_MAX_RETRIES + 1):
+        broadcast_bucket.acquire()
+        chat_send_bucket(chat_id).acquire()
+        try:
+            bot.send_message(chat_id, text)
+            return 'sent'
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code == 429:
+                # Telegram limits the bot as a whole, so every broadcast worker
+                # backs off, not only the one that was told to
+                retry_after = e.result_json.get('parameters', {}).get('retry_after', 1)
+                broadcast_bucket.pause(retry_after)
+                continue
+            if e.error_code in (400, 403) and any(err in e.description.lower() for err in UNREACHABLE_CHAT_ERRORS):
+                return 'unreachable'
+            print(f"Error sending broadcast to chat {chat_id}: {e}")
+            return 'failed'
+        except Exception as e:
+            print(f"Error sending broadcast to chat {chat_id}: {e}")
+            return 'failed'
+    return 'failed'
+
+def prune_chat(chat_id):
+    if chat_id > 0:
+        user_activity.remove(chat_id)
+    unregister_chat(chat_id)
+
+def acquire_broadcast_lease():
+    """Take the 'broadcast_runner' lease. Returns its token, or None if another worker holds it."""
+    token = uuid.uuid4().hex
+    return token if shared_state.add('broadcast_runner', token, ttl=BROADCAST_RUNNER_TTL) else None
+
+def broadcast_heartbeat(token, lost, stop):
+    renewed = time.monotonic()
+    while not stop.wait(BROADCAST_LEASE_RENEW_INTERVAL):
+        try:
+            if not shared_state.refresh('broadcast_runner', token, ttl=BROADCAST_RUNNER_TTL):
+                print("Broadcast lease was taken over by another worker. Stopping this runner.")
+                lost.set()
+                return
+            renewed = time.monotonic()
+        except Exception as e:
+            print(f"Error renewing broadcast lease: {e}")
+            # Once it may have expired, another worker could be sending already
+            if time.monotonic() - renewed >= BROADCAST_RUNNER_TTL:
+                lost.set()
+                return
+
+def save_broadcast_state():
+    with broadcast_lock:
+        snapshot = dict(broadcast_status, done=sorted(broadcast_status.get('done', ())))
+    if shared_state.shared:
+        shared_state.set('broadcast', snapshot)
+        return
+    try:
+        write_json_atomic(BROADCAST_FILE, snapshot)
+    except OSError as e:
+        print(f"Error saving broadcast state: {e}")
+
+def load_broadcast_state():
+    if shared_state.shared:
+        return shared_state.get('broadcast')
+    try:
+        with open(BROADCAST_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def broadcast_worker(chat_id, text, lease_lost):
+    if lease_lost.is_set():
+        return
+    result = send_rate_limited(chat_id, text)
+    if result == 'unreachable':
+        prune_chat(chat_id)
+    with broadcast_lock:
+        broadcast_status[result] = broadcast_status.get(result, 0) + 1
+        broadcast_status['done'].add(chat_id)
+
+def broadcast_batches():
+    """Yield (batch, cursor update) pairs: tracked groups and channels first, then
+    users streamed from the activity store in user_id order."""
+    chats = broadcast_status['chats']
+    while broadcast_status['chats_next'] < len(chats):
+        start = broadcast_status['chats_next']
+        yield chats[start:start + BROADCAST_BATCH_SIZE], {'chats_next': start + BROADCAST_BATCH_SIZE}
+    while True:
+        batch = user_activity.user_ids_after(broadcast_status['user_cursor'], BROADCAST_BATCH_SIZE)
+        if not batch:
+            return
+        yield batch, {'user_cursor': batch[-1]}
+
+def run_broadcast(token):
+    text = broadcast_status['text']
+    last_checkpoint = time.time()
+    lease_lost, stop_heartbeat = threading.Event(), threading.Event()
+    start_daemon(broadcast_heartbeat, token, lease_lost, stop_heartbeat)
+    try:
+        with ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix='broadcast') as executor:
+            for batch, cursor in broadcast_batches():
+                # 'done' holds the recipients of the current batch that were already
+                # handled. It is checkpointed while the batch is still being sent, so
+                # a broadcast resumed mid-batch only re-sends the messages of the
+                # last BROADCAST_CHECKPOINT_INTERVAL seconds.
+                pending = {executor.submit(broadcast_worker, chat_id, text, lease_lost)
+                           for chat_id in batch if chat_id not in broadcast_status['done']}
+                while pending:
+                    _, pending = wait(pending, timeout=BROADCAST_CHECKPOINT_INTERVAL)
+                    if pending and not lease_lost.is_set() and time.time() - last_checkpoint >= BROADCAST_CHECKPOINT_INTERVAL:
+                        save_broadcast_state()
+                        last_checkpoint = time.time()
+                if lease_lost.is_set():
+                    # The new runner resumes from the last checkpoint; don't overwrite it
+                    with broadcast_lock:
+                        broadcast_status['state'] = 'handed over'
+                    return
+                with broadcast_lock:
+                    broadcast_status.update(cursor)
+                    broadcast_status['done'].clear()
+                if time.time() - last_checkpoint >= BROADCAST_CHECKPOINT_INTERVAL:
+                    save_broadcast_state()
+                    last_checkpoint = time.time()
+    finally:
+        stop_heartbeat.set()
+    with broadcast_lock:
+        broadcast_status['state'] = 'finished'
+        broadcast_status['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    save_broadcast_state()
+    shared_state.release('broadcast_runner', token)
+    try:
+        bot.send_message(broadcast_status['requested_by'], broadcast_progress_text())
+    except Exception as e:
+        print(f"Error reporting broadcast result: {e}")
+
+def start_broadcast(text, requested_by):
+    with broadcast_lock:
+        if broadcast_status.get('state') == 'running':
+            return False
+        token = acquire_broadcast_lease()
+        if token is None:
+            return False  # another worker is sending one
+        channels, groups = tracked_chats()
+        chats = list(dict.fromkeys(channels + groups))
+        broadcast_status.clear()
+        broadcast_status.update({
+            'state': 'running',
+            'text': text,
+            'requested_by': requested_by,
+            'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'chats': chats,
+            'chats_next': 0,
+            'user_cursor': 0,
+            'total': len(chats) + user_activity.total(),
+            'done': set(),
+        })
+    save_broadcast_state()
+    threading.Thread(target=run_broadcast, args=(token,), daemon=True).start()
+    return True
+
+def resume_broadcast():
+    """Pick up an interrupted broadcast once no other worker is sending it."""
+    while True:
+        saved = load_broadcast_state()
+        if not saved or 'user_cursor' not in saved or saved.get('state') != 'running':
+            return
+        token = acquire_broadcast_lease()
+        if token is not None:
+            # Re-read in case the previous runner checkpointed since
+            saved = load_broadcast_state() or saved
+            break
+        time.sleep(BROADCAST_RUNNER_TTL)
+    saved['done'] = set(saved.get('done', ()))
+    with broadcast_lock:
+        broadcast_status.clear()
+        broadcast_status.update(saved)
+    print(f"Resuming broadcast after user {saved['user_cursor']} ({saved['chats_next']} chats done)")
+    run_broadcast(token)
+
+def broadcast_progress_text():
+    status = broadcast_status
+    if shared_state.shared and status.get('state') != 'running':
+        # The broadcast may be running on another worker
+        status = shared_state.get('broadcast') or status
+    if not status:
+        return "No broadcast has been sent yet."
+    handled = sum(status.get(result, 0) for result in ('sent', 'failed', 'unreachable'))
+    text = (
+        f"Broadcast {status['state']} (started {status['started_at']}): "
+        f"{handled}/{status['total']} handled, {status.get('sent', 0)} sent, "
+        f"{status.get('failed', 0)} failed, {status.get('unreachable', 0)} unreachable chats removed."
+    )
+    if status.get('finished_at'):
+        text += f"\nFinished at {status['finished_at']}."
+    return text
+
 def handle_broadcast_status(message):
-    user_id = message.from_user.id
-    if user_id == int(DEVELOPER_ID):
-        status_message = "Tracked channels:\n"
-        status_message += "\n".join([str(ch_id) for ch_id in channel_ids])
-        status_message += "\n\nTracked groups:\n"
-        status_message += "\n".join([str(gr_id) for gr_id in group_ids])
-        
-        if not channel_ids and not group_ids:
-            status_message = "No channels or groups are currently being tracked."
-        
-        bot.reply_to(message, status_message)
-    else:
-        bot.reply_to(message, "You are not authorized to use this command.")
+    channels, groups = tracked_chats()
+    status_message = "Tracked channels:\n"
+    status_message += "\n".join([str(ch_id) for ch_id in channels])
+    status_message += "\n\nTracked groups:\n"
+    status_message += "\n".join([str(gr_id) for gr_id in groups])
+    
+    if not channels and not groups:
+        status_message = "No channels or groups are currently being tracked."
+    
+    status_message += "\n\n" + broadcast_progress_text()
+    bot.reply_to(message, status_message)
 
 def handle_broadcast_message(message):
     user_id = message.from_user.id
-    if user_id != int(DEVELOPER_ID):
+    if not is_developer(user_id):
         bot.reply_to(message, "Access denied. This command is for developers only.")
         return
 
     broadcast_message = message.text
-    broadcast_status[message.from_user.id] = 'broadcasting'
-    
-    # Broadcast to all users
-    for user_id in user_last_interaction.keys():
-        try:
-            bot.send_message(user_id, broadcast_message)
-        except Exception as e:
-            print(f"Error sending message to user {user_id}: {e}")
-
-    # Broadcast to all channels and groups
-    for chat_id in channel_ids + group_ids:
-        try:
-            bot.send_message(chat_id, broadcast_message)
-        except Exception as e:
-            print(f"Error sending message to chat {chat_id}: {e}")
+    if not start_broadcast(broadcast_message, message.chat.id):
+        bot.send_message(message.chat.id, "A broadcast is already running. Use /broadcast_status to follow it.")
+        return
 
-    bot.send_message(message.chat.id, "Broadcasting message to all users, channels, and groups.")
-    bot.send_message(message.chat.id, f"Message sent: {broadcast_message}")
+    bot.send_message(
+        message.chat.id,
+        f"Broadcasting message to {broadcast_status['total']} users, channels, and groups. "
+        "Use /broadcast_status to follow progress."
+    )
 
-    # Clear the status
-    del broadcast_status[message.from_user.id]
+on_startup(start_daemon, resume_broadcast)
 
 def handle_id_command(message):
     user_id = message.from_user.id
@@ -735,82 +2924,374 @@ def handle_info_command(message):
     response = bot.send_message(chat_id, info_message, parse_mode='Markdown')
     delete_message_after_delay(message.chat.id, response.message_id)
 
+def is_developer(user_id):
+    return bool(DEVELOPER_ID) and str(user_id) == str(DEVELOPER_ID)
+
+# Command name (without '/') -> (handler, developer_only)
+COMMANDS = {
+    'help': (handle_help_command, False),
+    'recommend': (handle_recommend_command, False),
+    'start': (handle_start, False),
+    'id': (handle_id_command, False),
+    'info': (handle_info_command, False),
+    'searchmovie': (handle_search_movie_command, False),
+    'searchseries': (handle_search_series_command, False),
+    'searchseason': (handle_search_season_command, False),
+    'devinfo': (handle_devinfo_command, True),
+    'filter': (handle_filter_command, True),
+    'clearcache': (handle_clear_cache_command, True),
+    'stats': (handle_stats_command, True),
+    'reload': (handle_reload_command, True),
+    'broadcast': (handle_broadcast, True),
+    'broadcast_status': (handle_broadcast_status, True),
+    'preshorten': (handle_preshorten_command, True),
+    'warmup': (handle_warmup_command, True),
+}
+# Conversation step name -> handler(message, **data), see start_conversation
+CONVERSATION_STEPS = {
+    'recommend_media_type': process_media_type,
+    'recommend_genre': process_genre_selection,
+    'broadcast_message': handle_broadcast_message,
+}
+# command -> count, errors, rejected, total_seconds, max_seconds
+command_stats = defaultdict(lambda: defaultdict(float))
+COMMAND_RATE_PER_MINUTE = int(os.getenv('COMMAND_RATE_PER_MINUTE', '20'))
+COMMAND_BUCKETS_MAX = 10000
+command_buckets = OrderedDict()  # user_id -> TokenBucket, least recently used first
+command_buckets_lock = threading.Lock()
+
+def parse_command(text):
+    """Return the lower-cased command name of '/name@botname args', or None."""
+    if not text or not text.startswith('/'):
+        return None
+    token = text.split(maxsplit=1)[0][1:]
+    return token.split('@', 1)[0].lower() or None
+
+def require_developer(message, command, developer_only):
+    if developer_only and not is_developer(message.from_user.id):
+        bot.reply_to(message, "Access denied. This command is for developers only.")
+        return False
+    return True
+
+def limit_command_rate(message, command, developer_only):
+    user_id = message.from_user.id
+    if is_developer(user_id):
+        return True
+    with command_buckets_lock:
+        bucket = command_buckets.get(user_id)
+        if bucket is None:
+            bucket = command_buckets[user_id] = TokenBucket(COMMAND_RATE_PER_MINUTE / 60, COMMAND_RATE_PER_MINUTE)
+            if len(command_buckets) > COMMAND_BUCKETS_MAX:
+                command_buckets.popitem(last=False)
+        command_buckets.move_to_end(user_id)
+    if bucket.try_acquire():
+        bot.reply_to(message, "You're sending commands too quickly. Please wait a moment.")
+        return False
+    return True
+
+# Run in order before every command; returning False stops the command
+COMMAND_MIDDLEWARE = [require_developer, limit_command_rate]
+
+def dispatch_command(message):
+    command = parse_command(message.text)
+    entry = COMMANDS.get(command)
+    if entry is None:
+        return bot.reply_to(message, 'Unknown command. Please use /help to see available commands.')
+    handler, developer_only = entry
+    stats = command_stats[command]
+    for middleware in COMMAND_MIDDLEWARE:
+        if not middleware(message, command, developer_only):
+            stats['rejected'] += 1
+            return None
+
+    start = time.monotonic()
+    try:
+        return handler(message)
+    except Exception:
+        stats['errors'] += 1
+        raise
+    finally:
+        elapsed = time.monotonic() - start
+        stats['count'] += 1
+        stats['total_seconds'] += elapsed
+        stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+        observe_latency('handler_seconds', elapsed, handler=command)
+
+# Free-text searches are flood-controlled before any upstream work: a token
+# bucket per user (sized by the user's tier) and one per group chat, plus a
+# debounce that drops a query the same user sent moments ago. The developer
+# is exempt. Rejections are counted in bot_stats and shown in /stats. With a
+# shared STATE_BACKEND the limits are per-minute counters in the shared state
+# instead, so several workers enforce one limit between them.
+SEARCH_RATE_TIERS = {  # tier -> searches per minute, also the burst size
+    'default': int(os.getenv('SEARCH_RATE_PER_MINUTE', '10')),
+    'trusted': int(os.getenv('TRUSTED_SEARCH_RATE_PER_MINUTE', '60')),
+}
+TRUSTED_USER_IDS = set(json.loads(os.getenv('TRUSTED_USER_IDS', '[]')))
+SEARCH_CHAT_RATE_PER_MINUTE = int(os.getenv('SEARCH_CHAT_RATE_PER_MINUTE', '30'))
+SEARCH_DEBOUNCE_SECONDS = float(os.getenv('SEARCH_DEBOUNCE_SECONDS', '10'))
+# Tell a flooding user they're being limited at most this often
+FLOOD_NOTICE_INTERVAL = 30
+SEARCH_LIMITER_MAX = 20000
+search_buckets = OrderedDict()  # ('user' | 'chat', id) -> TokenBucket, least recently used first
+recent_searches = OrderedDict()  # user_id -> (normalized query, time)
+flood_notices = OrderedDict()  # user_id -> time the last notice was sent
+search_limiter_lock = threading.Lock()
+
+def user_tier(user_id):
+    return 'trusted' if user_id in TRUSTED_USER_IDS else 'default'
+
+def _remember(entries, key, value):
+    entries[key] = value
+    entries.move_to_end(key)
+    if len(entries) > SEARCH_LIMITER_MAX:
+        entries.popitem(last=False)
+
+def search_bucket(key, per_minute):
+    bucket = search_buckets.get(key)
+    if bucket is None:
+        bucket = TokenBucket(per_minute / 60, per_minute)
+    _remember(search_buckets, key, bucket)
+    return bucket
+
+def take_search(key, per_minute):
+    """Spend one search from the limit for key. Returns a function that gives it
+    back, or None if the limit is used up."""
+    if not shared_state.shared:
+        bucket = search_bucket(key, per_minute)
+        if bucket.try_acquire():
+            return None
+        return bucket.release
+    # Count first and give the search back if that went over the limit, like
+    # the OMDb quota counter
+    counter = f"search_limit:{key[0]}:{key[1]}:{int(time.time() // 60)}"
+    if shared_state.incr(counter, ttl=120) > per_minute:
+        shared_state.incr(counter, -1)
+        return None
+    return lambda: shared_state.incr(counter, -1)
+
+def is_repeated_search(user_id, query_key, now):
+    if shared_state.shared:
+        return shared_state.get(f"last_search:{user_id}") == query_key
+    previous = recent_searches.get(user_id)
+    return bool(previous and previous[0] == query_key and now - previous[1] < SEARCH_DEBOUNCE_SECONDS)
+
+def remember_search(user_id, query_key, now):
+    if shared_state.shared:
+        shared_state.set(f"last_search:{user_id}", query_key, ttl=math.ceil(SEARCH_DEBOUNCE_SECONDS))
+    else:
+        _remember(recent_searches, user_id, (query_key, now))
+
+def check_search_flood(message, query):
+    """Return None if the search may run, otherwise why it was rejected:
+    'debounced', 'user_limited' or 'chat_limited'."""
+    user_id = message.from_user.id
+    if is_developer(user_id):
+        return None
+    now = time.monotonic()
+    query_key = normalize_title(query)
+    with search_limiter_lock:
+        if is_repeated_search(user_id, query_key, now):
+            return 'debounced'
+        give_back = take_search(('user', user_id), SEARCH_RATE_TIERS[user_tier(user_id)])
+        if give_back is None:
+            return 'user_limited'
+        if message.chat.type != 'private' and take_search(('chat', message.chat.id), SEARCH_CHAT_RATE_PER_MINUTE) is None:
+            # The search never ran, so it shouldn't count against the user
+            give_back()
+            return 'chat_limited'
+        remember_search(user_id, query_key, now)
+    return None
+
+def reject_search(message, reason):
+    bot_stats[f'searches_{reason}'] += 1
+    schedule_deletion(message.chat.id, message.message_id, delay=80)
+    if reason == 'debounced':
+        return
+    user_id = message.from_user.id
+    now = time.monotonic()
+    if shared_state.shared:
+        if not shared_state.add(f"flood_notice:{user_id}", 1, ttl=FLOOD_NOTICE_INTERVAL):
+            return
+    else:
+        with search_limiter_lock:
+            if now - flood_notices.get(user_id, -FLOOD_NOTICE_INTERVAL) < FLOOD_NOTICE_INTERVAL:
+                return
+            _remember(flood_notices, user_id, now)
+    response = bot.reply_to(message, "You're searching too quickly. Please wait a moment and try again.")
+    schedule_deletion(message.chat.id, response.message_id, delay=20)
+
+SEASON_QUERY_RE = re.compile(r'(.*?)\s+season\s+(\d+)', re.IGNORECASE)
+
 @bot.message_handler(func=lambda message: True)
 def handle_all_messages(message):
+    search_query = accept_message(message)
+    if search_query is not None:
+        finish_message(message, search_and_reply(message, search_query))
+
+def accept_message(message):
+    """Do everything that comes before a search. Returns the search query, or None
+    if the message was a command or conversation step, filtered or flood-limited."""
     # Update user interaction timestamp
     user_id = message.from_user.id
-    user_last_interaction[user_id] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    user_activity.touch(user_id)
+    handle_new_message(message)
+    bot_stats['messages_received'] += 1
+    if continue_conversation(message):
+        return None
     
     # Check if the message is a command
     if message.text.startswith('/'):
-        # Handle commands as before
-        if '/help' in message.text:
-            response = handle_help_command(message)
-        elif '/recommend' in message.text:
-            response = handle_recommend_command(message)
-        elif '/start' in message.text:
-            response = handle_start(message)
-        elif '/devinfo' in message.text:
-            response = handle_devinfo_command(message)
-        elif '/filter' in message.text:
-            response = handle_filter_command(message)
-        elif '/clearcache' in message.text:
-            response = handle_clear_cache_command(message)
-        elif '/stats' in message.text:
-            response = handle_stats_command(message)
-        elif '/reload' in message.text:
-            response = handle_reload_command(message)
-        elif '/broadcast' in message.text:
-            response = handle_broadcast(message)
-        elif '/broadcast_status' in message.text:
-            response = handle_broadcast_status(message)
-        elif '/id' in message.text:
-            response = handle_id_command(message)
-        elif '/info' in message.text:
-            response = handle_info_command(message)
-        else:
-            response = bot.reply_to(message, 'Unknown command. Please use /help to see available commands.')
-    else:
-        # If not a command, treat as a search query
-        search_query = message.text.strip()
+        finish_message(message, dispatch_command(message))
+        return None
+    if filter_messages(message):
+        return None
+    # If not a command, treat as a search query
+    search_query = message.text.strip()
+    rejected = check_search_flood(message, search_query)
+    if rejected:
+        reject_search(message, rejected)
+        return None
+    return search_query
 
-        # Try to detect if it's a season search
-        season_match = re.match(r'(.*?)\s+season\s+(\d+)', search_query, re.IGNORECASE)
-        if season_match:
-            series_name = season_match.group(1)
-            season_number = season_match.group(2)
-            response = handle_search_season(message, series_name, season_number)
-        else:
-            # Try movie search first, then series
-            response = handle_search_movie(message, search_query)
-            if not response:
-                response = handle_search_series(message, search_query)
-        
+def search_and_reply(message, search_query):
+    start = time.monotonic()
+
+    # Try to detect if it's a season search
+    season_match = SEASON_QUERY_RE.match(search_query)
+    if season_match:
+        series_name = season_match.group(1)
+        season_number = season_match.group(2)
+        response = handle_search_season(message, series_name, season_number)
         if not response:
             response = bot.reply_to(message, f"Sorry, I couldn't find any information about '{search_query}'.")
+        observe_latency('handler_seconds', time.monotonic() - start, handler='season_search')
+    else:
+        # Try movie search first, then series
+        response = handle_search_movie_or_series(message, search_query)
+        observe_latency('handler_seconds', time.monotonic() - start, handler='search')
+    return response
 
+def finish_message(message, response):
     # Delete both the user's message and the bot's response after a short delay
     if response:
-        threading.Timer(80.0, delete_messages, args=[message.chat.id, message.message_id, response.message_id]).start()
+        schedule_deletion(message.chat.id, message.message_id, response.message_id, delay=80)
     else:
         # If no response was sent (unlikely, but possible), just delete the user's message
-        threading.Timer(80.0, delete_messages, args=[message.chat.id, message.message_id]).start()
+        schedule_deletion(message.chat.id, message.message_id, delay=80)
 
 def delete_messages(chat_id, *message_ids):
+    # Newer Bot API versions can delete up to 100 messages of a chat in one call
+    if len(message_ids) > 1 and hasattr(bot, 'delete_messages'):
+        try:
+            for i in range(0, len(message_ids), 100):
+                bot.delete_messages(chat_id, list(message_ids[i:i + 100]))
+            return
+        except Exception as e:
+            print(f"Error bulk deleting messages in chat {chat_id}: {e}")
     for msg_id in message_ids:
         try:
             bot.delete_message(chat_id, msg_id)
         except Exception as e:
             print(f"Error deleting message {msg_id}: {e}")
 
+# Message deletions are kept in one heap ordered by due time and run by a
+# single scheduler thread on a small worker pool, instead of one sleeping
+# thread per message. Pending deletions are saved every few seconds and at exit
+# so they survive redeploys.
+DELETIONS_FILE = os.getenv('DELETIONS_FILE', 'pending_deletions.json')
+DELETION_WORKERS = int(os.getenv('DELETION_WORKERS', '4'))
+DELETIONS_SAVE_INTERVAL = 10
+deletion_heap = []  # (due, chat_id, [message_ids])
+# (chat_id, message_id) -> due, so a message scheduled twice is only deleted once
+pending_deletions = {}
+deletion_cond = threading.Condition()
+deletions_dirty = False
+deletion_executor = ThreadPoolExecutor(max_workers=DELETION_WORKERS, thread_name_prefix='delete')
+
+def schedule_deletion(chat_id, *message_ids, delay=20):
+    global deletions_dirty
+    due = time.time() + delay
+    with deletion_cond:
+        new_ids = []
+        for msg_id in message_ids:
+            key = (chat_id, msg_id)
+            if key in pending_deletions and pending_deletions[key] <= due:
+                continue
+            pending_deletions[key] = due
+            new_ids.append(msg_id)
+        if not new_ids:
+            return
+        heapq.heappush(deletion_heap, (due, chat_id, new_ids))
+        deletions_dirty = True
+        deletion_cond.notify()
+
 def delete_message_after_delay(chat_id, message_id, delay=60):
-    def delete():
-        try:
-            bot.delete_message(chat_id, message_id)
-        except Exception as e:
-            print(f"Error deleting message {message_id}: {e}")
+    schedule_deletion(chat_id, message_id, delay=delay)
+
+def deletion_queue_depth():
+    return len(pending_deletions)
+
+def pop_due_deletions(now):
+    """Pop every due job and group the message ids by chat. Caller must hold deletion_cond."""
+    batches = defaultdict(list)
+    while deletion_heap and deletion_heap[0][0] <= now:
+        due, chat_id, message_ids = heapq.heappop(deletion_heap)
+        for msg_id in message_ids:
+            # Skip ids that were rescheduled to an earlier time by another job
+            if pending_deletions.get((chat_id, msg_id)) == due:
+                del pending_deletions[(chat_id, msg_id)]
+                batches[chat_id].append(msg_id)
+    return batches
+
+def save_pending_deletions():
+    global deletions_dirty
+    with deletion_cond:
+        if not deletions_dirty:
+            return
+        snapshot = [[chat_id, msg_id, due] for (chat_id, msg_id), due in pending_deletions.items()]
+        deletions_dirty = False
+    try:
+        write_json_atomic(DELETIONS_FILE, snapshot)
+    except OSError as e:
+        print(f"Error saving pending deletions: {e}")
+
+def load_pending_deletions():
+    try:
+        with open(DELETIONS_FILE, 'r') as f:
+            saved = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+    now = time.time()
+    # Deletions that fell due while we were down run straight away
+    for chat_id, msg_id, due in saved:
+        schedule_deletion(chat_id, msg_id, delay=max(0, due - now))
+
+def deletion_scheduler():
+    global deletions_dirty
+    last_save = time.time()
+    while True:
+        with deletion_cond:
+            now = time.time()
+            batches = pop_due_deletions(now)
+            if batches:
+                deletions_dirty = True
+            elif deletion_heap:
+                deletion_cond.wait(min(deletion_heap[0][0] - now, DELETIONS_SAVE_INTERVAL))
+            else:
+                deletion_cond.wait(DELETIONS_SAVE_INTERVAL)
+        for chat_id, message_ids in batches.items():
+            if async_bot is not None:
+                asyncio.run_coroutine_threadsafe(delete_messages_async(chat_id, *message_ids), update_loop)
+            else:
+                deletion_executor.submit(delete_messages, chat_id, *message_ids)
+        if time.time() - last_save >= DELETIONS_SAVE_INTERVAL:
+            save_pending_deletions()
+            last_save = time.time()
 
-    threading.Timer(delay, delete).start()
+on_startup(load_pending_deletions)
+on_startup(start_daemon, deletion_scheduler)
+on_startup(atexit.register, save_pending_deletions)
 
 # Update this function to manage user interaction timestamps
 #@bot.message_handler(func=lambda message: True)
@@ -819,18 +3300,625 @@ def delete_message_after_delay(chat_id, message_id, delay=60):
     # Track the last interaction
 #    user_last_interaction[user_id] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
+# Incoming updates are acknowledged straight away and handled by a pool of
+# workers. Each worker has its own bounded queue and every chat always maps to
+# the same worker, so messages of one chat are handled in order (a conversation
+# step never overtakes the command that started it). Set UPDATE_WORKERS=0 to handle
+# updates inline, e.g. on serverless hosts that freeze background threads.
+#
+# ASYNC_UPDATES=1 replaces the worker queues with one asyncio event loop. Each
+# update becomes a task chained after the previous update of the same chat, so
+# a slow chat never holds up the chats that happen to share its worker, and
+# waiting updates cost a coroutine instead of a queue slot on a fixed worker.
+# Free-text searches then run as coroutines on the loop (see the async search
+# path below); commands and other updates run on its thread pool
+# (ASYNC_HANDLER_THREADS).
+# Vercel freezes the function once the response is sent, so handle updates inline there
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '0' if os.getenv('VERCEL') else '4'))
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', '1000'))
+ASYNC_UPDATES = os.getenv('ASYNC_UPDATES', '0') == '1'
+ASYNC_HANDLER_THREADS = int(os.getenv('ASYNC_HANDLER_THREADS', '32'))
+RECENT_UPDATE_IDS_MAX = 10000
+update_queues = [queue.Queue(maxsize=max(1, UPDATE_QUEUE_SIZE // max(1, UPDATE_WORKERS)))
+                 for _ in range(0 if ASYNC_UPDATES else UPDATE_WORKERS)]
+update_loop = None
+chat_tails = {}  # chat_id -> task of the chat's latest update, only touched on the loop
+async_pending = 0  # updates accepted by the loop and not finished yet
+async_pending_lock = threading.Lock()
+recent_update_ids = OrderedDict()
+recent_update_ids_lock = threading.Lock()
+# enqueued, processed, duplicates, rejected, errors, total_wait_seconds, max_wait_seconds
+update_stats = defaultdict(float)
+
+def update_chat_id(update):
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'my_chat_member', 'chat_member'):
+        obj = getattr(update, field, None)
+        if obj is not None:
+            return obj.chat.id
+    callback_query = getattr(update, 'callback_query', None)
+    if callback_query is not None and callback_query.message is not None:
+        return callback_query.message.chat.id
+    return 0
+
+def is_duplicate_update(update_id):
+    """Remember update_id and report whether it was already seen (Telegram redelivers on timeouts)."""
+    with recent_update_ids_lock:
+        if update_id in recent_update_ids:
+            return True
+        recent_update_ids[update_id] = True
+        if len(recent_update_ids) > RECENT_UPDATE_IDS_MAX:
+            recent_update_ids.popitem(last=False)
+        return False
+
+def forget_update(update_id):
+    with recent_update_ids_lock:
+        recent_update_ids.pop(update_id, None)
+
+def process_update(update):
+    start = time.monotonic()
+    try:
+        bot.process_new_updates([update])
+        update_stats['processed'] += 1
+    except Exception as e:
+        update_stats['errors'] += 1
+        bot_stats['errors'] += 1
+        print(f"Error processing update {update.update_id}: {e}")
+    observe_latency('update_seconds', time.monotonic() - start)
+
+def enqueue_update(update, block=False):
+    """Queue an update for its chat's worker. Returns False if the queue is full."""
+    ensure_initialized()
+    if is_duplicate_update(update.update_id):
+        update_stats['duplicates'] += 1
+        return True
+    if ASYNC_UPDATES:
+        return submit_update_async(update, block)
+    if not update_queues:
+        process_update(update)
+        return True
+    worker_queue = update_queues[hash(update_chat_id(update)) % len(update_queues)]
+    try:
+        worker_queue.put((time.monotonic(), update), block=block)
+    except queue.Full:
+        # Let Telegram redeliver it later rather than dropping it
+        forget_update(update.update_id)
+        update_stats['rejected'] += 1
+        return False
+    update_stats['enqueued'] += 1
+    return True
+
+def record_queue_wait(enqueued_at):
+    waited = time.monotonic() - enqueued_at
+    observe_latency('update_queue_wait_seconds', waited)
+    update_stats['total_wait_seconds'] += waited
+    update_stats['max_wait_seconds'] = max(update_stats['max_wait_seconds'], waited)
+
+def update_worker(worker_queue):
+    while True:
+        enqueued_at, update = worker_queue.get()
+        record_queue_wait(enqueued_at)
+        process_update(update)
+        worker_queue.task_done()
+
+def start_update_loop():
+    global update_loop
+    update_loop = asyncio.new_event_loop()
+    update_loop.set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_HANDLER_THREADS, thread_name_prefix='update')
+    )
+    start_daemon(update_loop.run_forever)
+    asyncio.run_coroutine_threadsafe(open_async_clients(), update_loop).result()
+
+async def open_async_clients():
+    global async_bot, async_http_session, aiohttp
+    # Imported here so the default threaded mode doesn't pay for them at import
+    try:
+        import aiohttp
+        from telebot import asyncio_helper
+        from telebot.async_telebot import AsyncTeleBot
+    except ImportError:
+        print("ASYNC_UPDATES needs aiohttp. Running every handler on the handler threads instead.")
+        return
+    if os.getenv('TELEGRAM_API_URL'):
+        asyncio_helper.API_URL = os.getenv('TELEGRAM_API_URL')
+    async_bot = AsyncTeleBot(BOT_TOKEN)
+    async_http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=ASYNC_HTTP_CONNECTIONS))
+
+async def handle_update_async(update, enqueued_at, previous):
+    global async_pending
+    try:
+        if previous is not None:
+            # Errors are handled inside process_update_async, so this only waits
+            await asyncio.wait([previous])
+        record_queue_wait(enqueued_at)
+        await process_update_async(update)
+    finally:
+        with async_pending_lock:
+            async_pending -= 1
+
+async def process_update_async(update):
+    start = time.monotonic()
+    try:
+        message = update.message
+        if async_bot is not None and message is not None and message.text is not None:
+            await handle_message_async(message)
+        else:
+            await update_loop.run_in_executor(None, bot.process_new_updates, [update])
+        update_stats['processed'] += 1
+    except Exception as e:
+        update_stats['errors'] += 1
+        bot_stats['errors'] += 1
+        print(f"Error processing update {update.update_id}: {e}")
+    observe_latency('update_seconds', time.monotonic() - start)
+
+def schedule_update_task(update, enqueued_at):
+    chat_id = update_chat_id(update)
+    task = update_loop.create_task(handle_update_async(update, enqueued_at, chat_tails.get(chat_id)))
+    chat_tails[chat_id] = task
+    task.add_done_callback(lambda done: chat_tails.pop(chat_id) if chat_tails.get(chat_id) is done else None)
+
+def submit_update_async(update, block=False):
+    """Hand an update to the event loop. Returns False if UPDATE_QUEUE_SIZE updates are already pending."""
+    global async_pending
+    while True:
+        with async_pending_lock:
+            if async_pending < UPDATE_QUEUE_SIZE:
+                async_pending += 1
+                break
+        if not block:
+            forget_update(update.update_id)
+            update_stats['rejected'] += 1
+            return False
+        time.sleep(0.05)
+    update_loop.call_soon_threadsafe(schedule_update_task, update, time.monotonic())
+    update_stats['enqueued'] += 1
+    return True
+
+def update_queue_depth():
+    return sum(q.qsize() for q in update_queues) + async_pending
+
+# The search path as coroutines, used by ASYNC_UPDATES. A text message goes
+# through accept_message on a handler thread (commands, conversations, filters
+# and flood control stay synchronous), then the search itself runs on the
+# loop: OMDb lookups, genre searches and link shortening go through one
+# aiohttp session, and replies and deletions through AsyncTeleBot. Each
+# coroutine mirrors the synchronous function of the same name without the
+# _async suffix, and shares its cache keys, quota and statistics. Cache
+# and state calls stay synchronous; they are in-process or one Redis
+# round-trip.
+ASYNC_HTTP_CONNECTIONS = int(os.getenv('ASYNC_HTTP_CONNECTIONS', '100'))
+async_bot = None
+async_http_session = None
+aiohttp = None
+_async_inflight = {}  # key -> Task shared by concurrent callers, only touched on the loop
+# Per search count of lookups that had to go to OMDb, like lookup_trace
+async_lookup_misses = contextvars.ContextVar('async_lookup_misses', default=None)
+
+class FetchedResponse:
+    """The parts of a requests.Response the lookups use, for an aiohttp response read in full."""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+async def http_get_async(upstream, url, params=None, timeout=None, retries=None, priority='lookup'):
+    """http_request for coroutines. Connection errors and timeouts are re-raised as requests.ConnectionError."""
+    connect_timeout, read_timeout = timeout or HTTP_TIMEOUTS[upstream]
+    retries = HTTP_RETRIES[upstream] if retries is None else retries
+    # requests leaves out parameters that are None; aiohttp refuses them
+    params = {key: value for key, value in (params or {}).items() if value is not None}
+    for attempt in range(retries + 1):
+        if attempt:
+            with upstream_stats_lock:
+                upstream_stats[upstream]['retries'] += 1
+            await asyncio.sleep(random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt)))
+        if upstream == 'omdb':
+            await acquire_api_call_async(priority)
+        start = time.monotonic()
+        try:
+            async with async_http_session.get(
+                url, params=params, timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+            ) as response:
+                status, text = response.status, await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            record_upstream_call(upstream, time.monotonic() - start, failed=True)
+            if attempt == retries:
+                raise requests.ConnectionError(str(e) or type(e).__name__) from e
+            continue
+        record_upstream_call(upstream, time.monotonic() - start, failed=status >= 500)
+        if status < 500 or attempt == retries:
+            return FetchedResponse(status, text)
+
+async def telegram_async(method, *args, **kwargs):
+    """Call an AsyncTeleBot method, timed like send_telegram_request times the threaded bot."""
+    start = time.monotonic()
+    try:
+        result = await getattr(async_bot, method)(*args, **kwargs)
+    except Exception as e:
+        # Bot API errors such as a blocked chat are answers, not upstream failures
+        record_upstream_call('telegram', time.monotonic() - start, failed=getattr(e, 'error_code', 500) >= 500)
+        raise
+    record_upstream_call('telegram', time.monotonic() - start)
+    return result
+
+def run_deduplicated_async(key, func, *args, stat='deduplicated_requests'):
+    """Run the coroutine func(*args) once for concurrent callers with the same key. Returns its Task."""
+    task = _async_inflight.get(key)
+    if task is not None:
+        bot_stats[stat] += 1
+        return task
+    task = _async_inflight[key] = asyncio.ensure_future(func(*args))
+    task.add_done_callback(lambda done: _async_inflight.pop(key) if _async_inflight.get(key) is done else None)
+    return task
+
+async def invoke_rest_method_async(url, params=None, priority='lookup'):
+    if not check_api_limit(priority):
+        return {'Response': 'False', 'Error': 'Daily API limit reached. Please try again tomorrow.'}
+    try:
+        response = await http_get_async('omdb', url, params=params, priority=priority)
+        if response.status_code == 200:
+            return response.json()
+        return {'Response': 'False', 'Error': f"HTTP Error: {response.status_code}"}
+    except Exception as e:
+        return {'Response': 'False', 'Error': str(e)}
+
+async def fetch_omdb_data_async(cache_key, params, priority='lookup'):
+    async def fetch():
+        misses = async_lookup_misses.get()
+        if misses is not None:
+            misses[0] += 1
+        data = await invoke_rest_method_async(OMDB_API_URL, params, priority)
+        cache_omdb_data(cache_key, data)
+        return data
+
+    cached_data = get_cached_omdb_data(cache_key)
+    if cached_data is not None:
+        return cached_data
+    # Shielded so a caller that gives up doesn't cancel the lookup for the others
+    return await asyncio.shield(run_deduplicated_async(f"omdb:{cache_key}", fetch, stat='coalesced_lookups'))
+
+async def get_movie_data_async(movie_name, priority='lookup'):
+    params = {'apikey': OMDB_API_KEY, 't': movie_name}
+    return await fetch_omdb_data_async(f"movie:{normalize_title(movie_name)}", params, priority)
+
+async def get_series_data_async(series_name, priority='lookup'):
+    params = {'apikey': OMDB_API_KEY, 't': series_name, 'type': 'series'}
+    return await fetch_omdb_data_async(f"series:{normalize_title(series_name)}", params, priority)
+
+async def get_season_data_async(imdb_id, season_number, priority='lookup'):
+    params = {'apikey': OMDB_API_KEY, 'i': imdb_id, 'Season': season_number}
+    return await fetch_omdb_data_async(f"season:{imdb_id}:{season_number}", params, priority)
+
+async def search_genre_async(genre, media_type, priority='recommendation'):
+    cache_key = f"genre:{media_type}:{genre.lower()}"
+    cached_data = get_cached_data(cache_key)
+    if cached_data is not None:
+        return cached_data
+    params = {'apikey': OMDB_API_KEY, 's': genre, 'type': media_type}
+    try:
+        response = await http_get_async('omdb', OMDB_API_URL, params=params,
+                                        timeout=(HTTP_TIMEOUTS['omdb'][0], RECOMMENDATION_DEADLINE), priority=priority)
+    except requests.RequestException as e:
+        print(f"Error searching genre {genre}: {e}")
+        raise
+    if response.status_code != 200:
+        raise requests.HTTPError(f"OMDb returned HTTP {response.status_code} for genre {genre}")
+    return store_genre_results(cache_key, response.json())
+
+async def search_genres_async(genres, media_type, deadline=RECOMMENDATION_DEADLINE, priority='recommendation'):
+    tasks = [run_deduplicated_async(f"genre:{media_type}:{genre.lower()}", search_genre_async, genre, media_type, priority)
+             for genre in genres]
+    if not tasks:
+        return [], True
+    # Searches still running at the deadline finish in the background and land in the genre cache
+    waiters = [asyncio.shield(task) for task in tasks]
+    for future in tasks + waiters:
+        # Failures are counted below; don't also log them as never retrieved
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+    done, not_done = await asyncio.wait(waiters, timeout=deadline)
+    titles = []
+    failed = 0
+    for task in tasks:
+        if task.done() and not task.cancelled() and task.exception() is None:
+            titles.extend(task.result())
+        elif task.done():
+            failed += 1
+    if not_done:
+        print(f"Genre search deadline exceeded for {len(not_done)} of {len(tasks)} genres")
+    return titles, not not_done and not failed
+
+async def find_recommendations_async(title, media_type):
+    cache_key = f"recommendations:{media_type}:{normalize_title(title)}"
+    cached = cached_recommendations(cache_key)
+    if cached is not None:
+        return cached
+
+    if media_type == 'movie':
+        data = await get_movie_data_async(title)
+    else:
+        data = await get_series_data_async(title)
+    if not data or 'Genre' not in data:
+        return [], False
+
+    recommendations = recommend_similar(data, media_type)
+    if len(recommendations) >= 5:
+        bot_stats['recommendations_from_index'] += 1
+        set_cached_data(cache_key, recommendations)
+        return recommendations, True
+
+    titles, complete = await search_genres_async(data['Genre'].split(', '), media_type)
+    return add_genre_results(cache_key, recommendations, titles, complete, (title, data.get('Title')))
+
+async def shorten_url_async(long_url, timeout=SHORTEN_TIMEOUT):
+    short_url = short_urls.get(long_url)
+    if short_url:
+        bot_stats['short_url_hits'] += 1
+        return short_url
+    params = {'api': MDISK_API_KEY, 'url': long_url, 'format': 'text'}
+    try:
+        response = await http_get_async('shortener', SHORTENER_API_URL, params=params,
+                                        timeout=(HTTP_TIMEOUTS['shortener'][0], timeout))
+    except requests.RequestException as e:
+        print(f"An error occurred: {e}")
+        return long_url
+    short_url = response.text.strip() if response.status_code == 200 else ''
+    if not short_url:
+        print(f"Failed to shorten URL. Status code: {response.status_code}")
+        return long_url
+    remember_short_url(long_url, short_url)
+    return short_url
+
+async def shorten_urls_async(long_urls, timeout=SHORTEN_TIMEOUT):
+    results = [short_urls.get(url) for url in long_urls]
+    pending = {i: run_deduplicated_async(f"shorten:{url}", shorten_url_async, url, timeout)
+               for i, url in enumerate(long_urls) if not results[i]}
+    if pending:
+        await asyncio.wait([asyncio.shield(task) for task in pending.values()], timeout=timeout)
+        for i, task in pending.items():
+            if task.done() and not task.cancelled() and task.exception() is None:
+                results[i] = task.result()
+            else:
+                # Late results still land in short_urls for the next request
+                bot_stats['short_url_timeouts'] += 1
+                results[i] = long_urls[i]
+    return results
+
+async def prefetch_season_async(series_data, season_number):
+    season_data = await get_season_data_async(series_data['imdbID'], season_number, 'recommendation')
+    if season_data and season_data.get('Response') == 'True':
+        await shorten_url_async(season_link(series_data, season_number))
+        bot_stats['seasons_prefetched'] += 1
+
+async def send_rendered_reply_async(chat_id, entry):
+    markup = types.InlineKeyboardMarkup.de_json(entry['markup']) if entry.get('markup') else None
+    return await telegram_async('send_message', chat_id, entry['text'], parse_mode='HTML', reply_markup=markup)
+
+async def handle_search_title_async(message, name, media_type):
+    source_key = f"{media_type}:{normalize_title(name)}"
+    reply_key = f"reply:{source_key}"
+    rendered = get_rendered_reply(reply_key)
+    if rendered:
+        record_title_request(rendered['title'], media_type)
+        return await send_rendered_reply_async(message.chat.id, rendered)
+
+    data = await (get_movie_data_async(name) if media_type == 'movie' else get_series_data_async(name))
+    if not data or 'Error' in data:
+        return None
+    record_title_request(data['Title'], media_type)
+    long_links = build_reply_links(data, media_type)
+    links, (recommendations, complete) = await asyncio.gather(shorten_urls_async(long_links),
+                                                              find_recommendations_async(name, media_type))
+    text = compose_title_reply(data, media_type, links, recommendations)
+    if complete and links_shortened(links, long_links):
+        set_rendered_reply(reply_key, source_key, data['Title'], text)
+    return await telegram_async('send_message', message.chat.id, text, parse_mode='HTML')
+
+async def handle_search_movie_async(message, movie_name):
+    if not check_api_limit():
+        return await telegram_async('reply_to', message, 'My Daily limit reached. Please try again tomorrow.')
+    response = await handle_search_title_async(message, movie_name, 'movie')
+    if response:
+        return response
+    response = await telegram_async('reply_to', message, 'Please provide a movie name after the /searchmovie command.\nFor example: /searchmovie Inception')
+    schedule_deletion(message.chat.id, message.message_id, response.message_id)
+
+async def handle_search_series_async(message, series_name):
+    if not check_api_limit():
+        return await telegram_async('reply_to', message, 'My Daily limit reached. Please try again tomorrow.')
+    return await handle_search_title_async(message, series_name, 'series')
+
+async def handle_search_movie_or_series_async(message, search_query):
+    print(f"Searching for: {search_query}")
+    misses = [0]
+    async_lookup_misses.set(misses)
+    try:
+        match = resolve_title(search_query, exact=True)
+        if match:
+            search_query = match[1]
+            if match[3] == 'series':
+                response = (await handle_search_series_async(message, search_query)
+                            or await handle_search_movie_async(message, search_query))
+            else:
+                response = (await handle_search_movie_async(message, search_query)
+                            or await handle_search_series_async(message, search_query))
+        else:
+            if PARALLEL_TITLE_LOOKUP and check_api_limit('recommendation'):
+                # Joined by handle_search_series_async through fetch_omdb_data_async
+                asyncio.ensure_future(get_series_data_async(search_query, 'recommendation'))
+            response = await handle_search_movie_async(message, search_query)
+            if not response:
+                response = await handle_search_series_async(message, search_query)
+        if not response:
+            match = resolve_title(search_query)
+            if match and normalize_title(match[1]) != normalize_title(search_query) and check_api_limit():
+                response = await handle_search_title_async(message, match[1], 'series' if match[3] == 'series' else 'movie')
+        if response:
+            record_search(misses[0] == 0)
+        if not response:
+            reply = f"Sorry, I couldn't find any information about '{search_query}'."
+            suggestions = suggest_titles(search_query)
+            if suggestions:
+                reply += "\nDid you mean: " + ", ".join(f"{entry[1]} ({entry[2]})" for entry in suggestions) + "?"
+            response = await telegram_async('reply_to', message, reply)
+        return response
+    except Exception as e:
+        print(f"Error in handle_search_movie_or_series_async: {e}")
+        return await telegram_async('reply_to', message, "An error occurred while processing your request. Please try again later.")
+
+async def handle_search_season_async(message, series_name, season_number):
+    if not check_api_limit():
+        return await telegram_async('reply_to', message, 'My Daily limit reached. Please try again tomorrow.')
+    misses = [0]
+    async_lookup_misses.set(misses)
+    series_data = await get_series_data_async(series_name)
+    if series_data and series_data.get('Response') == 'True':
+        source_key = f"season:{series_data['imdbID']}:{season_number}"
+        rendered = get_rendered_reply(f"reply:{source_key}")
+        if rendered:
+            record_search(True)
+            record_title_request(series_data['Title'], 'series')
+            return await send_rendered_reply_async(message.chat.id, rendered)
+
+        season_data = await get_season_data_async(series_data['imdbID'], season_number)
+        if season_data and season_data.get('Response') == 'True':
+            record_search(misses[0] == 0)
+            record_title_request(series_data['Title'], 'series')
+            next_season = int(season_number) + 1
+            if next_season <= total_seasons(season_data) and check_api_limit('recommendation'):
+                asyncio.ensure_future(prefetch_season_async(series_data, next_season))
+            long_link = season_link(series_data, season_number)
+            short_link = await shorten_url_async(long_link)
+            formatted_data = format_season_data(series_data, season_data, season_number, short_link)
+            if short_link != long_link:
+                set_rendered_reply(f"reply:{source_key}", source_key, series_data['Title'], formatted_data)
+            return await telegram_async('send_message', message.chat.id, formatted_data, parse_mode='HTML')
+    return None
+
+async def search_and_reply_async(message, search_query):
+    start = time.monotonic()
+    season_match = SEASON_QUERY_RE.match(search_query)
+    if season_match:
+        response = await handle_search_season_async(message, season_match.group(1), season_match.group(2))
+        if not response:
+            response = await telegram_async('reply_to', message, f"Sorry, I couldn't find any information about '{search_query}'.")
+        observe_latency('handler_seconds', time.monotonic() - start, handler='season_search')
+    else:
+        response = await handle_search_movie_or_series_async(message, search_query)
+        observe_latency('handler_seconds', time.monotonic() - start, handler='search')
+    return response
+
+async def handle_message_async(message):
+    search_query = await update_loop.run_in_executor(None, accept_message, message)
+    if search_query is not None:
+        finish_message(message, await search_and_reply_async(message, search_query))
+
+async def delete_messages_async(chat_id, *message_ids):
+    if len(message_ids) > 1 and hasattr(async_bot, 'delete_messages'):
+        try:
+            for i in range(0, len(message_ids), 100):
+                await telegram_async('delete_messages', chat_id, list(message_ids[i:i + 100]))
+            return
+        except Exception as e:
+            print(f"Error bulk deleting messages in chat {chat_id}: {e}")
+    for msg_id in message_ids:
+        try:
+            await telegram_async('delete_message', chat_id, msg_id)
+        except Exception as e:
+            print(f"Error deleting message {msg_id}: {e}")
+
+for _worker_queue in update_queues:
+    on_startup(start_daemon, update_worker, _worker_queue)
+if ASYNC_UPDATES:
+    on_startup(start_update_loop)
+
+def poll_updates():
+    """Long-poll Telegram and feed updates through the same worker queues as the webhook."""
+    offset = None
+    while True:
+        try:
+            updates = bot.get_updates(offset=offset, timeout=30, long_polling_timeout=30)
+        except Exception as e:
+            print(f"Error polling updates: {e}")
+            time.sleep(3)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            enqueue_update(update, block=True)
+
 # Add this new route for the webhook
 @app.route('/' + BOT_TOKEN, methods=['POST'])
 def webhook():
     json_string = request.get_data().decode('utf-8')
     update = telebot.types.Update.de_json(json_string)
-    bot.process_new_updates([update])
+    if not enqueue_update(update):
+        return 'Busy', 503
     return 'OK', 200
 
+def format_labels(labels):
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}' if labels else ''
+
+def render_metrics():
+    """All counters, gauges and histograms in the Prometheus text exposition format."""
+    lines = []
+
+    def add(name, kind, samples):
+        lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{METRICS_PREFIX}{name}{format_labels(labels)} {value}")
+
+    add('events_total', 'counter', [((('event', event),), count) for event, count in sorted(bot_stats.items())])
+    with upstream_stats_lock:
+        upstream_samples = sorted((upstream, dict(stats)) for upstream, stats in upstream_stats.items())
+    for field in ('calls', 'errors', 'retries'):
+        add(f'upstream_{field}_total', 'counter',
+            [((('upstream', upstream),), int(stats.get(field, 0))) for upstream, stats in upstream_samples])
+    add('command_total', 'counter', [((('command', command),), int(stats['count'])) for command, stats in sorted(command_stats.items())])
+    add('cache_events_total', 'counter', [((('event', event),), count) for event, count in sorted(cache.stats.items())])
+    add('cache_hit_ratio', 'gauge', [((), round(cache.hit_ratio(), 4))])
+    add('update_queue_depth', 'gauge', [((), update_queue_depth())])
+    add('deletion_queue_depth', 'gauge', [((), deletion_queue_depth())])
+    add('omdb_requests_today', 'gauge', [((), API_REQUEST_COUNT)])
+    add('title_index_size', 'gauge', [((), len(title_index))])
+    add('threads', 'gauge', [((), threading.active_count())])
+    add('startup_seconds', 'gauge', [((('phase', phase.split('_')[0]),), round(seconds, 4))
+                                     for phase, seconds in sorted(startup_stats.items())])
+
+    with latency_histograms_lock:
+        histograms = sorted((key, list(h.counts), h.count, h.sum) for key, h in latency_histograms.items())
+    typed = set()
+    for (name, labels), counts, count, total in histograms:
+        if name not in typed:
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+            cumulative += n
+            lines.append(f"{METRICS_PREFIX}{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+        lines.append(f"{METRICS_PREFIX}{name}_sum{format_labels(labels)} {total:.6f}")
+        lines.append(f"{METRICS_PREFIX}{name}_count{format_labels(labels)} {count}")
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics')
+def metrics():
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+            return 'Forbidden', 403
+    elif not METRICS_PUBLIC:
+        return 'Not Found', 404
+    ensure_initialized()
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
 @app.route('/')
 def home():
     return 'Bot is running!'
 
+startup_stats['import_seconds'] = time.perf_counter() - _module_started
+if not LAZY_INIT:
+    ensure_initialized()
+
 if __name__ == '__main__':
     if os.environ.get('ENVIRONMENT') == 'production':
         webhook_url = os.environ.get('WEBHOOK_URL')
@@ -844,4 +3932,9 @@ if __name__ == '__main__':
             print("WEBHOOK_URL is not set. Please set it in your Render environment variables.")
     else:
         bot.remove_webhook()
-        bot.polling(none_stop=True)
+        # Plain polling hands updates straight to telebot, bypassing enqueue_update
+        ensure_initialized()
+        if UPDATE_WORKERS or ASYNC_UPDATES:
+            poll_updates()
+        else:
+            bot.polling(none_stop=True)
@@ -0,0 +1,64 @@
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+# The bot reads its configuration at import time. Import it with lazy startup,
+# dummy credentials and every state file in a scratch directory.
+os.environ.update({
+    'BOT_TOKEN': '123456:test',
+    'DEVELOPER_ID': '1',
+    'LAZY_INIT': '1',
+    'UPDATE_WORKERS': '0',
+    'STATE_BACKEND': 'memory',
+    'CACHE_BACKEND': 'memory',
+    'WARMUP_ON_START': '0',
+})
+os.environ.pop('RENDER_API_KEY', None)
+os.chdir(tempfile.mkdtemp(prefix='movizinfo-tests-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import movie_filter_bot  # noqa: E402
+
+
+@pytest.fixture
+def bot_module():
+    return movie_filter_bot
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Freeze time.time() at a value the test can move forward."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(movie_filter_bot.time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def omdb(monkeypatch):
+    """Answer OMDb requests locally, counting them against the real quota."""
+    calls = []
+
+    def http_get(upstream, url, params=None, priority='lookup', **kwargs):
+        movie_filter_bot.acquire_api_call(priority)
+        calls.append((priority, params.get('t') or params.get('s') or params.get('Season')))
+        if 't' in params:
+            data = {'Response': 'True', 'Title': params['t'], 'Year': '2000', 'Type': params.get('type', 'movie'),
+                    'imdbID': f"tt{len(calls)}", 'Genre': 'Drama, Crime, Mystery, War', 'Director': '', 'Actors': ''}
+        else:
+            data = {'Response': 'True', 'Search': []}
+        return SimpleNamespace(status_code=200, json=lambda: data)
+
+    monkeypatch.setattr(movie_filter_bot, 'http_get', http_get)
+    monkeypatch.setattr(movie_filter_bot, 'cache', movie_filter_bot.LRUCache(100, 10 ** 6, movie_filter_bot.CACHE_TTLS))
+    monkeypatch.setattr(movie_filter_bot, 'API_REQUEST_COUNT', 0)
+    monkeypatch.setattr(movie_filter_bot, 'warmup_calls_today', 0)
+    monkeypatch.setattr(movie_filter_bot, 'shared_state', movie_filter_bot.MemoryState())
+    monkeypatch.setattr(movie_filter_bot, 'title_index', {})
+    monkeypatch.setattr(movie_filter_bot, 'title_norms', None)
+    monkeypatch.setattr(movie_filter_bot, 'shorten_urls', lambda urls: urls)
+    monkeypatch.setattr(movie_filter_bot, 'save_short_urls', lambda: None)
+    monkeypatch.setattr(movie_filter_bot, 'popular_titles', movie_filter_bot.defaultdict(int))
+    return calls
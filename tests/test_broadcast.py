@@ -0,0 +1,111 @@
+import threading
+import time
+
+import fakeredis
+import pytest
+
+import movie_filter_bot as m
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def state(request):
+    if request.param == 'memory':
+        return m.MemoryState()
+    return m.RedisState(fakeredis.FakeRedis())
+
+
+def test_lease_is_only_renewed_and_released_by_its_holder(state):
+    assert state.add('lease', 'mine', ttl=30)
+    assert state.refresh('lease', 'mine', ttl=30)
+    assert not state.refresh('lease', 'theirs', ttl=30)
+    state.release('lease', 'theirs')
+    assert state.get('lease') == 'mine'
+    state.release('lease', 'mine')
+    assert state.get('lease') is None
+    assert not state.refresh('lease', 'mine', ttl=30)
+
+
+@pytest.fixture
+def broadcast(monkeypatch):
+    sent, saved = [], []
+    monkeypatch.setattr(m, 'shared_state', m.MemoryState())
+    monkeypatch.setattr(m, 'user_activity', m.UserActivityStore(':memory:'))
+    monkeypatch.setattr(m, 'BROADCAST_WORKERS', 2)
+    monkeypatch.setattr(m, 'BROADCAST_LEASE_RENEW_INTERVAL', 0.02)
+    monkeypatch.setattr(m, 'send_rate_limited', lambda chat_id, text: (time.sleep(0.01), sent.append(chat_id))[0] or 'sent')
+    monkeypatch.setattr(m, 'save_broadcast_state', lambda: saved.append(time.monotonic()))
+    monkeypatch.setattr(m.bot, 'send_message', lambda *args, **kwargs: None)
+    monkeypatch.setattr(m, 'broadcast_status', {
+        'state': 'running', 'text': 'hi', 'requested_by': 1, 'chats': list(range(-1, -201, -1)),
+        'chats_next': 0, 'user_cursor': 0, 'total': 200, 'done': set(),
+    })
+    return sent, saved
+
+
+def test_runner_keeps_its_lease_while_sending(broadcast):
+    sent, _ = broadcast
+    token = m.acquire_broadcast_lease()
+    m.run_broadcast(token)
+    assert len(sent) == 200
+    assert m.broadcast_status['state'] == 'finished'
+    assert m.shared_state.get('broadcast_runner') is None
+
+
+def test_runner_stops_once_another_worker_holds_the_lease(broadcast):
+    sent, saved = broadcast
+    token = m.acquire_broadcast_lease()
+    runner = threading.Thread(target=m.run_broadcast, args=(token,))
+    runner.start()
+    while len(sent) < 20:
+        time.sleep(0.005)
+    # The lease expired and another worker took it
+    m.shared_state.set('broadcast_runner', 'other', ttl=30)
+    taken_over = time.monotonic()
+    runner.join(10)
+    assert not runner.is_alive()
+    assert len(sent) < 200
+    assert m.broadcast_status['state'] == 'handed over'
+    assert m.shared_state.get('broadcast_runner') == 'other'
+    assert all(at < taken_over + m.BROADCAST_LEASE_RENEW_INTERVAL * 2 for at in saved)
+
+
+def test_paused_bucket_hands_out_nothing_then_refills_from_empty():
+    bucket = m.TokenBucket(10, 10)
+    bucket.pause(0.2)
+    assert bucket.try_acquire() > 0.2
+    time.sleep(0.22)
+    assert 0 < bucket.try_acquire() <= 0.1  # no burst of tokens saved up during the pause
+    time.sleep(0.1)
+    assert bucket.try_acquire() == 0
+
+
+def test_rate_limit_reply_pauses_every_broadcast_worker(monkeypatch):
+    monkeypatch.setattr(m, 'broadcast_bucket', m.TokenBucket(1000, 1000))
+    monkeypatch.setattr(m, 'chat_send_buckets', m.OrderedDict())
+    attempts, limited = [], []
+    lock = threading.Lock()
+
+    def send_message(chat_id, text):
+        with lock:
+            attempts.append(time.monotonic())
+            if not limited:
+                limited.append(time.monotonic())
+                raise m.telebot.apihelper.ApiTelegramException('sendMessage', None, {
+                    'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                    'parameters': {'retry_after': 0.3}})
+        time.sleep(0.01)
+    monkeypatch.setattr(m.bot, 'send_message', send_message)
+    results = []
+
+    def worker(first):
+        for chat_id in range(first, first - 5, -1):
+            results.append(m.send_rate_limited(chat_id, 'hi'))
+    workers = [threading.Thread(target=worker, args=(-10 * n,)) for n in range(1, 5)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join(10)
+    assert results.count('sent') == 20
+    # Sends already past the bucket may land just after the 429; none start later in the pause
+    paused = [at for at in attempts if limited[0] + 0.05 < at < limited[0] + 0.3]
+    assert paused == []
@@ -0,0 +1,163 @@
+import fakeredis
+import pytest
+
+import movie_filter_bot as m
+
+
+def make_backend(kind, tmp_path, max_items=3):
+    ttls = {'movie': 60, 'season': 600}
+    if kind == 'memory':
+        return m.LRUCache(max_items, 1_000_000, ttls)
+    if kind == 'sqlite':
+        return m.SQLiteCache(str(tmp_path / 'cache.db'), max_items, ttls=ttls)
+    return m.RedisCache(fakeredis.FakeRedis(), prefix='test:', ttls=ttls)
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def backend(request, tmp_path):
+    return make_backend(request.param, tmp_path)
+
+
+def test_get_set_and_stats(backend):
+    assert backend.get('movie:a') is None
+    backend.set('movie:a', {'Title': 'A'})
+    assert backend.get('movie:a') == {'Title': 'A'}
+    assert backend.stats['hits'] == 1
+    assert backend.stats['misses'] == 1
+    backend.delete('movie:a')
+    assert backend.get('movie:a') is None
+
+
+def test_max_age_rejects_older_entries(backend, clock):
+    backend.set('movie:a', 1)
+    clock[0] += 30
+    assert backend.get('movie:a', max_age=60) == 1
+    assert backend.get('movie:a', max_age=10) is None
+
+
+@pytest.mark.parametrize('kind', ['memory', 'sqlite'])
+def test_namespace_ttl_expires_entries(kind, tmp_path, clock):
+    backend = make_backend(kind, tmp_path)
+    backend.set('movie:a', 1)
+    backend.set('season:a:1', 2)
+    clock[0] += 61
+    assert backend.get('movie:a') is None
+    assert backend.get('season:a:1') == 2
+    assert backend.stats['expired'] == 1
+
+
+@pytest.mark.parametrize('kind', ['memory', 'sqlite'])
+def test_sweep_removes_expired_entries(kind, tmp_path, clock):
+    backend = make_backend(kind, tmp_path)
+    backend.set('movie:a', 1)
+    backend.set('season:a:1', 2)
+    clock[0] += 61
+    assert backend.sweep() == 1
+    assert len(backend) == 1
+
+
+def test_redis_sets_expiry_from_namespace_ttl():
+    client = fakeredis.FakeRedis()
+    backend = m.RedisCache(client, prefix='test:', ttls={'movie': 60})
+    backend.set('movie:a', 1)
+    backend.set('movie:b', 1, ttl=5)
+    assert 0 < client.ttl('test:cache:movie:a') <= 60
+    assert 0 < client.ttl('test:cache:movie:b') <= 5
+
+
+def test_redis_clear_leaves_state_and_activity_keys_alone():
+    client = fakeredis.FakeRedis()
+    backend = m.RedisCache(client, prefix='test:')
+    state = m.RedisState(client, prefix='test:')
+    activity = m.RedisUserActivityStore(client, prefix='test:')
+    backend.set('movie:a', 1)
+    state.incr('omdb_calls:2026-01-01', ttl=60)
+    state.set('broadcast_runner', 'token')
+    activity.touch(42)
+    activity.flush()
+    client.sadd('test:group_ids', -5)
+    assert len(backend) == 1
+    assert backend.clear() == 1
+    assert backend.get('movie:a') is None
+    assert state.get('omdb_calls:2026-01-01') == 1
+    assert state.get('broadcast_runner') == 'token'
+    assert client.zscore('test:users:ids', 42) is not None
+    assert client.smembers('test:group_ids') == {b'-5'}
+
+
+@pytest.mark.parametrize('kind', ['memory', 'sqlite'])
+def test_least_recently_used_entry_is_evicted(kind, tmp_path, clock):
+    backend = make_backend(kind, tmp_path)
+    for key in ('movie:a', 'movie:b', 'movie:c'):
+        backend.set(key, key)
+        clock[0] += 1
+    backend.get('movie:a')
+    clock[0] += 1
+    backend.set('movie:d', 'd')
+    assert backend.get('movie:b') is None
+    assert backend.get('movie:a') == 'movie:a'
+    assert backend.stats['evictions'] == 1
+
+
+def test_memory_cache_is_bounded_by_bytes():
+    backend = m.LRUCache(100, 200)
+    for i in range(10):
+        backend.set(f'movie:{i}', 'x' * 50)
+    assert backend.size_bytes <= 200
+    assert len(backend) < 10
+
+
+def test_clear_counts_removed_entries(backend):
+    backend.set('movie:a', 1)
+    backend.set('movie:b', 2)
+    assert backend.clear() == 2
+    assert len(backend) == 0
+
+
+def test_unreachable_redis_falls_back_to_memory(monkeypatch):
+    def fail():
+        raise ConnectionError('no redis here')
+    monkeypatch.setattr(m, 'get_redis_client', fail)
+    assert isinstance(m.create_cache('redis'), m.LRUCache)
+
+
+def test_unopenable_sqlite_file_falls_back_to_memory(monkeypatch):
+    monkeypatch.setattr(m, 'CACHE_DB_PATH', '/nonexistent/dir/cache.db')
+    assert isinstance(m.create_cache('sqlite'), m.LRUCache)
+
+
+def test_cache_errors_cost_a_miss_not_the_reply(monkeypatch):
+    class Broken(m.LRUCache):
+        def get(self, key, max_age=None):
+            raise ConnectionError('flaky')
+
+        def set(self, key, value, ttl=None):
+            raise ConnectionError('flaky')
+
+    monkeypatch.setattr(m, 'cache', Broken(10, 1000))
+    assert m.get_cached_data('movie:a') is None
+    m.set_cached_data('movie:a', 1)
+    assert m.cache.stats['errors'] == 2
+
+
+@pytest.mark.parametrize('answer, ttl', [
+    ({'Response': 'True', 'Title': 'Heat', 'imdbID': 'tt0113277', 'Type': 'movie'}, m.CACHE_TTLS['movie']),
+    ({'Response': 'False', 'Error': 'Movie not found!'}, m.NEGATIVE_CACHE_TTL),
+    ({'Response': 'False', 'Error': 'Daily API limit reached. Please try again tomorrow.'}, None),
+    ({'Response': 'False', 'Error': 'HTTP Error: 500'}, None),
+])
+def test_omdb_answers_are_cached_for_their_kind(monkeypatch, answer, ttl):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(m, 'cache', m.RedisCache(client, prefix='test:', ttls=m.CACHE_TTLS))
+    monkeypatch.setattr(m, 'title_index', {})
+    monkeypatch.setattr(m, 'title_norms', None)
+    calls = []
+    monkeypatch.setattr(m, 'invoke_rest_method', lambda url, params, priority='lookup': calls.append(params) or answer)
+    assert m.get_movie_data('  HEAT! ') == answer
+    if ttl is None:
+        assert client.exists('test:cache:movie:heat') == 0  # errors are retried, not remembered
+    else:
+        assert ttl - 5 < client.ttl('test:cache:movie:heat') <= ttl
+        # Typed differently, the title still hits the same entry
+        assert m.get_movie_data('heat') == answer
+        assert len(calls) == 1
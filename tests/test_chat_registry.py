@@ -0,0 +1,86 @@
+import fakeredis
+import pytest
+
+import movie_filter_bot as m
+
+
+@pytest.fixture
+def workers(monkeypatch, tmp_path):
+    """Switch the module between worker registries that share one Redis."""
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(m, 'CHAT_REGISTRY_BACKEND', 'redis')
+    monkeypatch.setattr(m, 'get_redis_client', lambda: client)
+    monkeypatch.setattr(m, 'RENDER_API_KEY', None)
+    monkeypatch.setenv('GROUP_IDS', '[]')
+    monkeypatch.setenv('CHANNEL_IDS', '[]')
+    names = ('known_chat_ids', 'pending_chat_changes', 'group_ids', 'channel_ids')
+    registries = {}
+    current = [None]
+
+    def become(name):
+        if current[0] is not None:
+            registries[current[0]] = {attr: getattr(m, attr) for attr in names}
+        current[0] = name
+        monkeypatch.setattr(m, 'CHAT_IDS_FILE', str(tmp_path / f'{name}.json'))
+        if name in registries:
+            for attr, value in registries[name].items():
+                monkeypatch.setattr(m, attr, value)
+        else:
+            for attr, value in (('known_chat_ids', set()), ('pending_chat_changes', []),
+                                ('group_ids', []), ('channel_ids', [])):
+                monkeypatch.setattr(m, attr, value)
+            m.load_ids()
+        return client
+
+    return become
+
+
+def test_flushes_from_two_workers_keep_each_others_chats(workers):
+    workers('a')
+    m.register_chat(-100, 'group')
+    workers('b')
+    m.register_chat(-200, 'supergroup')
+    m.register_chat(-300, 'channel')
+    m.flush_chat_ids()
+    workers('a')
+    m.flush_chat_ids()
+    assert m.tracked_chats() == ([-300], [-200, -100])
+
+
+def test_removal_reaches_the_other_workers(workers):
+    workers('a')
+    m.register_chat(-100, 'group')
+    m.register_chat(-200, 'group')
+    m.flush_chat_ids()
+    workers('b')
+    assert -100 in m.known_chat_ids  # loaded from Redis on start
+    m.unregister_chat(-100)
+    m.flush_chat_ids()
+    workers('a')
+    assert m.tracked_chats() == ([], [-200])
+
+
+def test_broadcast_starts_with_every_workers_chats(workers, monkeypatch):
+    monkeypatch.setattr(m, 'shared_state', m.MemoryState())
+    monkeypatch.setattr(m, 'broadcast_status', {})
+    monkeypatch.setattr(m, 'user_activity', m.UserActivityStore(':memory:'))
+    monkeypatch.setattr(m, 'run_broadcast', lambda token: None)
+    monkeypatch.setattr(m, 'save_broadcast_state', lambda: None)
+    workers('a')
+    m.register_chat(-100, 'group')
+    m.flush_chat_ids()
+    workers('b')
+    m.register_chat(-300, 'channel')  # not flushed yet
+    assert m.start_broadcast('hi', requested_by=1)
+    assert m.broadcast_status['chats'] == [-300, -100]
+
+
+def test_failed_redis_write_is_retried(workers, monkeypatch):
+    client = workers('a')
+    m.register_chat(-100, 'group')
+    monkeypatch.setattr(m, 'get_redis_client', lambda: (_ for _ in ()).throw(ConnectionError('down')))
+    m.flush_chat_ids()
+    assert m.pending_chat_changes == [('sadd', 'group_ids', -100)]
+    monkeypatch.setattr(m, 'get_redis_client', lambda: client)
+    m.flush_chat_ids()
+    assert client.smembers('movizinfo:group_ids') == {b'-100'}
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+
+import movie_filter_bot as m
+
+
+@pytest.mark.parametrize('text, command', [
+    ('/help', 'help'),
+    ('/help@MovizInfoBot', 'help'),
+    ('/HELP', 'help'),
+    ('/SearchMovie@MovizInfoBot Heat', 'searchmovie'),
+    ('/searchseason Dark 2', 'searchseason'),
+    ('/', None),
+    ('/@MovizInfoBot', None),
+    ('help', None),
+    ('', None),
+    (None, None),
+])
+def test_parse_command(text, command):
+    assert m.parse_command(text) == command
+
+
+def make_message(text, user_id=100):
+    return SimpleNamespace(text=text, message_id=1, from_user=SimpleNamespace(id=user_id),
+                           chat=SimpleNamespace(id=user_id, type='private'))
+
+
+@pytest.fixture
+def routed(monkeypatch):
+    """Replace every command and conversation step with one that records the call."""
+    calls = []
+    for name, (handler, developer_only) in list(m.COMMANDS.items()):
+        monkeypatch.setitem(m.COMMANDS, name, (lambda message, name=name: calls.append(name) or name, developer_only))
+    for name in list(m.CONVERSATION_STEPS):
+        monkeypatch.setitem(m.CONVERSATION_STEPS, name, lambda message, name=name, **data: calls.append((name, data)))
+    monkeypatch.setattr(m, 'shared_state', m.MemoryState())
+    monkeypatch.setattr(m, 'command_buckets', m.OrderedDict())
+    monkeypatch.setattr(m, 'user_activity', m.UserActivityStore(':memory:'))
+    monkeypatch.setattr(m, 'handle_new_message', lambda message: None)
+    monkeypatch.setattr(m, 'filter_messages', lambda message: False)
+    monkeypatch.setattr(m, 'check_search_flood', lambda message, query: None)
+    monkeypatch.setattr(m, 'finish_message', lambda message, response: None)
+    monkeypatch.setattr(m.bot, 'reply_to', lambda message, text: calls.append(('reply', text)))
+    return calls
+
+
+@pytest.mark.parametrize('text, user_id, expected', [
+    ('/help', 100, ['help']),
+    ('/help@MovizInfoBot', 100, ['help']),
+    ('/Recommend', 100, ['recommend']),
+    ('/searchmovie Heat', 100, ['searchmovie']),
+    ('/stats', 1, ['stats']),
+    ('/stats', 100, [('reply', 'Access denied. This command is for developers only.')]),
+    ('/nosuchcommand', 100, [('reply', 'Unknown command. Please use /help to see available commands.')]),
+])
+def test_commands_are_routed_through_the_table(routed, text, user_id, expected):
+    assert m.accept_message(make_message(text, user_id)) is None
+    assert routed == expected
+
+
+def test_plain_text_goes_to_search(routed):
+    assert m.accept_message(make_message('  The Dark Knight ')) == 'The Dark Knight'
+    assert routed == []
+
+
+@pytest.mark.parametrize('text', ['Movie', '/help'])
+def test_conversation_step_takes_the_message_before_command_routing(routed, text):
+    message = make_message(text)
+    m.start_conversation(message, 'recommend_media_type')
+    assert m.accept_message(message) is None
+    assert routed == [('recommend_media_type', {})]
+    # The step is used up; the next message is routed as usual
+    assert m.accept_message(make_message('/help')) is None
+    assert routed[-1] == 'help'
+
+
+def test_command_rate_limit_applies_to_everyone_but_the_developer(routed, monkeypatch):
+    monkeypatch.setattr(m, 'COMMAND_RATE_PER_MINUTE', 2)
+    for _ in range(3):
+        m.dispatch_command(make_message('/help', 100))
+        m.dispatch_command(make_message('/help', 1))
+    assert routed.count('help') == 5
+    assert routed[-2] == ('reply', "You're sending commands too quickly. Please wait a moment.")
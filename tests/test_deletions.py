@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+import movie_filter_bot as m
+
+
+@pytest.fixture
+def scheduler(monkeypatch, tmp_path, clock):
+    monkeypatch.setattr(m, 'deletion_heap', [])
+    monkeypatch.setattr(m, 'pending_deletions', {})
+    monkeypatch.setattr(m, 'deletions_dirty', False)
+    monkeypatch.setattr(m, 'DELETIONS_FILE', str(tmp_path / 'pending_deletions.json'))
+
+    def due_after(seconds):
+        clock[0] += seconds
+        with m.deletion_cond:
+            return dict(m.pop_due_deletions(m.time.time()))
+    return due_after
+
+
+def test_deletions_run_in_due_order_grouped_by_chat(scheduler):
+    m.schedule_deletion(1, 10, delay=30)
+    m.schedule_deletion(2, 20, delay=10)
+    m.schedule_deletion(1, 11, 12, delay=20)
+    m.schedule_deletion(2, 21, delay=20)
+    assert scheduler(5) == {}
+    assert scheduler(5) == {2: [20]}
+    assert scheduler(10) == {1: [11, 12], 2: [21]}
+    assert scheduler(100) == {1: [10]}
+    assert m.deletion_queue_depth() == 0
+
+
+def test_rescheduling_earlier_moves_the_deletion_and_runs_it_once(scheduler):
+    m.schedule_deletion(1, 10, delay=80)
+    m.schedule_deletion(1, 10, delay=20)
+    assert m.deletion_queue_depth() == 1
+    assert scheduler(20) == {1: [10]}
+    assert scheduler(100) == {}  # the stale 80 s entry is skipped
+
+
+def test_rescheduling_later_keeps_the_earlier_deletion(scheduler):
+    m.schedule_deletion(1, 10, delay=20)
+    m.schedule_deletion(1, 10, delay=80)
+    assert scheduler(20) == {1: [10]}
+    assert scheduler(100) == {}
+
+
+def test_pending_deletions_survive_a_restart(scheduler, monkeypatch):
+    m.schedule_deletion(1, 10, delay=20)
+    m.schedule_deletion(2, 20, delay=300)
+    m.save_pending_deletions()
+    with open(m.DELETIONS_FILE) as f:
+        assert sorted(json.load(f)) == [[1, 10, m.time.time() + 20], [2, 20, m.time.time() + 300]]
+    # Restart 60 s later: the overdue deletion runs at once, the other keeps its time
+    monkeypatch.setattr(m, 'deletion_heap', [])
+    monkeypatch.setattr(m, 'pending_deletions', {})
+    scheduler(60)
+    m.load_pending_deletions()
+    assert scheduler(0) == {1: [10]}
+    assert scheduler(200) == {}
+    assert scheduler(40) == {2: [20]}
+
+
+def test_pending_deletions_are_saved_at_exit():
+    assert (m.atexit.register, (m.save_pending_deletions,)) in m.startup_tasks
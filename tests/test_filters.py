@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+
+import movie_filter_bot as m
+
+
+@pytest.fixture
+def rules(monkeypatch):
+    monkeypatch.setattr(m, 'filter_rules', {'*': {'spam': False, 'ass': True}, '-5': {'promo': False}})
+    monkeypatch.setattr(m, 'filter_patterns', {})
+
+
+def test_substring_and_whole_word_rules(rules):
+    assert m.find_filtered_word('Buy SPAMMY stuff', -1) == 'SPAM'
+    assert m.find_filtered_word('what an ass', -1) == 'ass'
+    assert m.find_filtered_word('a classic film', -1) is None
+
+
+def test_chat_rules_only_apply_in_their_chat(rules):
+    assert m.find_filtered_word('big promo today', -5) == 'promo'
+    assert m.find_filtered_word('big promo today', -6) is None
+
+
+def test_filtered_message_is_removed_before_searching(rules, monkeypatch):
+    sent, deleted, searched = [], [], []
+    monkeypatch.setattr(m.bot, 'send_message', lambda chat_id, text, **kw: (sent.append(text), SimpleNamespace(message_id=2))[1])
+    monkeypatch.setattr(m.bot, 'delete_message', lambda chat_id, message_id: deleted.append(message_id))
+    monkeypatch.setattr(m, 'handle_search_movie_or_series', lambda message, query: searched.append(query))
+    monkeypatch.setattr(m, 'schedule_deletion', lambda *args, **kwargs: None)
+    monkeypatch.setattr(m, 'user_activity', m.UserActivityStore(':memory:'))
+    message = SimpleNamespace(chat=SimpleNamespace(id=-1, type='supergroup'), from_user=SimpleNamespace(id=7),
+                              text='free spam here', message_id=1)
+    m.handle_all_messages(message)
+    assert deleted == [1]
+    assert searched == []
+    assert "'spam'" in sent[0]
+
+
+def test_failed_save_keeps_the_previous_filter_file(rules, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(m, 'shared_state', m.MemoryState())
+    m.save_filtered_words()
+    m.filter_rules['*']['scam'] = False
+    dump = m.json.dump
+
+    def crash_mid_write(data, f, **kwargs):
+        f.write('{"*": {"sp')
+        raise OSError('disk full')
+    monkeypatch.setattr(m.json, 'dump', crash_mid_write)
+    m.save_filtered_words()
+    monkeypatch.setattr(m.json, 'dump', dump)
+    m.load_filtered_words()
+    assert m.filter_rules == {'*': {'spam': False, 'ass': True}, '-5': {'promo': False}}
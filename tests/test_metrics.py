@@ -0,0 +1,31 @@
+import pytest
+
+import movie_filter_bot as m
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(m, 'ensure_initialized', lambda: None)
+    monkeypatch.setattr(m, 'render_metrics', lambda: 'movizinfo_up 1\n')
+    return m.app.test_client()
+
+
+def test_metrics_are_disabled_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(m, 'METRICS_TOKEN', None)
+    monkeypatch.setattr(m, 'METRICS_PUBLIC', False)
+    assert client.get('/metrics').status_code == 404
+
+
+def test_metrics_can_be_made_public_explicitly(client, monkeypatch):
+    monkeypatch.setattr(m, 'METRICS_TOKEN', None)
+    monkeypatch.setattr(m, 'METRICS_PUBLIC', True)
+    assert client.get('/metrics').status_code == 200
+
+
+def test_metrics_require_the_token(client, monkeypatch):
+    monkeypatch.setattr(m, 'METRICS_TOKEN', 's3cret')
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer nope'}).status_code == 403
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert response.data == b'movizinfo_up 1\n'
@@ -0,0 +1,105 @@
+import fakeredis
+import pytest
+
+import movie_filter_bot as m
+
+
+def record_cache_writes(monkeypatch):
+    writes = {}
+    set_cached_data = m.set_cached_data
+
+    def record(key, data, ttl=None):
+        writes[key] = (data, ttl)
+        set_cached_data(key, data, ttl)
+    monkeypatch.setattr(m, 'set_cached_data', record)
+    return writes
+
+
+def test_recommendations_are_not_cached_for_a_day_when_the_quota_runs_out(omdb, monkeypatch):
+    writes = record_cache_writes(monkeypatch)
+    monkeypatch.setattr(m, 'API_REQUEST_COUNT', m.MAX_DAILY_REQUESTS - m.OMDB_RESERVED_FOR_LOOKUPS - 1)
+    assert m.get_recommendations('Heat', 'movie') == []
+    # The lookup got through, every genre search hit the recommendation limit
+    assert omdb == [('lookup', 'Heat')]
+    assert writes['recommendations:movie:heat'] == ({'partial': []}, m.NEGATIVE_CACHE_TTL)
+    assert not any(key.startswith('genre:') for key in writes)
+
+
+def test_failed_genre_search_marks_results_incomplete(omdb, monkeypatch):
+    def search_genre(genre, media_type, priority='recommendation'):
+        if genre == 'Crime':
+            raise m.requests.ConnectionError('reset')
+        return [f"{genre} title"]
+    monkeypatch.setattr(m, 'search_genre', search_genre)
+    titles, complete = m.search_genres(['Drama', 'Crime'], 'movie')
+    assert titles == ['Drama title']
+    assert not complete
+
+
+@pytest.fixture
+def quota(monkeypatch, tmp_path):
+    monkeypatch.setattr(m, 'shared_state', m.MemoryState())
+    monkeypatch.setattr(m, 'API_REQUEST_COUNT', 0)
+    monkeypatch.setattr(m, 'LAST_RESET_DATE', m.datetime.now().date())
+    monkeypatch.setattr(m, 'API_USAGE_FILE', str(tmp_path / 'api_usage.json'))
+    monkeypatch.setattr(m, 'api_counter_dirty', False)
+    monkeypatch.setattr(m, 'MAX_DAILY_REQUESTS', 10)
+    monkeypatch.setattr(m, 'OMDB_RESERVED_FOR_LOOKUPS', 4)
+    monkeypatch.setattr(m, 'warmup_call_limit', 0)
+    monkeypatch.setattr(m, 'warmup_calls_today', 0)
+    return tmp_path / 'api_usage.json'
+
+
+@pytest.mark.parametrize('count, lookup, recommendation', [
+    (0, True, True),
+    (5, True, True),
+    (6, True, False),  # the last 4 calls are kept for lookups
+    (9, True, False),
+    (10, False, False),
+])
+def test_lookups_keep_a_reserve(quota, monkeypatch, count, lookup, recommendation):
+    monkeypatch.setattr(m, 'API_REQUEST_COUNT', count)
+    assert m.check_api_limit('lookup') is lookup
+    assert m.check_api_limit('recommendation') is recommendation
+
+
+def test_warmup_stops_at_its_own_limit_and_the_reserve(quota, monkeypatch):
+    monkeypatch.setattr(m, 'warmup_call_limit', 2)
+    assert m.increment_api_counter('warmup')
+    assert m.increment_api_counter('warmup')
+    assert not m.increment_api_counter('warmup')
+    assert m.increment_api_counter('recommendation')
+    monkeypatch.setattr(m, 'warmup_call_limit', 100)
+    assert m.check_api_limit('warmup')
+    monkeypatch.setattr(m, 'API_REQUEST_COUNT', 6)
+    assert not m.check_api_limit('warmup')
+
+
+def test_shared_counter_spans_workers(quota, monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(m, 'shared_state', m.RedisState(client))
+    for _ in range(3):
+        assert m.increment_api_counter('recommendation')
+    # A second worker sharing the Redis sees the first one's calls
+    monkeypatch.setattr(m, 'shared_state', m.RedisState(client))
+    monkeypatch.setattr(m, 'API_REQUEST_COUNT', 0)
+    assert m.increment_api_counter('recommendation')
+    assert m.increment_api_counter('recommendation')
+    assert m.increment_api_counter('recommendation')
+    assert not m.increment_api_counter('recommendation')  # 6 used, the rest are reserved
+    assert m.increment_api_counter('lookup')
+    assert m.API_REQUEST_COUNT == 7
+    assert m.shared_state.get(m.api_counter_key()) == 7
+    m.save_api_counter()
+    assert not quota.exists()  # the shared counter is authoritative
+
+
+def test_counter_is_written_behind_not_per_call(quota, monkeypatch):
+    writes = []
+    monkeypatch.setattr(m, 'write_json_atomic', lambda path, data: writes.append(data))
+    for _ in range(5):
+        assert m.increment_api_counter()
+    assert writes == []
+    m.save_api_counter()
+    m.save_api_counter()
+    assert writes == [{'date': m.LAST_RESET_DATE.isoformat(), 'count': 5, 'warmup': 0}]
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+
+import movie_filter_bot as m
+
+HEAT = {'Response': 'True', 'Title': 'Heat', 'Year': '1995', 'Type': 'movie', 'imdbID': 'tt0113277', 'Genre': 'Crime'}
+
+
+@pytest.fixture
+def search(monkeypatch):
+    monkeypatch.setattr(m, 'cache', m.LRUCache(100, 10 ** 6, m.CACHE_TTLS))
+    m.set_cached_data('movie:heat', HEAT)
+    monkeypatch.setattr(m, 'get_movie_data', lambda name, priority='lookup': m.get_cached_data('movie:heat'))
+    monkeypatch.setattr(m, 'find_recommendations', lambda name, media_type: ([], True))
+    monkeypatch.setattr(m, 'record_title_request', lambda *args: None)
+    monkeypatch.setattr(m.bot, 'send_message', lambda **kwargs: SimpleNamespace(message_id=2, **kwargs))
+    message = SimpleNamespace(chat=SimpleNamespace(id=1), message_id=1)
+    return lambda: m.handle_search_title(message, 'heat', 'movie')
+
+
+def test_reply_is_cached_once_links_are_short(search, monkeypatch):
+    monkeypatch.setattr(m, 'shorten_urls', lambda urls: [f"https://short/{i}" for i in range(len(urls))])
+    assert 'https://short/0' in search().text
+    assert m.get_rendered_reply('reply:movie:heat')['title'] == 'Heat'
+
+
+def test_reply_with_long_fallback_links_is_not_cached(search, monkeypatch):
+    monkeypatch.setattr(m, 'shorten_urls', lambda urls: urls[:1] + [f"https://short/{i}" for i in range(1, len(urls))])
+    assert 'youtube.com' in search().text
+    assert m.get_rendered_reply('reply:movie:heat') is None
+
+
+def test_stale_reply_delete_errors_are_counted(search, monkeypatch):
+    m.set_rendered_reply('reply:movie:gone', 'movie:gone', 'Gone', 'text')
+
+    def delete(key):
+        raise ConnectionError('backend down')
+    monkeypatch.setattr(m.cache, 'delete', delete)
+    errors = m.cache.stats['errors']
+    assert m.get_rendered_reply('reply:movie:gone') is None
+    assert m.cache.stats['errors'] == errors + 1
+
+
+@pytest.mark.parametrize('total, prefetched', [('3', [2]), ('1', []), ('N/A', []), (None, [])])
+def test_season_reply_survives_any_total_seasons(monkeypatch, total, prefetched):
+    series = {'Response': 'True', 'Title': 'Dark', 'Year': '2017', 'imdbID': 'tt5753856'}
+    season = {'Response': 'True', 'Season': '1', 'totalSeasons': total, 'Episodes': []}
+    prefetches = []
+    monkeypatch.setattr(m, 'cache', m.LRUCache(100, 10 ** 6, m.CACHE_TTLS))
+    monkeypatch.setattr(m, 'get_series_data', lambda name, priority='lookup': series)
+    monkeypatch.setattr(m, 'get_season_data', lambda imdb_id, number, priority='lookup': season)
+    monkeypatch.setattr(m, 'prefetch_season', lambda series_data, number: prefetches.append(number))
+    monkeypatch.setattr(m, 'record_title_request', lambda *args: None)
+    monkeypatch.setattr(m, 'shorten_url', lambda url: url)
+    monkeypatch.setattr(m.bot, 'send_message', lambda chat_id, text, **kwargs: SimpleNamespace(text=text))
+    message = SimpleNamespace(chat=SimpleNamespace(id=1), message_id=1)
+    assert 'Dark' in m.handle_search_season(message, 'dark', '1').text
+    assert prefetches == prefetched
+
+
+def test_reply_with_partial_recommendations_is_not_cached(search, monkeypatch):
+    monkeypatch.setattr(m, 'shorten_urls', lambda urls: [f"https://short/{i}" for i in range(len(urls))])
+    monkeypatch.setattr(m, 'find_recommendations', lambda name, media_type: (['Ronin'], False))
+    assert 'Ronin' in search().text
+    assert m.get_rendered_reply('reply:movie:heat') is None
+
+
+def test_partial_recommendations_stay_partial_when_read_back(monkeypatch):
+    monkeypatch.setattr(m, 'cache', m.LRUCache(100, 10 ** 6, m.CACHE_TTLS))
+    assert m.add_genre_results('recommendations:movie:heat', [], ['Ronin'], False, ('Heat',)) == (['Ronin'], False)
+    assert m.find_recommendations('Heat', 'movie') == (['Ronin'], False)
+    assert m.get_recommendations('Heat', 'movie') == ['Ronin']
@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+
+import movie_filter_bot as m
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def backend(request, monkeypatch, clock):
+    if request.param == 'memory':
+        state = m.MemoryState()
+    else:
+        # Two workers see the same Redis, each with its own process-local limiter
+        state = m.RedisState(fakeredis.FakeRedis())
+    monkeypatch.setattr(m, 'shared_state', state)
+    for name in ('search_buckets', 'recent_searches', 'flood_notices'):
+        monkeypatch.setattr(m, name, m.OrderedDict())
+    monkeypatch.setattr(m, 'SEARCH_RATE_TIERS', {'default': 3, 'trusted': 10})
+    monkeypatch.setattr(m, 'SEARCH_CHAT_RATE_PER_MINUTE', 2)
+    return request.param
+
+
+def message(user_id, chat_id=None):
+    chat = SimpleNamespace(id=chat_id or user_id, type='group' if chat_id else 'private')
+    return SimpleNamespace(from_user=SimpleNamespace(id=user_id), chat=chat)
+
+
+def test_chat_limited_searches_do_not_spend_the_user_limit(backend):
+    assert m.check_search_flood(message(100, -5), 'alpha') is None
+    assert m.check_search_flood(message(101, -5), 'beta') is None
+    assert m.check_search_flood(message(100, -5), 'gamma') == 'chat_limited'
+    assert m.check_search_flood(message(100, -5), 'delta') == 'chat_limited'
+    # Two of user 100's three searches are left for their private chat
+    assert m.check_search_flood(message(100), 'epsilon') is None
+    assert m.check_search_flood(message(100), 'zeta') is None
+    assert m.check_search_flood(message(100), 'eta') == 'user_limited'
+
+
+def test_repeated_query_is_debounced(backend, clock):
+    assert m.check_search_flood(message(100), 'The Matrix') is None
+    assert m.check_search_flood(message(100), 'the matrix') == 'debounced'
+    clock[0] += m.SEARCH_DEBOUNCE_SECONDS + 1
+    if backend == 'memory':
+        m.recent_searches.clear()  # the memory debounce runs on the monotonic clock
+    assert m.check_search_flood(message(100), 'the matrix') is None
+
+
+def test_shared_backend_enforces_one_limit_across_workers(backend, clock):
+    if backend != 'redis':
+        pytest.skip('only a shared backend spans workers')
+    for query in ('a', 'b', 'c'):
+        assert m.check_search_flood(message(100), query) is None
+        # Another worker has its own in-process state but shares Redis
+        m.search_buckets.clear()
+        m.recent_searches.clear()
+    assert m.check_search_flood(message(100), 'd') == 'user_limited'
+    clock[0] += 60
+    assert m.check_search_flood(message(100), 'd') is None
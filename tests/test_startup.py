@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import movie_filter_bot as m
+from bench_startup import measure_startup
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_bot_snippet(code, tmp_path, **env):
+    """Import the bot in a fresh interpreter, run code and return its last output line."""
+    full_env = {key: value for key, value in os.environ.items()
+                if key not in ('UPDATE_WORKERS', 'LAZY_INIT', 'VERCEL', 'WARMUP_ON_START', 'ENVIRONMENT')}
+    full_env.update(BOT_TOKEN='123456:test', PYTHONPATH=REPO, **env)
+    result = subprocess.run([sys.executable, '-c', f"import movie_filter_bot as m\n{code}"], cwd=tmp_path,
+                            env=full_env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.strip().splitlines()[-1]
+
+
+def test_vercel_handles_updates_inline_and_lazily(tmp_path):
+    assert run_bot_snippet("print(m.UPDATE_WORKERS, m.LAZY_INIT)", tmp_path, VERCEL='1') == '0 True'
+
+
+def test_update_workers_default_elsewhere(tmp_path):
+    assert run_bot_snippet("print(m.UPDATE_WORKERS)", tmp_path, LAZY_INIT='1') == '4'
+
+
+@pytest.mark.parametrize('env, expected', [
+    ({}, 'True'),
+    ({'LAZY_INIT': '1'}, 'False'),
+    ({'ENVIRONMENT': 'production'}, 'False'),
+    ({'LAZY_INIT': '1', 'WARMUP_ON_START': '1'}, 'True'),
+])
+def test_warmup_on_start_is_off_where_processes_start_often(tmp_path, env, expected):
+    assert run_bot_snippet("print(m.WARMUP_ON_START)", tmp_path, **env) == expected
+
+
+# Budgets for a cold start in lazy mode; generous so slow CI machines pass,
+# tight enough to catch eager network calls or heavy work at import time
+IMPORT_BUDGET_SECONDS = 2.0
+MODULE_BUDGET_SECONDS = 0.1
+
+
+def test_lazy_import_stays_within_budget():
+    stats = measure_startup(lazy=True)
+    assert stats['total_import_seconds'] < IMPORT_BUDGET_SECONDS
+    assert stats['import_seconds'] < MODULE_BUDGET_SECONDS
+
+
+def test_failed_startup_task_is_retried_alone(monkeypatch):
+    calls = []
+
+    def flaky():
+        calls.append('flaky')
+        if calls.count('flaky') == 1:
+            raise OSError('not yet')
+    monkeypatch.setattr(m, 'startup_tasks', [])
+    monkeypatch.setattr(m, '_initialized', False)
+    monkeypatch.setattr(m, '_startup_done', 0)
+    m.on_startup(calls.append, 'first')
+    m.on_startup(flaky)
+    m.on_startup(calls.append, 'last')
+    with pytest.raises(OSError):
+        m.ensure_initialized()
+    m.ensure_initialized()
+    m.ensure_initialized()
+    assert calls == ['first', 'flaky', 'flaky', 'last']
@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+
+import pytest
+
+import movie_filter_bot as m
+
+
+@pytest.fixture
+def index(monkeypatch):
+    monkeypatch.setattr(m, 'title_index', {'tt1345836': ['The Dark Knight Rises', '2012', 'movie', 'Action', '', '']})
+    monkeypatch.setattr(m, 'title_norms', None)
+    monkeypatch.setattr(m, 'check_api_limit', lambda: True)
+    monkeypatch.setattr(m, 'record_search', lambda *args: None)
+    monkeypatch.setattr(m, 'PARALLEL_TITLE_LOOKUP', False)
+
+
+def search(monkeypatch, known):
+    looked_up = []
+
+    def handle_search_title(message, name, media_type):
+        looked_up.append((name, media_type))
+        return name if m.normalize_title(name) in known else None
+    monkeypatch.setattr(m, 'handle_search_title', handle_search_title)
+    monkeypatch.setattr(m.bot, 'reply_to', lambda message, text: SimpleNamespace(message_id=2, text=text))
+    monkeypatch.setattr(m, 'schedule_deletion', lambda *args, **kwargs: None)
+    return looked_up
+
+
+def test_prefix_of_indexed_title_is_looked_up_as_typed(index, monkeypatch):
+    looked_up = search(monkeypatch, {m.normalize_title('The Dark Knight')})
+    message = SimpleNamespace(chat=SimpleNamespace(id=1), message_id=1, text='the dark knight')
+    assert m.handle_search_movie_or_series(message, 'the dark knight') == 'the dark knight'
+    assert looked_up == [('the dark knight', 'movie')]
+
+
+def test_indexed_title_is_tried_when_omdb_has_no_exact_match(index, monkeypatch):
+    looked_up = search(monkeypatch, {m.normalize_title('The Dark Knight Rises')})
+    message = SimpleNamespace(chat=SimpleNamespace(id=1), message_id=1, text='the dark knight rise')
+    assert m.handle_search_movie_or_series(message, 'the dark knight rise') == 'The Dark Knight Rises'
+    assert looked_up[-1] == ('The Dark Knight Rises', 'movie')
+
+
+def test_exact_index_match_needs_one_lookup(index, monkeypatch):
+    looked_up = search(monkeypatch, {m.normalize_title('The Dark Knight Rises')})
+    message = SimpleNamespace(chat=SimpleNamespace(id=1), message_id=1, text='the dark knight rises')
+    assert m.handle_search_movie_or_series(message, 'the dark knight rises') == 'The Dark Knight Rises'
+    assert looked_up == [('The Dark Knight Rises', 'movie')]
+
+
+def test_index_recommendations_are_ranked_and_cached(monkeypatch):
+    entries = {f'tt{i}': [f'Title {i}', '2000', 'movie', 'Drama' if i % 2 else 'Comedy', 'Nolan' if i < 3 else '', '', str(i)]
+               for i in range(20)}
+    monkeypatch.setattr(m, 'title_index', entries)
+    monkeypatch.setattr(m, 'title_norms', None)
+    lookups = []
+    monkeypatch.setattr(m, 'get_movie_data', lambda title, priority='lookup': lookups.append(title) or
+                        {'Title': 'Memento', 'imdbID': 'tt0', 'Genre': 'Drama', 'Director': 'Nolan', 'Actors': ''})
+    monkeypatch.setattr(m, 'search_genres', lambda *args: pytest.fail('index was big enough'))
+    monkeypatch.setattr(m, 'cache', m.LRUCache(100, 10 ** 6, m.CACHE_TTLS))
+
+    expected = ['Title 1', 'Title 2', 'Title 19', 'Title 17', 'Title 15']
+    assert m.get_recommendations('Memento', 'movie') == expected
+    assert m.get_recommendations('Memento', 'movie') == expected
+    assert lookups == ['Memento']
+
+
+@pytest.mark.parametrize('count, speculative', [(0, [('recommendation', 'Heat')]), (None, [])])
+def test_parallel_series_lookup_stays_out_of_the_lookup_reserve(omdb, monkeypatch, count, speculative):
+    if count is None:
+        count = m.MAX_DAILY_REQUESTS - m.OMDB_RESERVED_FOR_LOOKUPS  # only the reserve is left
+    monkeypatch.setattr(m, 'API_REQUEST_COUNT', count)
+    monkeypatch.setattr(m, 'PARALLEL_TITLE_LOOKUP', True)
+    monkeypatch.setattr(m, 'title_index', {})
+    monkeypatch.setattr(m, 'record_search', lambda *args: None)
+    monkeypatch.setattr(m, 'handle_search_movie', lambda message, name: 'movie reply')
+    submitted = []
+    monkeypatch.setattr(m.lookup_executor, 'submit', lambda func, *args: submitted.append(args))
+    assert m.handle_search_movie_or_series(SimpleNamespace(), 'Heat') == 'movie reply'
+    assert [(priority, name) for name, priority in submitted] == speculative
+
+
+@pytest.mark.parametrize('typed, key', [
+    ('The Dark Knight', 'the dark knight'),
+    ('THE DARK KNIGHT', 'the dark knight'),
+    ('  the   dark\tknight\n', 'the dark knight'),
+    ('The Dark Knight!', 'the dark knight'),
+    ('Spider-Man: No Way Home', 'spider man no way home'),
+    ("Ocean's Eleven", 'ocean s eleven'),
+    ('Amélie', 'amelie'),
+    ('AMÉLIE ', 'amelie'),
+    ('Straße', 'strasse'),
+    ('...', ''),
+])
+def test_normalize_title(typed, key):
+    assert m.normalize_title(typed) == key
@@ -0,0 +1,132 @@
+"""The same searches through the threaded handlers and through ASYNC_UPDATES
+coroutines, against the local OMDb, shortener and Bot API stand-ins of loadtest.py."""
+import asyncio
+import threading
+import time
+
+import pytest
+import telebot
+from telebot import asyncio_helper
+
+import loadtest
+import movie_filter_bot as m
+
+
+class RecordingUpstreams(loadtest.FakeUpstreams):
+    def __init__(self, catalog):
+        super().__init__(catalog, latency={}, error_rate={})
+        self.sent = []
+
+    def telegram(self, method, params):
+        if method == 'sendMessage':
+            with self.lock:
+                self.sent.append((int(params['chat_id']), params['text']))
+        return super().telegram(method, params)
+
+
+@pytest.fixture(scope='module')
+def upstreams():
+    fake = RecordingUpstreams(loadtest.build_catalog(30))
+    fake.start()
+    yield fake
+    fake.server.shutdown()
+
+
+@pytest.fixture(scope='module')
+def event_loop_thread():
+    m.start_update_loop()
+    loop, client = m.update_loop, m.async_bot
+    yield loop, client
+    asyncio.run_coroutine_threadsafe(m.async_http_session.close(), loop).result(5)
+    asyncio.run_coroutine_threadsafe(client.close_session(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    m.update_loop = m.async_bot = m.async_http_session = None
+
+
+@pytest.fixture(params=['threaded', 'async'])
+def send(request, upstreams, monkeypatch):
+    monkeypatch.setattr(m, 'OMDB_API_URL', upstreams.url + '/omdb/')
+    monkeypatch.setattr(m, 'SHORTENER_API_URL', upstreams.url + '/shortener/api')
+    monkeypatch.setattr(telebot.apihelper, 'API_URL', upstreams.url + '/bot{0}/{1}')
+    monkeypatch.setattr(asyncio_helper, 'API_URL', upstreams.url + '/bot{0}/{1}')
+    monkeypatch.setattr(m, 'cache', m.LRUCache(1000, 10 ** 7, m.CACHE_TTLS))
+    monkeypatch.setattr(m, 'user_activity', m.UserActivityStore(':memory:'))
+    monkeypatch.setattr(m, 'title_index', {})
+    monkeypatch.setattr(m, 'title_norms', None)
+    monkeypatch.setattr(m, 'short_urls', {})
+    monkeypatch.setattr(m, 'API_REQUEST_COUNT', 0)
+    monkeypatch.setattr(m, 'check_search_flood', lambda message, query: None)
+    monkeypatch.setattr(m, 'schedule_deletion', lambda *args, **kwargs: None)
+    if request.param == 'async':
+        loop, client = request.getfixturevalue('event_loop_thread')
+        monkeypatch.setattr(m, 'update_loop', loop)
+        monkeypatch.setattr(m, 'async_bot', client)
+    else:
+        monkeypatch.setattr(m, 'async_bot', None)
+    update_ids = iter(range(1, 1 << 30))
+
+    def send_text(text, chat_id=42):
+        update = telebot.types.Update.de_json({
+            'update_id': next(update_ids),
+            'message': {'message_id': 1, 'date': int(time.time()), 'text': text,
+                        'chat': {'id': chat_id, 'type': 'private'},
+                        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Test'}},
+        })
+        with upstreams.lock:
+            upstreams.sent.clear()
+        if request.param == 'async':
+            asyncio.run_coroutine_threadsafe(m.process_update_async(update), loop).result(10)
+        else:
+            m.process_update(update)
+        with upstreams.lock:
+            return [text for chat, text in upstreams.sent if chat == chat_id]
+    send_text.mode = request.param
+    return send_text
+
+
+def test_movie_search_replies_with_details_links_and_recommendations(send, upstreams):
+    movie = next(item for item in upstreams.catalog if item['Type'] == 'movie')
+    replies = send(movie['Title'].lower())
+    assert len(replies) == 1
+    assert f"<b>Title</b>: {movie['Title']}" in replies[0]
+    assert 'https://short.example/' in replies[0]
+    assert '<b>Recommendations:</b>' in replies[0]
+    # The second search is answered from the rendered reply cache
+    calls = upstreams.calls['omdb']
+    assert send(movie['Title']) == replies
+    assert upstreams.calls['omdb'] == calls
+
+
+def test_season_search(send, upstreams):
+    series = next(item for item in upstreams.catalog if item['Type'] == 'series' and int(item['totalSeasons']) >= 2)
+    replies = send(f"{series['Title']} season 2")
+    assert len(replies) == 1
+    assert replies[0].startswith(f"<b>{series['Title']} - Season 2</b>")
+    assert 'Episode 8: Episode 8' in replies[0]
+
+
+def test_unknown_title(send):
+    replies = send('No Such Film Anywhere')
+    assert replies[-1] == "Sorry, I couldn't find any information about 'No Such Film Anywhere'."
+
+
+def test_commands_use_the_threaded_handlers(send):
+    replies = send('/help')
+    assert replies and replies[0].startswith('Here are the commands you can use')
+
+
+def test_concurrent_searches_share_one_lookup(send, upstreams, monkeypatch):
+    # Slow OMDb down so the searches really overlap
+    monkeypatch.setitem(upstreams.latency, 'omdb', 0.05)
+    movie = [item for item in upstreams.catalog if item['Type'] == 'movie'][1]
+    calls = upstreams.calls['omdb']
+    results = []
+    threads = [threading.Thread(target=lambda chat_id=chat_id: results.append(send(movie['Title'], chat_id)))
+               for chat_id in range(100, 120)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 20
+    # The movie lookup and one search per genre
+    assert upstreams.calls['omdb'] - calls == 1 + len(movie['Genre'].split(', '))
@@ -0,0 +1,50 @@
+import threading
+import time
+
+import movie_filter_bot as m
+
+
+def test_unwritable_database_falls_back_to_memory(monkeypatch, capsys):
+    monkeypatch.setattr(m, 'STATE_BACKEND', 'memory')
+    monkeypatch.setattr(m, 'USER_ACTIVITY_DB', '/nonexistent/users.db')
+    monkeypatch.setattr(m, 'user_activity', None)
+    m.init_user_activity()
+    m.user_activity.touch(5)
+    assert m.user_activity.total() == 1
+    assert 'Keeping it in memory' in capsys.readouterr().out
+
+
+def test_touch_while_flushing_loses_nothing():
+    store = m.UserActivityStore(':memory:')
+    stop = threading.Event()
+
+    def flusher():
+        while not stop.is_set():
+            store.flush()
+    thread = threading.Thread(target=flusher)
+    thread.start()
+    try:
+        for user_id in range(20000):
+            store.touch(user_id, when=1000)
+    finally:
+        stop.set()
+        thread.join()
+    assert store.total() == 20000
+
+
+def test_broadcast_checkpoints_done_while_a_batch_is_in_flight(monkeypatch):
+    saved = []
+    monkeypatch.setattr(m, 'user_activity', m.UserActivityStore(':memory:'))
+    monkeypatch.setattr(m, 'BROADCAST_WORKERS', 1)
+    monkeypatch.setattr(m, 'BROADCAST_CHECKPOINT_INTERVAL', 0.05)
+    monkeypatch.setattr(m, 'send_rate_limited', lambda chat_id, text: time.sleep(0.02) or 'sent')
+    monkeypatch.setattr(m, 'save_broadcast_state', lambda: saved.append(set(m.broadcast_status['done'])))
+    monkeypatch.setattr(m.bot, 'send_message', lambda *args, **kwargs: None)
+    monkeypatch.setattr(m, 'broadcast_status', {
+        'state': 'running', 'text': 'hi', 'requested_by': 1, 'chats': list(range(-1, -21, -1)),
+        'chats_next': 0, 'user_cursor': 0, 'total': 20, 'done': set(),
+    })
+    monkeypatch.setattr(m, 'shared_state', m.MemoryState())
+    m.run_broadcast(m.acquire_broadcast_lease())
+    assert m.broadcast_status['sent'] == 20
+    assert any(0 < len(done) < 20 for done in saved)
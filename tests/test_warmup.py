@@ -0,0 +1,71 @@
+import threading
+from types import SimpleNamespace
+
+import fakeredis
+import pytest
+
+import movie_filter_bot as m
+
+
+def test_warmup_budget_is_checked_for_every_call(omdb, monkeypatch):
+    monkeypatch.setattr(m, 'WARMUP_TITLES', ['Heat', 'Ronin', 'Collateral'])
+    status = m.run_warmup(budget=3)
+    assert status['api_calls'] == 3
+    assert len(omdb) == 3
+    assert {priority for priority, _ in omdb} == {'warmup'}
+
+
+def test_warmup_leaves_the_lookup_reserve_alone(omdb, monkeypatch):
+    monkeypatch.setattr(m, 'WARMUP_TITLES', ['Heat'])
+    monkeypatch.setattr(m, 'API_REQUEST_COUNT', m.MAX_DAILY_REQUESTS - m.OMDB_RESERVED_FOR_LOOKUPS)
+    assert m.run_warmup(budget=50)['api_calls'] == 0
+    assert omdb == []
+    assert m.get_movie_data('Heat')['Title'] == 'Heat'
+    assert omdb == [('lookup', 'Heat')]
+
+
+def test_warmup_budget_is_shared_by_the_runs_of_a_day(omdb, monkeypatch, tmp_path):
+    monkeypatch.setattr(m, 'WARMUP_TITLES', ['Heat', 'Ronin', 'Collateral'])
+    monkeypatch.setattr(m, 'WARMUP_QUOTA_BUDGET', 5)
+    monkeypatch.setattr(m, 'API_USAGE_FILE', str(tmp_path / 'api_usage.json'))
+    assert m.run_warmup(budget=3)['api_calls'] == 3
+    # A restart picks up the day's warm-up calls from the usage file
+    m.save_api_counter()
+    monkeypatch.setattr(m, 'warmup_calls_today', 0)
+    m.load_api_counter()
+    m.cache.clear()
+    assert m.run_warmup()['api_calls'] == 2
+    assert not m.check_api_limit('warmup')
+    assert m.check_api_limit('recommendation')
+
+
+def test_warmup_budget_is_shared_by_workers(omdb, monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(m, 'shared_state', m.RedisState(client))
+    monkeypatch.setattr(m, 'WARMUP_TITLES', ['Heat', 'Ronin', 'Collateral'])
+    monkeypatch.setattr(m, 'WARMUP_QUOTA_BUDGET', 5)
+    assert m.run_warmup(budget=3)['api_calls'] == 3
+    m.cache.clear()
+    monkeypatch.setattr(m, 'shared_state', m.RedisState(client))  # another worker
+    assert m.run_warmup()['api_calls'] == 2
+    assert m.shared_state.get(m.warmup_counter_key()) == 5
+
+
+def test_warmup_command_runs_in_the_background(monkeypatch):
+    started, finished, replies = threading.Event(), threading.Event(), []
+
+    def run_warmup():
+        started.set()
+        finished.wait(5)
+        return {'warmed': 1}
+    monkeypatch.setattr(m, 'run_warmup', run_warmup)
+    monkeypatch.setattr(m.bot, 'reply_to', lambda message, text: replies.append(text))
+    m.handle_warmup_command(SimpleNamespace(chat=SimpleNamespace(id=1)))
+    assert started.wait(5)
+    assert replies == ['Warming up caches...']
+    finished.set()
+    for _ in range(100):
+        if len(replies) == 2:
+            break
+        threading.Event().wait(0.05)
+    assert replies[1].startswith('Warm-up finished: 1 titles warmed')